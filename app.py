@@ -1,21 +1,83 @@
+import hashlib
+import hmac
+import mimetypes
 import os
+import random
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g, send_from_directory
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash, g,
+                   send_from_directory, send_file, jsonify, stream_with_context, abort, before_render_template,
+                   template_rendered, has_request_context, get_template_attribute, make_response)
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.exceptions import RequestEntityTooLarge
+from markupsafe import Markup, escape
+
+import compressao
+import consultas_lentas
+import expiracao
+import exportacao
+import fotos
+import fragmentos
+import lookups
+import metricas
+import notificacoes
+import perfis
+from filtros import expressao_fts, filtros_chamados
 
 # --- Configuração da Aplicação ---
 app = Flask(__name__)
 app.secret_key = 'sua-chave-secreta-super-aleatoria'
-app.instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+# CHAMADOS_INSTANCIA troca a pasta instance/ (banco padrão, uploads, métricas e consultas lentas), ex.: nos benchmarks
+app.instance_path = (os.environ.get('CHAMADOS_INSTANCIA')
+                     or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
 
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
-
-DATABASE = os.path.join(app.instance_path, 'chamados.db')
+# Intervalo (segundos) da expiração automática de chamados resolvidos; 0 desativa (use `database.py expirar`)
+app.config['EXPIRACAO_INTERVALO'] = int(os.environ.get('EXPIRACAO_INTERVALO', 600))
+# Quantidade de chamados por página em cada lista de /meus_chamados
+app.config['CHAMADOS_POR_PAGINA'] = int(os.environ.get('CHAMADOS_POR_PAGINA', 50))
+# O total de cada lista de /meus_chamados é contado só até esse número (acima dele a página mostra "N+")
+app.config['CHAMADOS_CONTAGEM_MAXIMA'] = int(os.environ.get('CHAMADOS_CONTAGEM_MAXIMA', 1000))
+# Máximo de equipamentos devolvidos pela busca do formulário de abertura de chamado
+app.config['EQUIPAMENTOS_POR_BUSCA'] = int(os.environ.get('EQUIPAMENTOS_POR_BUSCA', 20))
+# Na busca de /meus_chamados (q=), a relevância é calculada entre os N chamados mais recentes que atendem à busca
+app.config['BUSCA_CANDIDATOS'] = int(os.environ.get('BUSCA_CANDIDATOS', 2000))
+# Quantidade de usuários por página em /admin/
+app.config['USUARIOS_POR_PAGINA'] = int(os.environ.get('USUARIOS_POR_PAGINA', 50))
+# Intervalo (segundos) da entrega das notificações em fila; 0 desativa (use `database.py notificar`).
+# Servidor SMTP e webhook: ver notificacoes.py
+app.config['NOTIFICACOES_INTERVALO'] = int(os.environ.get('NOTIFICACOES_INTERVALO', 15))
+app.config['NOTIFICACOES'] = notificacoes.Configuracao.do_ambiente()
+# Validade (segundos) do perfil do usuário logado no cache em memória de cada worker (ver perfis.py)
+app.config['PERFIL_CACHE_TTL'] = int(os.environ.get('PERFIL_CACHE_TTL', 300))
+# Processos (por worker) que reduzem as fotos enviadas e geram as miniaturas
+app.config['FOTOS_PROCESSOS'] = int(os.environ.get('FOTOS_PROCESSOS', 2))
+# Entrega das fotos pelo servidor web em vez do gunicorn: com nginx, FOTOS_X_ACCEL_PREFIX é a location
+# `internal` que aponta para instance/uploads (ex.: /uploads-internos/); com Apache/lighttpd, USE_X_SENDFILE=1
+app.config['FOTOS_X_ACCEL_PREFIX'] = os.environ.get('FOTOS_X_ACCEL_PREFIX', '')
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+FOTOS_MAX_AGE = 365 * 24 * 3600
+# Consultas SQL que levam pelo menos esse tempo (ms) vão para instance/consultas_lentas.jsonl, com o plano de
+# execução (ver consultas_lentas.py e `database.py consultas`); 0 desativa
+app.config['CONSULTA_LENTA_MS'] = int(os.environ.get('CONSULTA_LENTA_MS', 200))
+# Linhas de /meus_chamados guardadas já renderizadas, por worker (ver fragmentos.py); 0 desativa o cache
+app.config['FRAGMENTOS_CAPACIDADE'] = int(os.environ.get('FRAGMENTOS_CAPACIDADE', fragmentos.CAPACIDADE))
+# Respostas de texto a partir desse tamanho (bytes) são comprimidas com gzip/brotli (ver compressao.py)
+app.config['COMPRESSAO_MINIMO'] = int(os.environ.get('COMPRESSAO_MINIMO', compressao.TAMANHO_MINIMO))
+# Máximo de chamados por XLSX baixado em /admin/exportar (o arquivo só começa a sair depois de montado); acima
+# disso, CSV em streaming ou `database.py exportar --formato xlsx`. 0 desativa o limite
+app.config['EXPORTACAO_XLSX_MAXIMO'] = int(os.environ.get('EXPORTACAO_XLSX_MAXIMO', 50000))
+# Token para o Prometheus ler /metrics sem sessão (cabeçalho `Authorization: Bearer <token>`); sem ele, só admins
+app.config['METRICAS_TOKEN'] = os.environ.get('METRICAS_TOKEN', '')
+
+# CHAMADOS_DB aponta para outro banco (ex.: o gerado por benchmarks/gerar_dados.py)
+DATABASE = os.environ.get('CHAMADOS_DB') or os.path.join(app.instance_path, 'chamados.db')
 UPLOAD_FOLDER = os.path.join(app.instance_path, 'uploads')
+METRICAS_FOLDER = os.path.join(app.instance_path, 'metricas')
+CONSULTAS_LENTAS_FILE = os.path.join(app.instance_path, consultas_lentas.ARQUIVO)
 DEFAULT_PASSWORD = '12345'
 
 os.makedirs(app.instance_path, exist_ok=True)
@@ -36,12 +98,105 @@ def handle_too_large_entity(e):
 
 
 # --- Funções de Banco de Dados ---
-def get_db():
-    db = sqlite3.connect(DATABASE)
+# Cada thread do worker (gunicorn) mantém uma conexão aberta e a reaproveita entre requisições.
+# Dentro de uma requisição, todas as chamadas a get_db() devolvem a mesma conexão, guardada em `g`.
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KIB = 20000
+
+_conexoes = threading.local()
+
+
+def _abrir_conexao():
+    # ConexaoMedida cronometra cada consulta (histogramas de /metrics e cabeçalho Server-Timing)
+    db = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT_MS / 1000, factory=metricas.ConexaoMedida)
     db.row_factory = sqlite3.Row
+    # WAL permite que leitores (/meus_chamados) não bloqueiem escritores (/submit_chamado) e vice-versa.
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    db.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KIB}')
+    db.execute('PRAGMA synchronous = NORMAL')
+    db.limite_lenta = app.config['CONSULTA_LENTA_MS'] / 1000
+    db.arquivo_lentas = CONSULTAS_LENTAS_FILE
     return db
 
 
+def _descartar_conexao():
+    db = getattr(_conexoes, 'db', None)
+    _conexoes.db = None
+    if db is not None:
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+
+
+def get_db():
+    """Retorna a conexão da requisição atual, reaproveitando a conexão da thread."""
+    if 'db' not in g:
+        db = getattr(_conexoes, 'db', None)
+        if db is None or _conexoes.caminho != DATABASE:
+            _descartar_conexao()
+            db = _abrir_conexao()
+            _conexoes.db = db
+            _conexoes.caminho = DATABASE
+        db.zerar_medicao(request.endpoint if has_request_context() else None)
+        g.db = db
+    return g.db
+
+
+# Com BEGIN IMMEDIATE o busy_timeout já espera pelo lock de escrita; se mesmo assim o banco continuar
+# ocupado, a transação inteira é repetida algumas vezes, com espera exponencial e aleatória entre elas
+DB_TENTATIVAS_OCUPADO = 4
+DB_ESPERA_OCUPADO_S = 0.05
+
+
+def _banco_ocupado(erro):
+    mensagem = str(erro)
+    return 'locked' in mensagem or 'busy' in mensagem
+
+
+def em_transacao(db, funcao, *args):
+    """Executa `funcao(db, *args)` numa transação BEGIN IMMEDIATE e faz o commit. Devolve o resultado da função.
+
+    Se o banco estiver ocupado (SQLITE_BUSY), a transação é desfeita e repetida; depois de
+    DB_TENTATIVAS_OCUPADO tentativas o sqlite3.OperationalError é propagado.
+    """
+    for tentativa in range(DB_TENTATIVAS_OCUPADO):
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                resultado = funcao(db, *args)
+                db.commit()
+                return resultado
+            except BaseException:
+                db.rollback()
+                raise
+        except sqlite3.OperationalError as e:
+            if not _banco_ocupado(e) or tentativa == DB_TENTATIVAS_OCUPADO - 1:
+                raise
+            time.sleep(DB_ESPERA_OCUPADO_S * 2 ** tentativa * random.uniform(0.5, 1.5))
+
+
+@app.teardown_appcontext
+def close_db(exception):
+    """Devolve a conexão da requisição para a thread, desfazendo qualquer transação pendente."""
+    db = g.pop('db', None)
+    if db is None:
+        return
+    try:
+        if db.in_transaction:
+            db.rollback()
+    except sqlite3.Error:
+        _descartar_conexao()
+
+
+def get_lookups():
+    """Status, tipos de problema e configurações em cache, lidos uma vez por requisição."""
+    if 'lookups' not in g:
+        g.lookups = lookups.obter(get_db())
+    return g.lookups
+
+
 # --- Decoradores de Segurança ---
 def login_required(f):
     @wraps(f)
@@ -65,16 +220,117 @@ def admin_required(f):
     return decorated_function
 
 
+# --- GET condicional ---
+# Identifica os templates e o código em execução: uma atualização da aplicação muda todas as ETags
+VERSAO_APLICACAO = hashlib.sha1(''.join(
+    f'{nome}:{os.path.getmtime(os.path.join(pasta, nome))}'
+    for pasta in (os.path.dirname(os.path.abspath(__file__)), os.path.join(app.root_path, 'templates'))
+    for nome in sorted(os.listdir(pasta)) if nome.endswith(('.py', '.html'))).encode()).hexdigest()[:12]
+
+
+def pagina_condicional(*nomes_versoes, depende_da_hora=False):
+    """Responde 304 Not Modified, sem chamar a view, quando nada do que a página mostra mudou.
+
+    A ETag (fraca) combina a rota, a query string, o usuário, a versão da aplicação e os contadores da tabela
+    `versoes` indicados em `nomes_versoes`, mantidos por triggers. Com `depende_da_hora`, muda também a cada
+    hora, para páginas com valores calculados a partir do horário atual (idade do chamado, prazo de
+    reabertura). Páginas com mensagens flash pendentes não são cacheadas.
+    """
+    marcadores = ', '.join('?' for _ in nomes_versoes)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if session.get('_flashes'):
+                return f(*args, **kwargs)
+            versoes = dict(get_db().execute(f'SELECT nome, valor FROM versoes WHERE nome IN ({marcadores})',
+                                            nomes_versoes).fetchall())
+            if len(versoes) < len(nomes_versoes):
+                # Banco sem a migração que cria o contador: sem ele, não há como saber se a página mudou
+                return f(*args, **kwargs)
+            partes = [request.endpoint, request.query_string.decode(), g.user['id'], VERSAO_APLICACAO,
+                      *(versoes[nome] for nome in nomes_versoes),
+                      datetime.now().strftime('%Y%m%d%H') if depende_da_hora else '']
+            etag = hashlib.sha1(repr(partes).encode()).hexdigest()[:20]
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # Navegador guarda a página, mas sempre confirma com o servidor; proxies não guardam
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+# --- Métricas ---
+# Registrada antes dos demais before_request, para que o tempo total inclua o carregamento do usuário
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.tempo_render = 0.0
+
+
+@before_render_template.connect_via(app)
+def iniciar_medicao_render(sender, template, context, **extra):
+    g.inicio_render = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def registrar_medicao_render(sender, template, context, **extra):
+    g.tempo_render += time.perf_counter() - g.inicio_render
+
+
+@app.after_request
+def registrar_metricas(response):
+    if 'inicio_requisicao' not in g:
+        return response
+    duracao = time.perf_counter() - g.inicio_requisicao
+    conexao = g.get('db')
+    endpoint = request.endpoint or 'sem_rota'
+    metricas.registrar_requisicao(endpoint, request.method, response.status_code, duracao, conexao, g.tempo_render)
+    response.headers['Server-Timing'] = metricas.server_timing(duracao, conexao, g.tempo_render)
+    metricas.gravar(METRICAS_FOLDER)
+    return response
+
+
+@app.after_request
+def comprimir_resposta(response):
+    return compressao.comprimir(response, request.accept_encodings, app.config['COMPRESSAO_MINIMO'])
+
+
 # --- Processador de Contexto ---
+@app.before_request
+def iniciar_tarefas_em_background():
+    expiracao.iniciar(_abrir_conexao, app.config['EXPIRACAO_INTERVALO'])
+    notificacoes.iniciar(_abrir_conexao, app.config['NOTIFICACOES_INTERVALO'], app.config['NOTIFICACOES'])
+    # Fotos que ficaram em uploads/pendentes (servidor parado ou worker caído antes de processá-las)
+    fotos.retomar_pendentes(UPLOAD_FOLDER, app.config['FOTOS_PROCESSOS'])
+
+
 @app.before_request
 def load_logged_in_user():
     user_id = session.get('user_id')
     if user_id is None:
         g.user = None
     else:
-        db = get_db()
-        g.user = db.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        db.close()
+        g.user = perfis.obter(get_db, user_id, app.config['PERFIL_CACHE_TTL'], session.get('versao_perfil', 0))
+        if g.user is None:
+            # Usuário removido: encerra a sessão em vez de deixar as rotas com g.user = None
+            session.clear()
+
+
+def perfil_alterado(db, user_id):
+    """Chamada depois de gravar uma alteração em users: descarta o perfil em cache neste worker e, se for o
+    próprio usuário logado, garante que as próximas requisições (em qualquer worker) já vejam a alteração."""
+    perfis.invalidar(user_id)
+    if user_id == session.get('user_id'):
+        session['versao_perfil'] = lookups.versao_atual(db, perfis.VERSAO_USUARIOS)
 
 
 @app.context_processor
@@ -82,6 +338,166 @@ def inject_user():
     return dict(user=g.user)
 
 
+# Marcadores que o snippet() do FTS5 insere em volta dos termos encontrados (char(2) e char(3) em
+# CHAMADOS_BUSCA_QUERY); trocados por <mark> só depois de escapar o texto, para que o conteúdo do chamado
+# nunca seja interpretado como HTML
+INICIO_DESTAQUE, FIM_DESTAQUE = '\x02', '\x03'
+
+
+@app.template_filter('destaque')
+def destaque_filter(trecho):
+    return Markup(str(escape(trecho)).replace(INICIO_DESTAQUE, '<mark>').replace(FIM_DESTAQUE, '</mark>'))
+
+
+@app.template_global()
+def linha_chamado(macro, chamado, destaque=None):
+    """HTML de uma linha de /meus_chamados (`macro` de linhas_chamados.html), do cache se a linha não mudou."""
+    def renderizar():
+        return get_template_attribute('linhas_chamados.html', macro)(chamado, destaque)
+
+    capacidade = app.config['FRAGMENTOS_CAPACIDADE']
+    if not capacidade:
+        return renderizar()
+    return fragmentos.obter((macro, tuple(chamado), destaque), renderizar, capacidade)
+
+
+# --- Consultas da listagem de chamados ---
+# A listagem traz só as colunas exibidas na linha da tabela; observações, foto, equipamento e histórico
+# vêm de /chamado/<id> (CHAMADO_DETALHE_QUERY) quando o painel de detalhes é aberto.
+# Data formatada, cor da borda (idade do chamado) e janela de reabertura são calculadas no próprio SELECT.
+# ?1 = agora, ?2 = prazo_vermelho, ?3 = prazo_amarelo, ?4 = prazo_reabrir; os `?` dos filtros vêm depois.
+CHAMADOS_LISTA_COLUNAS = """
+           c.id, c.timestamp, c.municipio, c.solicitante_email, c.status_id, c.tipo_problema_id,
+           c.admin_responsavel_id, c.resolvido_em,
+           COALESCE(strftime('%d/%m/%Y', c.timestamp), 'Data inválida') as data_abertura,
+           CASE
+               WHEN s.e_final THEN 'success'
+               WHEN julianday(c.timestamp) IS NULL THEN 'secondary'
+               WHEN CAST(julianday(?1) - julianday(date(c.timestamp)) AS INTEGER) > ?2 THEN 'danger'
+               WHEN CAST(julianday(?1) - julianday(date(c.timestamp)) AS INTEGER) > ?3 THEN 'warning'
+               ELSE 'success'
+           END as cor_borda,
+           COALESCE(s.permite_reabertura AND julianday(c.resolvido_em) + ?4 > julianday(?1), 0)
+               as reabertura_disponivel,
+           strftime('%d/%m/%Y às %H:%M', c.resolvido_em, '+' || ?4 || ' days') as expira_em,
+           s.nome as status_nome,
+           s.e_inicial as status_e_inicial, 
+           s.e_final as status_e_final,
+           s.permite_reabertura as status_permite_reabertura,
+           tp.nome as tipo_problema_nome,
+           u.responsavel as admin_responsavel_nome"""
+CHAMADOS_LISTA_JUNCOES = """
+    FROM chamados c
+    JOIN status s ON c.status_id = s.id
+    JOIN tipos_problema tp ON c.tipo_problema_id = tp.id
+    LEFT JOIN users u ON c.admin_responsavel_id = u.id
+"""
+CHAMADOS_LISTA_QUERY = f"SELECT {CHAMADOS_LISTA_COLUNAS}{CHAMADOS_LISTA_JUNCOES}"
+# Busca (q=): mesmas colunas mais o trecho encontrado, com os termos entre INICIO_DESTAQUE e FIM_DESTAQUE.
+# Os filtros precisam incluir a condição `f.chamados_fts MATCH ?`.
+CHAMADOS_BUSCA_QUERY = (f"SELECT {CHAMADOS_LISTA_COLUNAS},\n"
+                        f"           snippet(chamados_fts, -1, char(2), char(3), '…', 16) as destaque"
+                        f"{CHAMADOS_LISTA_JUNCOES}"
+                        f"    JOIN chamados_fts f ON f.rowid = c.id\n")
+CHAMADO_DETALHE_QUERY = """
+    SELECT c.id, c.solicitante_email, c.smartphone_imei, c.observacoes, c.foto, c.status_id,
+           s.e_final as status_e_final,
+           e.marca as equipamento_marca,
+           e.modelo as equipamento_modelo,
+           e.patrimonio as equipamento_patrimonio,
+           e.numeroDeSerie as equipamento_ns,
+           e.localdeUso as equipamento_local,
+           e.situacao as equipamento_situacao
+    FROM chamados c
+    JOIN status s ON c.status_id = s.id
+    LEFT JOIN equipamentos e ON c.smartphone_imei = e.imei1
+    WHERE c.id = ?
+"""
+# Contagem limitada: lê no máximo LIMIT linhas de um índice, em vez de todos os chamados que atendem à lista.
+# A junção com status só entra quando algum filtro usa `s.` (ex.: finalizados).
+CHAMADOS_LISTA_COUNT_QUERY = "SELECT COUNT(*) FROM (SELECT 1 FROM chamados c{juncao}{conditions} LIMIT ?)"
+
+
+def contar_chamados(db, conditions, params, maximo):
+    """Total da lista, contado até `maximo` + 1. Devolve (total, limitado): com `limitado`, total = maximo."""
+    juncao = " JOIN status s ON c.status_id = s.id" if " s." in conditions else ""
+    total, = db.execute(CHAMADOS_LISTA_COUNT_QUERY.format(juncao=juncao, conditions=conditions),
+                        [*params, maximo + 1]).fetchone()
+    return min(total, maximo), total > maximo
+
+
+def parametros_lista_chamados(cadastros, agora=None):
+    """Parâmetros ?1..?4 de CHAMADOS_LISTA_QUERY."""
+    return [(agora or datetime.now()).isoformat(' '), cadastros.prazo_vermelho, cadastros.prazo_amarelo,
+            cadastros.prazo_reabrir]
+
+
+# --- Busca de equipamentos (índice equipamentos_fts, migração 007) ---
+EQUIPAMENTOS_BUSCA_COLUNAS = "e.imei1, e.patrimonio, e.marca, e.modelo, e.numeroDeSerie, e.localdeUso, e.situacao"
+
+
+def buscar_equipamentos(db, municipio, termo, limite):
+    """Equipamentos do município cujo IMEI, nº de série, patrimônio, marca ou modelo começam com as
+    palavras digitadas. Sem termo, devolve os primeiros equipamentos do município."""
+    expressao = expressao_fts(termo)
+    if not expressao:
+        return db.execute(f'SELECT {EQUIPAMENTOS_BUSCA_COLUNAS} FROM equipamentos e WHERE e.municipio = ? '
+                          'ORDER BY e.id LIMIT ?', (municipio, limite)).fetchall()
+    return db.execute(f"""
+        SELECT {EQUIPAMENTOS_BUSCA_COLUNAS}
+        FROM equipamentos_fts f
+        JOIN equipamentos e ON e.id = f.rowid
+        WHERE equipamentos_fts MATCH ? AND e.municipio = ?
+        ORDER BY f.rank, e.id
+        LIMIT ?
+    """, (expressao, municipio, limite)).fetchall()
+
+
+# --- Histórico de chamados (tabela chamado_eventos) ---
+SEPARADOR_HISTORICO = "-" * 50 + "\n"
+
+
+EVENTO_INSERT = ('INSERT INTO chamado_eventos (chamado_id, tipo, timestamp, autor_id, autor_nome, e_solicitante, '
+                 'status_anterior_id, status_novo_id, texto) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def parametros_evento(chamado_id, tipo, texto=None, status_anterior_id=None, status_novo_id=None,
+                      e_solicitante=False):
+    """Parâmetros de EVENTO_INSERT para um evento do usuário logado."""
+    return (chamado_id, tipo, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), g.user['id'], g.user['responsavel'],
+            e_solicitante, status_anterior_id, status_novo_id, texto)
+
+
+def registrar_evento(db, chamado_id, tipo, texto=None, status_anterior_id=None, status_novo_id=None,
+                     e_solicitante=False):
+    """Acrescenta um evento (nota e/ou transição de status) ao histórico do chamado. Não faz commit."""
+    db.execute(EVENTO_INSERT, parametros_evento(chamado_id, tipo, texto, status_anterior_id, status_novo_id,
+                                                e_solicitante))
+
+
+def buscar_eventos(db, condicao, params):
+    return db.execute(f"""
+        SELECT ev.*, strftime('%d/%m/%Y %H:%M', ev.timestamp) as data,
+               sa.nome as status_anterior_nome, sn.nome as status_novo_nome
+        FROM chamado_eventos ev
+        LEFT JOIN status sa ON ev.status_anterior_id = sa.id
+        LEFT JOIN status sn ON ev.status_novo_id = sn.id
+        WHERE {condicao}
+        ORDER BY ev.id DESC
+    """, params).fetchall()
+
+
+def formatar_evento(evento):
+    """Texto de um evento no mesmo formato usado pelo antigo campo `solucao`."""
+    autor = (evento['autor_nome'] or 'Sistema') + (' (SOLICITANTE)' if evento['e_solicitante'] else '')
+    linhas = [f"[{evento['data']} - {autor}]:"]
+    if evento['status_novo_nome'] and evento['status_anterior_id'] != evento['status_novo_id']:
+        linhas.append(f"Status: {evento['status_anterior_nome'] or '-'} → {evento['status_novo_nome']}")
+    if evento['texto']:
+        linhas.append(evento['texto'])
+    return '\n'.join(linhas) + '\n'
+
+
 # --- Rotas da Aplicação Principal ---
 @app.route('/')
 @login_required
@@ -94,18 +510,17 @@ def index():
 
     db = get_db()
     kpis = {}
+    # kpi_solicitante_status é mantida por triggers em chamados (ver database.py, migração 005)
     query_kpis = """
-        SELECT s.nome, s.e_final, count(c.id) as count 
-        FROM status s 
-        LEFT JOIN chamados c ON s.id = c.status_id AND c.solicitante_email = ? 
-        GROUP BY s.id
+        SELECT s.nome, s.e_final, COALESCE(k.total, 0) as count
+        FROM status s
+        LEFT JOIN kpi_solicitante_status k ON k.status_id = s.id AND k.solicitante_email = ?
     """
     user_stats = db.execute(query_kpis, (g.user['email'],)).fetchall()
 
     kpis['abertos'] = sum(row['count'] for row in user_stats if not row['e_final'])
     kpis['finalizados'] = sum(row['count'] for row in user_stats if row['e_final'])
 
-    db.close()
     return render_template('user_dashboard.html', kpis=kpis)
 
 
@@ -115,14 +530,8 @@ def abrir_chamado():
     if g.user['is_admin']:
         return redirect(url_for('abrir_chamado_admin'))
 
-    db = get_db()
-    equipamentos = db.execute(
-        'SELECT * FROM equipamentos WHERE municipio = ?',
-        (g.user['municipio'],)
-    ).fetchall()
-    tipos_problema = db.execute('SELECT * FROM tipos_problema ORDER BY nome').fetchall()
-    db.close()
-    return render_template('chamado.html', equipamentos=equipamentos, tipos_problema=tipos_problema)
+    tipos_problema = get_lookups().tipos_problema
+    return render_template('chamado.html', tipos_problema=tipos_problema)
 
 
 @app.route('/abrir_chamado_admin')
@@ -132,29 +541,37 @@ def abrir_chamado_admin():
     db = get_db()
     municipio_selecionado = request.args.get('municipio', None)
     todos_municipios = [row['municipio'] for row in
-                        db.execute('SELECT DISTINCT municipio FROM equipamentos ORDER BY municipio').fetchall()]
-    tipos_problema = db.execute('SELECT * FROM tipos_problema ORDER BY nome').fetchall()
+                        db.execute('SELECT municipio FROM municipios ORDER BY municipio').fetchall()]
+    tipos_problema = get_lookups().tipos_problema
 
-    equipamentos = []
     responsavel_do_municipio = None
 
     if municipio_selecionado:
-        equipamentos = db.execute(
-            'SELECT * FROM equipamentos WHERE municipio = ?',
-            (municipio_selecionado,)
-        ).fetchall()
         responsavel_do_municipio = db.execute("SELECT * FROM users WHERE municipio = ? AND is_admin = 0 LIMIT 1",
                                               (municipio_selecionado,)).fetchone()
 
-    db.close()
     return render_template('chamado.html',
-                           equipamentos=equipamentos,
                            tipos_problema=tipos_problema,
                            todos_municipios=todos_municipios,
                            municipio_selecionado=municipio_selecionado,
                            responsavel_do_municipio=responsavel_do_municipio)
 
 
+@app.route('/equipamentos/busca')
+@login_required
+def busca_equipamentos():
+    """Busca de equipamentos (JSON) usada pelo formulário de abertura de chamado enquanto o usuário digita."""
+    # Usuário comum só enxerga os equipamentos do próprio município
+    municipio = request.args.get('municipio', '') if g.user['is_admin'] else g.user['municipio']
+    if not municipio:
+        return jsonify(equipamentos=[])
+
+    maximo = app.config['EQUIPAMENTOS_POR_BUSCA']
+    limite = max(1, min(request.args.get('limite', maximo, type=int), maximo))
+    equipamentos = buscar_equipamentos(get_db(), municipio, request.args.get('q', ''), limite + 1)
+    return jsonify(equipamentos=[dict(e) for e in equipamentos[:limite]], mais=len(equipamentos) > limite)
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -162,7 +579,6 @@ def login():
         password = request.form['password']
         db = get_db()
         user = db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-        db.close()
 
         is_password_correct = False
         if user:
@@ -172,6 +588,7 @@ def login():
         if is_password_correct:
             session.clear()
             session['user_id'] = user['id']
+            session['versao_perfil'] = lookups.versao_atual(db, perfis.VERSAO_USUARIOS)
 
             if user['must_reset_password'] == 1:
                 flash('Este é seu primeiro acesso ou sua senha foi redefinida. Por favor, crie uma nova senha.', 'info')
@@ -207,7 +624,7 @@ def redefinir_senha():
             db.execute('UPDATE users SET password = ?, must_reset_password = 0 WHERE id = ?',
                        (hashed_password, session['user_id']))
             db.commit()
-            db.close()
+            perfil_alterado(db, session['user_id'])
             flash('Senha redefinida com sucesso!', 'success')
             return redirect(url_for('index'))
     return render_template('redefinir_senha.html')
@@ -246,17 +663,16 @@ def submit_chamado():
     if 'foto' in request.files:
         foto_file = request.files['foto']
         if foto_file.filename != '':
-            _, extensao = os.path.splitext(foto_file.filename)
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
-            foto_filename = secure_filename(f"{timestamp}{extensao}")
-            foto_file.save(os.path.join(UPLOAD_FOLDER, foto_filename))
+            try:
+                foto_filename = fotos.receber(foto_file, UPLOAD_FOLDER, app.config['FOTOS_PROCESSOS'])
+            except fotos.FotoInvalida as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('abrir_chamado_admin') if g.user['is_admin'] else url_for('index'))
 
-    status_inicial_row = db.execute('SELECT id FROM status WHERE e_inicial = 1 LIMIT 1').fetchone()
-    if not status_inicial_row:
+    status_inicial_id = get_lookups().status_inicial_id
+    if not status_inicial_id:
         flash('Erro crítico: Nenhum status inicial configurado no sistema.', 'danger')
-        db.close()
         return redirect(url_for('index'))
-    status_inicial_id = status_inicial_row['id']
 
     db.execute(
         'INSERT INTO chamados (solicitante_email, municipio, smartphone_imei, tipo_problema_id, observacoes, status_id, foto) VALUES (?, ?, ?, ?, ?, ?, ?)',
@@ -264,7 +680,6 @@ def submit_chamado():
          foto_filename))
 
     db.commit()
-    db.close()
 
     flash('Chamado registrado com sucesso!', 'success')
     return redirect(url_for('meus_chamados'))
@@ -272,131 +687,128 @@ def submit_chamado():
 
 @app.route('/meus_chamados')
 @login_required
+@pagina_condicional(lookups.VERSAO_LOOKUPS, perfis.VERSAO_USUARIOS, 'chamados', depende_da_hora=True)
 def meus_chamados():
     erro_chamado_id = request.args.get('erro_chamado_id', type=int)
     db = get_db()
+    cadastros = get_lookups()
 
-    config_rows = db.execute("SELECT chave, valor FROM configuracoes").fetchall()
-    configs = {row['chave']: row['valor'] for row in config_rows}
-    prazo_reabrir = int(configs.get('prazo_reabrir', 3))
-    status_expirado_id = configs.get('status_expirado_id')
-
-    if status_expirado_id:
-        db.execute("""
-            UPDATE chamados 
-            SET status_id = :id_expirado
-            WHERE status_id IN (SELECT id FROM status WHERE permite_reabertura = 1) 
-            AND resolvido_em IS NOT NULL
-            AND date(resolvido_em, '+' || :prazo || ' days') <= date('now')
-        """, {"id_expirado": status_expirado_id, "prazo": prazo_reabrir})
-        db.commit()
-
-    status_options = db.execute('SELECT * FROM status ORDER BY nome').fetchall()
-    tipos_problema_options = db.execute('SELECT * FROM tipos_problema ORDER BY nome').fetchall()
+    status_options = cadastros.status
+    tipos_problema_options = cadastros.tipos_problema
 
     status_filter_id = request.args.get('status', default=None, type=int)
     municipio_filter = request.args.get('municipio', default=None, type=str)
     tipo_problema_filter_id = request.args.get('tipo_problema', default=None, type=int)
     status_group_filter = request.args.get('status_group', default=None, type=str)
+    termo_busca = request.args.get('q', default='', type=str).strip()
+    expressao_busca = expressao_fts(termo_busca)
 
     municipios_options = db.execute('SELECT DISTINCT municipio FROM chamados ORDER BY municipio').fetchall()
 
-    base_query = """
-        SELECT c.id, c.timestamp, c.municipio, c.solicitante_email, c.smartphone_imei, 
-               c.observacoes, c.foto, c.solucao, c.status_id, c.tipo_problema_id, c.admin_responsavel_id,
-               c.resolvido_em,
-               s.nome as status_nome,
-               s.e_inicial as status_e_inicial, 
-               s.e_final as status_e_final,
-               s.permite_reabertura as status_permite_reabertura,
-               tp.nome as tipo_problema_nome,
-               u.responsavel as admin_responsavel_nome,
-               e.marca as equipamento_marca,
-               e.modelo as equipamento_modelo,
-               e.patrimonio as equipamento_patrimonio,
-               e.numeroDeSerie as equipamento_ns,
-               e.localdeUso as equipamento_local,
-               e.situacao as equipamento_situacao
-        FROM chamados c
-        JOIN status s ON c.status_id = s.id
-        JOIN tipos_problema tp ON c.tipo_problema_id = tp.id
-        LEFT JOIN users u ON c.admin_responsavel_id = u.id
-        LEFT JOIN equipamentos e ON c.smartphone_imei = e.imei1
-    """
-
-    prazo_vermelho = int(configs.get('prazo_vermelho', 10))
-    prazo_amarelo = int(configs.get('prazo_amarelo', 5))
-
-    def processar_chamados(chamados_raw):
-        chamados_processados = []
-        for chamado in chamados_raw:
-            chamado_dict = dict(chamado)
-
-            try:
-                data_obj = datetime.strptime(chamado_dict['timestamp'].split('.')[0], '%Y-%m-%d %H:%M:%S')
-                chamado_dict['timestamp'] = data_obj.strftime('%d/%m/%Y')
-            except (ValueError, TypeError):
-                chamado_dict['timestamp'] = 'Data inválida'
-
-            chamado_dict['cor_borda'] = 'success'
-            if not chamado_dict['status_e_final']:
-                try:
-                    data_abertura = datetime.strptime(chamado_dict['timestamp'], '%d/%m/%Y')
-                    dias_aberto = (datetime.now() - data_abertura).days
-                    if dias_aberto > prazo_vermelho:
-                        chamado_dict['cor_borda'] = 'danger'
-                    elif dias_aberto > prazo_amarelo:
-                        chamado_dict['cor_borda'] = 'warning'
-                except (ValueError, TypeError):
-                    chamado_dict['cor_borda'] = 'secondary'
-
-            chamado_dict['reabertura_disponivel'] = False
-            if chamado_dict['status_permite_reabertura'] and chamado_dict['resolvido_em']:
-                try:
-                    data_resolvido = datetime.strptime(chamado_dict['resolvido_em'], '%Y-%m-%d %H:%M:%S.%f')
-                    data_expiracao = data_resolvido + timedelta(days=prazo_reabrir)
-                    if datetime.now() < data_expiracao:
-                        chamado_dict['reabertura_disponivel'] = True
-                        chamado_dict['expira_em'] = data_expiracao.strftime('%d/%m/%Y às %H:%M')
-                except (ValueError, TypeError):
-                    pass
-
-            chamados_processados.append(chamado_dict)
-        return chamados_processados
+    campos_params = parametros_lista_chamados(cadastros)
 
     def get_query_conditions_and_params(base_params, base_conditions_str=""):
-        params = list(base_params)
-        conditions = base_conditions_str
-        if status_filter_id:
-            conditions += " AND c.status_id = ?"
-            params.append(status_filter_id)
-        if municipio_filter:
-            conditions += " AND c.municipio = ?"
-            params.append(municipio_filter)
-        if tipo_problema_filter_id:
-            conditions += " AND c.tipo_problema_id = ?"
-            params.append(tipo_problema_filter_id)
-        if status_group_filter == 'finalizados':
-            conditions += " AND s.e_final = 1"
-        return conditions, params
+        conditions, params = filtros_chamados(status_filter_id, municipio_filter, tipo_problema_filter_id,
+                                              status_group_filter)
+        return base_conditions_str + conditions, [*base_params, *params]
+
+    def url_pagina(prefixo, direcao=None, chamado_id=None):
+        args = request.args.to_dict()
+        for chave in (f'{prefixo}antes', f'{prefixo}depois', 'erro_chamado_id'):
+            args.pop(chave, None)
+        if direcao:
+            args[f'{prefixo}{direcao}'] = chamado_id
+        return url_for('meus_chamados', **args)
+
+    def buscar_pagina(conditions, params, prefixo=''):
+        """Uma página da lista, paginada por cursor em (timestamp, id).
+
+        `?<prefixo>antes=<id>` traz os chamados mais antigos que o chamado <id> e `?<prefixo>depois=<id>`
+        os mais recentes, sem OFFSET: o custo não cresce com o número de páginas já percorridas.
+        Com busca (`q=`), traz os chamados mais relevantes, com os trechos encontrados em `destaques`.
+        """
+        por_pagina = app.config['CHAMADOS_POR_PAGINA']
+        if expressao_busca:
+            return buscar_pagina_relevancia(conditions, params, por_pagina)
+
+        antes = request.args.get(f'{prefixo}antes', type=int)
+        depois = request.args.get(f'{prefixo}depois', type=int)
+
+        cursor_condition, cursor_params = "", []
+        order = " ORDER BY c.timestamp DESC, c.id DESC"
+        if depois:
+            cursor_condition = " AND (c.timestamp, c.id) > (SELECT timestamp, id FROM chamados WHERE id = ?)"
+            cursor_params = [depois]
+            order = " ORDER BY c.timestamp ASC, c.id ASC"
+        elif antes:
+            cursor_condition = " AND (c.timestamp, c.id) < (SELECT timestamp, id FROM chamados WHERE id = ?)"
+            cursor_params = [antes]
+
+        rows = db.execute(CHAMADOS_LISTA_QUERY + conditions + cursor_condition + order + " LIMIT ?",
+                          [*campos_params, *params, *cursor_params, por_pagina + 1]).fetchall()
+        tem_mais = len(rows) > por_pagina
+        rows = rows[:por_pagina]
+        if depois:
+            rows.reverse()
+
+        ha_mais_recentes = tem_mais if depois else bool(antes)
+        ha_mais_antigos = True if depois else tem_mais
+        total, total_limitado = contar_chamados(db, conditions, params, app.config['CHAMADOS_CONTAGEM_MAXIMA'])
+        return {
+            'chamados': rows,
+            'total': total,
+            'total_limitado': total_limitado,
+            'url_mais_recentes': url_pagina(prefixo, 'depois', rows[0]['id']) if rows and ha_mais_recentes else None,
+            'url_mais_antigos': url_pagina(prefixo, 'antes', rows[-1]['id']) if rows and ha_mais_antigos else None,
+            'url_inicio': url_pagina(prefixo) if ha_mais_recentes else None,
+        }
+
+    def buscar_pagina_relevancia(conditions, params, por_pagina):
+        # Não há cursor estável para uma ordenação por relevância: a busca mostra só os mais relevantes.
+        # Calcular o bm25 de todos os chamados que contêm um termo comum custa segundos numa base grande;
+        # por isso só os BUSCA_CANDIDATOS mais recentes (maiores rowid, lidos direto do índice) são ordenados.
+        # Com IN (em vez de junção) o SQLite pode partir do índice dos filtros quando eles são seletivos.
+        candidatos = app.config['BUSCA_CANDIDATOS']
+        menor_id, total = db.execute(
+            "SELECT MIN(id), COUNT(*) FROM (SELECT c.id FROM chamados c JOIN status s ON c.status_id = s.id" +
+            conditions + " AND c.id IN (SELECT rowid FROM chamados_fts WHERE chamados_fts MATCH ?)"
+            " ORDER BY c.id DESC LIMIT ?)", [*params, expressao_busca, candidatos]).fetchone()
+        rows = []
+        if total:
+            rows = db.execute(CHAMADOS_BUSCA_QUERY + conditions +
+                              " AND f.chamados_fts MATCH ? AND f.rowid >= ? ORDER BY f.rank, c.id DESC LIMIT ?",
+                              [*campos_params, *params, expressao_busca, menor_id, por_pagina]).fetchall()
+        return {
+            'chamados': rows,
+            'destaques': {row['id']: row['destaque'] for row in rows},
+            'total': total,
+            'total_limitado': total >= candidatos,
+            'url_mais_recentes': None,
+            'url_mais_antigos': None,
+            'url_inicio': None,
+        }
 
     if g.user['is_admin']:
         atribuidos_conditions, atribuidos_params = get_query_conditions_and_params(
             (g.user['id'],), " WHERE c.admin_responsavel_id = ?"
         )
-        query_atribuidos = base_query + atribuidos_conditions + " ORDER BY c.timestamp DESC"
-        chamados_atribuidos_raw = db.execute(query_atribuidos, atribuidos_params).fetchall()
+        pagina_atribuidos = buscar_pagina(atribuidos_conditions, atribuidos_params, 'atribuidos_')
 
         outros_conditions, outros_params = get_query_conditions_and_params(
             (g.user['id'],), " WHERE (c.admin_responsavel_id IS NULL OR c.admin_responsavel_id != ?)"
         )
-        query_outros = base_query + outros_conditions + " ORDER BY c.timestamp DESC"
-        outros_chamados_raw = db.execute(query_outros, outros_params).fetchall()
+        pagina_outros = buscar_pagina(outros_conditions, outros_params, 'outros_')
 
-        db.close()
         return render_template('meus_chamados.html',
-                               chamados_atribuidos=processar_chamados(chamados_atribuidos_raw),
-                               outros_chamados=processar_chamados(outros_chamados_raw),
+                               chamados_atribuidos=pagina_atribuidos['chamados'],
+                               paginacao_atribuidos=pagina_atribuidos,
+                               outros_chamados=pagina_outros['chamados'],
+                               paginacao_outros=pagina_outros,
+                               admins_options=db.execute(
+                                   'SELECT id, responsavel FROM users WHERE is_admin = 1 ORDER BY responsavel').fetchall(),
+                               destaques={**pagina_atribuidos.get('destaques', {}),
+                                          **pagina_outros.get('destaques', {})},
+                               termo_busca=termo_busca,
                                status_options=status_options,
                                tipos_problema_options=tipos_problema_options,
                                status_filter_id=status_filter_id,
@@ -407,12 +819,13 @@ def meus_chamados():
         user_conditions, user_params = get_query_conditions_and_params(
             (g.user['email'],), " WHERE c.solicitante_email = ?"
         )
-        query = base_query + user_conditions + " ORDER BY c.timestamp DESC"
-        todos_chamados_raw = db.execute(query, user_params).fetchall()
+        pagina = buscar_pagina(user_conditions, user_params)
 
-        db.close()
         return render_template('meus_chamados.html',
-                               chamados=processar_chamados(todos_chamados_raw),
+                               chamados=pagina['chamados'],
+                               paginacao=pagina,
+                               destaques=pagina.get('destaques', {}),
+                               termo_busca=termo_busca,
                                status_options=status_options,
                                tipos_problema_options=tipos_problema_options,
                                status_filter_id=status_filter_id,
@@ -421,10 +834,64 @@ def meus_chamados():
                                erro_chamado_id=erro_chamado_id)
 
 
-@app.route('/uploads/<path:filename>')
+@app.route('/uploads/<filename>')
 @login_required
 def display_image(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    # O nome da foto é o hash do conteúdo e o arquivo nunca é regravado: o navegador pode guardá-lo para
+    # sempre, e o ETag (o próprio nome) responde 304 às revalidações
+    etag = os.path.splitext(filename)[0]
+    if not os.path.isfile(os.path.join(UPLOAD_FOLDER, filename)):
+        pendente = fotos.caminho_pendente(UPLOAD_FOLDER, filename)
+        if pendente:
+            # Ainda no pool (ou à espera de `retomar_pendentes`): serve o original, sem cache, até ficar pronta
+            resposta = send_file(pendente, max_age=0)
+            resposta.cache_control.no_store = True
+            return resposta
+    prefixo = app.config['FOTOS_X_ACCEL_PREFIX']
+    if prefixo:
+        if not safe_join(UPLOAD_FOLDER, filename):
+            abort(404)
+        resposta = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        resposta.headers['X-Accel-Redirect'] = prefixo + filename
+        resposta.set_etag(etag)
+        resposta = resposta.make_conditional(request)
+    else:
+        resposta = send_from_directory(UPLOAD_FOLDER, filename, etag=etag, max_age=FOTOS_MAX_AGE)
+    # As fotos exigem login: só o navegador guarda, nunca um cache compartilhado
+    resposta.cache_control.public = None
+    resposta.cache_control.private = True
+    resposta.cache_control.max_age = FOTOS_MAX_AGE
+    resposta.cache_control.immutable = True
+    return resposta
+
+
+def url_miniatura(foto):
+    # Fotos antigas, ou ainda em processamento, podem não ter miniatura: usa a própria foto
+    miniatura = fotos.nome_miniatura(foto)
+    if os.path.exists(os.path.join(UPLOAD_FOLDER, miniatura)):
+        return url_for('display_image', filename=miniatura)
+    return url_for('display_image', filename=foto)
+
+
+@app.route('/chamado/<int:chamado_id>')
+@login_required
+def detalhe_chamado(chamado_id):
+    """Detalhes de um chamado (observações, foto, equipamento e histórico), buscados pela página de
+    listagem quando o painel do chamado é aberto."""
+    db = get_db()
+    chamado = db.execute(CHAMADO_DETALHE_QUERY, (chamado_id,)).fetchone()
+    if not chamado or (not g.user['is_admin'] and chamado['solicitante_email'] != g.user['email']):
+        return jsonify(erro='Chamado não encontrado.'), 404
+
+    eventos = buscar_eventos(db, 'ev.chamado_id = ?', (chamado_id,))
+    textos = [formatar_evento(evento) for evento in eventos]
+    return jsonify(dict(
+        chamado,
+        foto_url=url_for('display_image', filename=chamado['foto']) if chamado['foto'] else None,
+        miniatura_url=url_miniatura(chamado['foto']) if chamado['foto'] else None,
+        eventos=[dict(evento, texto_formatado=texto) for evento, texto in zip(eventos, textos)],
+        historico=''.join(texto + SEPARADOR_HISTORICO for texto in textos),
+    ))
 
 
 @app.route('/chamado/update/<int:chamado_id>', methods=['POST'])
@@ -435,13 +902,11 @@ def update_chamado(chamado_id):
 
     if not g.user['is_admin']:
         flash('Você não tem permissão para alterar este chamado.', 'danger')
-        db.close()
         return redirect(url_for('meus_chamados'))
 
-    chamado_info = db.execute("SELECT solucao, status_id FROM chamados WHERE id = ?", (chamado_id,)).fetchone()
+    chamado_info = db.execute("SELECT status_id FROM chamados WHERE id = ?", (chamado_id,)).fetchone()
     if not chamado_info:
         flash('Chamado não encontrado.', 'danger')
-        db.close()
         return redirect(url_for('meus_chamados'))
 
     novo_status_id = request.form.get('status')
@@ -451,19 +916,15 @@ def update_chamado(chamado_id):
     if str(original_status_id) != novo_status_id and not nova_adicao_solucao:
         flash('Ao alterar o status de um chamado, é obrigatório adicionar uma nota no campo "Adicionar Nova Solução".',
               'danger')
-        db.close()
         return redirect(url_for('meus_chamados', erro_chamado_id=chamado_id))
 
-    solucao_final = chamado_info['solucao'] or ''
-    if nova_adicao_solucao:
-        timestamp_atual = datetime.now().strftime("%d/%m/%Y %H:%M")
-        autor = g.user['responsavel']
-        nova_entrada = f"[{timestamp_atual} - {autor}]:\n{nova_adicao_solucao}\n"
-        separador = "-" * 50 + "\n"
-        solucao_final = nova_entrada + separador + solucao_final
+    novo_status_info = get_lookups().status_info(novo_status_id)
+    status_mudou = str(original_status_id) != novo_status_id
 
-    novo_status_info = db.execute("SELECT e_inicial, permite_reabertura FROM status WHERE id = ?",
-                                  (novo_status_id,)).fetchone()
+    if nova_adicao_solucao or status_mudou:
+        registrar_evento(db, chamado_id, 'status' if status_mudou else 'nota', texto=nova_adicao_solucao or None,
+                         status_anterior_id=original_status_id if status_mudou else None,
+                         status_novo_id=novo_status_info['id'] if status_mudou and novo_status_info else None)
 
     timestamp_resolvido = None
     if novo_status_info and novo_status_info['permite_reabertura']:
@@ -471,19 +932,18 @@ def update_chamado(chamado_id):
 
     if novo_status_info and novo_status_info['e_inicial']:
         db.execute(
-            'UPDATE chamados SET status_id = ?, solucao = ?, resolvido_em = NULL, admin_responsavel_id = NULL WHERE id = ?',
-            (novo_status_id, solucao_final, chamado_id)
+            'UPDATE chamados SET status_id = ?, resolvido_em = NULL, admin_responsavel_id = NULL WHERE id = ?',
+            (novo_status_id, chamado_id)
         )
         flash(f'Chamado #{chamado_id} foi reaberto e devolvido para a fila de captura.', 'info')
     else:
         db.execute(
-            'UPDATE chamados SET status_id = ?, solucao = ?, resolvido_em = ? WHERE id = ?',
-            (novo_status_id, solucao_final, timestamp_resolvido, chamado_id)
+            'UPDATE chamados SET status_id = ?, resolvido_em = ? WHERE id = ?',
+            (novo_status_id, timestamp_resolvido, chamado_id)
         )
         flash(f'Chamado #{chamado_id} atualizado com sucesso!', 'success')
 
     db.commit()
-    db.close()
     return redirect(url_for('meus_chamados'))
 
 
@@ -492,48 +952,39 @@ def update_chamado(chamado_id):
 def reabrir_chamado(chamado_id):
     db = get_db()
     chamado = db.execute(
-        "SELECT c.*, s.permite_reabertura FROM chamados c JOIN status s ON c.status_id = s.id WHERE c.id = ?",
+        "SELECT c.id, c.solicitante_email, c.status_id, c.resolvido_em, s.permite_reabertura "
+        "FROM chamados c JOIN status s ON c.status_id = s.id WHERE c.id = ?",
         (chamado_id,)).fetchone()
 
     if not chamado or chamado['solicitante_email'] != g.user['email']:
         flash("Você não tem permissão para reabrir este chamado.", "danger")
-        db.close()
         return redirect(url_for('meus_chamados'))
 
     if not chamado['permite_reabertura']:
         flash("Este chamado não pode ser reaberto a partir do seu status atual.", "warning")
-        db.close()
         return redirect(url_for('meus_chamados'))
 
-    configs = {row['chave']: row['valor'] for row in db.execute("SELECT chave, valor FROM configuracoes").fetchall()}
-    prazo_reabrir = int(configs.get('prazo_reabrir', 3))
-    status_expirado_id = configs.get('status_expirado_id')
-    status_inicial_id = db.execute("SELECT id FROM status WHERE e_inicial = 1 LIMIT 1").fetchone()['id']
+    cadastros = get_lookups()
+    prazo_reabrir = cadastros.prazo_reabrir
+    status_inicial_id = cadastros.status_inicial_id
 
     data_resolvido = datetime.strptime(chamado['resolvido_em'], '%Y-%m-%d %H:%M:%S.%f')
     data_expiracao = data_resolvido + timedelta(days=prazo_reabrir)
 
     if datetime.now() > data_expiracao:
+        # O chamado será movido para o status de expirado pela tarefa de expiração (expiracao.py)
         flash("O prazo para reabertura deste chamado já expirou.", "danger")
-        if status_expirado_id:
-            db.execute("UPDATE chamados SET status_id = ? WHERE id = ?", (status_expirado_id, chamado_id))
-            db.commit()
     else:
-        solucao_antiga = chamado['solucao'] or ''
-        timestamp_atual = datetime.now().strftime("%d/%m/%Y %H:%M")
-        autor = g.user['responsavel']
-        nova_entrada = f"[{timestamp_atual} - {autor} (SOLICITANTE)]:\nCHAMADO REABERTO PELO USUÁRIO.\n"
-        separador = "-" * 50 + "\n"
-        solucao_final = nova_entrada + separador + solucao_antiga
-
+        registrar_evento(db, chamado_id, 'reabertura', texto='CHAMADO REABERTO PELO USUÁRIO.',
+                         status_anterior_id=chamado['status_id'], status_novo_id=status_inicial_id,
+                         e_solicitante=True)
         db.execute(
-            "UPDATE chamados SET status_id = ?, resolvido_em = NULL, solucao = ?, admin_responsavel_id = NULL WHERE id = ?",
-            (status_inicial_id, solucao_final, chamado_id)
+            "UPDATE chamados SET status_id = ?, resolvido_em = NULL, admin_responsavel_id = NULL WHERE id = ?",
+            (status_inicial_id, chamado_id)
         )
         db.commit()
         flash(f"Chamado #{chamado_id} foi reaberto com sucesso!", "success")
 
-    db.close()
     return redirect(url_for('meus_chamados'))
 
 
@@ -541,33 +992,169 @@ def reabrir_chamado(chamado_id):
 @login_required
 @admin_required
 def capturar_chamado(chamado_id):
-    db = get_db()
-    chamado_atual = db.execute(
-        "SELECT c.id FROM chamados c JOIN status s ON c.status_id = s.id WHERE c.id = ? AND s.e_inicial = 1",
-        (chamado_id,)).fetchone()
-    if not chamado_atual:
-        flash('Este chamado não está mais no status inicial e não pode ser capturado.', 'danger')
-        db.close()
-        return redirect(url_for('meus_chamados'))
-
-    configs = {row['chave']: row['valor'] for row in db.execute("SELECT chave, valor FROM configuracoes").fetchall()}
-    status_capturado_id = configs.get('status_capturado_id')
+    cadastros = get_lookups()
+    status_capturado_id = cadastros.status_capturado_id
 
     if not status_capturado_id:
         flash('Erro crítico: Nenhum status de "capturado" configurado no sistema.', 'danger')
-        db.close()
         return redirect(url_for('meus_chamados'))
 
-    db.execute(
-        'UPDATE chamados SET admin_responsavel_id = ?, status_id = ? WHERE id = ?',
-        (g.user['id'], status_capturado_id, chamado_id)
-    )
-    db.commit()
-    db.close()
+    try:
+        capturado = em_transacao(get_db(), capturar, chamado_id, cadastros, status_capturado_id)
+    except sqlite3.OperationalError as e:
+        if not _banco_ocupado(e):
+            raise
+        flash('O sistema está ocupado no momento. Tente capturar o chamado novamente.', 'warning')
+        return redirect(url_for('meus_chamados'))
+
+    if not capturado:
+        flash('Este chamado não está mais no status inicial e não pode ser capturado.', 'danger')
+        return redirect(url_for('meus_chamados'))
     flash(f'Chamado #{chamado_id} capturado com sucesso!', 'success')
     return redirect(url_for('meus_chamados'))
 
 
+def capturar(db, chamado_id, cadastros, status_capturado_id):
+    """Atribui o chamado ao admin logado, se ele ainda estiver num status inicial. Devolve True se capturou.
+
+    A condição de status faz parte do próprio UPDATE: quando dois admins capturam ao mesmo tempo, só o
+    primeiro altera a linha e o segundo recebe rowcount 0 (antes, o SELECT seguido de UPDATE deixava os
+    dois "capturarem" e o último sobrescrevia o primeiro).
+    """
+    for status in cadastros.status:
+        if not status['e_inicial']:
+            continue
+        cursor = db.execute(
+            'UPDATE chamados SET admin_responsavel_id = ?, status_id = ? WHERE id = ? AND status_id = ?',
+            (g.user['id'], status_capturado_id, chamado_id, status['id']))
+        if cursor.rowcount == 1:
+            registrar_evento(db, chamado_id, 'captura', status_anterior_id=status['id'],
+                             status_novo_id=status_capturado_id)
+            return True
+    return False
+
+
+# --- Ações em lote ---
+ACOES_EM_LOTE = ('capturar', 'status', 'atribuir')
+CHAMADOS_POR_ACAO_EM_LOTE = 500
+
+
+@app.route('/chamados/lote', methods=['POST'])
+@login_required
+@admin_required
+def acao_em_lote():
+    """Captura, muda o status (com uma nota comum) ou reatribui vários chamados de uma vez.
+
+    Tudo é gravado numa única transação. Devolve JSON com o resultado de cada chamado: os que não podem
+    receber a ação (já capturados, ainda na fila para atribuir, já atribuídos ao admin escolhido, inexistentes)
+    são listados com o motivo, sem impedir os demais.
+    """
+    acao = request.form.get('acao')
+    ids = sorted(set(request.form.getlist('ids', type=int)))
+    nota = request.form.get('nota', '').strip()
+    if acao not in ACOES_EM_LOTE or not ids:
+        return jsonify(erro='Selecione a ação e pelo menos um chamado.'), 400
+    if len(ids) > CHAMADOS_POR_ACAO_EM_LOTE:
+        return jsonify(erro=f'Selecione no máximo {CHAMADOS_POR_ACAO_EM_LOTE} chamados por vez.'), 400
+
+    db = get_db()
+    cadastros = get_lookups()
+    if acao == 'capturar':
+        destino = cadastros.status_capturado_id
+        if not destino:
+            return jsonify(erro='Nenhum status de "capturado" configurado no sistema.'), 400
+    elif acao == 'status':
+        destino = cadastros.status_info(request.form.get('status'))
+        if not destino:
+            return jsonify(erro='Status inválido.'), 400
+        if not nota:
+            return jsonify(erro='Ao alterar o status de chamados, é obrigatório adicionar uma nota.'), 400
+    else:
+        destino = db.execute('SELECT id, responsavel FROM users WHERE id = ? AND is_admin = 1',
+                             (request.form.get('admin_id', type=int),)).fetchone()
+        if not destino:
+            return jsonify(erro='Administrador inválido.'), 400
+
+    try:
+        resultados = em_transacao(db, aplicar_em_lote, acao, ids, destino, nota, cadastros)
+    except sqlite3.OperationalError as e:
+        if not _banco_ocupado(e):
+            raise
+        return jsonify(erro='O sistema está ocupado no momento. Tente novamente.'), 503
+    return jsonify(resultados=resultados, alterados=sum(1 for r in resultados if r['ok']))
+
+
+def aplicar_em_lote(db, acao, ids, destino, nota, cadastros):
+    """Aplica a ação aos chamados `ids` (dentro de em_transacao). Devolve [{id, ok, mensagem}] na ordem de `ids`."""
+    marcadores = ', '.join('?' for _ in ids)
+    atuais = {r['id']: r for r in db.execute(f"""
+        SELECT c.id, c.status_id, c.admin_responsavel_id, s.e_inicial, u.responsavel as admin_nome
+        FROM chamados c
+        JOIN status s ON c.status_id = s.id
+        LEFT JOIN users u ON c.admin_responsavel_id = u.id
+        WHERE c.id IN ({marcadores})
+    """, ids)}
+
+    resultados, atualizacoes, eventos = [], [], []
+    for chamado_id in ids:
+        chamado = atuais.get(chamado_id)
+        if chamado is None:
+            resultados.append(dict(id=chamado_id, ok=False, mensagem='Chamado não encontrado.'))
+            continue
+
+        if acao == 'capturar':
+            if not chamado['e_inicial']:
+                resultados.append(dict(id=chamado_id, ok=False, mensagem='Não está mais no status inicial.'))
+                continue
+            # Mesma condição de `capturar`: só altera a linha se o status não mudou
+            atualizacoes.append((g.user['id'], destino, chamado_id, chamado['status_id']))
+            eventos.append(parametros_evento(chamado_id, 'captura', nota or None,
+                                             status_anterior_id=chamado['status_id'], status_novo_id=destino))
+            resultados.append(dict(id=chamado_id, ok=True, mensagem='Capturado.'))
+            continue
+
+        # Como em update_chamado, chamados finalizados também podem mudar de status (ex.: reabertura pelo admin)
+        # e de responsável; só a captura depende do status atual
+        if acao == 'status':
+            status_mudou = chamado['status_id'] != destino['id']
+            # Mesmas regras de update_chamado
+            resolvido_em = datetime.now() if destino['permite_reabertura'] else None
+            if destino['e_inicial']:
+                atualizacoes.append((destino['id'], None, None, chamado_id))
+            else:
+                atualizacoes.append((destino['id'], resolvido_em, chamado['admin_responsavel_id'], chamado_id))
+            eventos.append(parametros_evento(chamado_id, 'status' if status_mudou else 'nota', nota,
+                                             status_anterior_id=chamado['status_id'] if status_mudou else None,
+                                             status_novo_id=destino['id'] if status_mudou else None))
+            resultados.append(dict(id=chamado_id, ok=True,
+                                   mensagem=f"Status: {destino['nome']}." if status_mudou else 'Nota adicionada.'))
+        else:
+            # Na fila de captura, responsável e status mudam juntos (capturar); só atribuir deixaria o chamado
+            # com responsável mas ainda no status inicial
+            if chamado['e_inicial']:
+                resultados.append(dict(id=chamado_id, ok=False,
+                                       mensagem='Ainda na fila de captura: use "Capturar" antes de atribuir.'))
+                continue
+            if chamado['admin_responsavel_id'] == destino['id']:
+                resultados.append(dict(id=chamado_id, ok=False, mensagem=f"Já atribuído a {destino['responsavel']}."))
+                continue
+            atualizacoes.append((destino['id'], chamado_id))
+            texto = f"Responsável: {chamado['admin_nome'] or '-'} → {destino['responsavel']}"
+            eventos.append(parametros_evento(chamado_id, 'atribuicao', texto + (f"\n{nota}" if nota else '')))
+            resultados.append(dict(id=chamado_id, ok=True, mensagem=f"Atribuído a {destino['responsavel']}."))
+
+    if acao == 'capturar':
+        db.executemany('UPDATE chamados SET admin_responsavel_id = ?, status_id = ? WHERE id = ? AND status_id = ?',
+                       atualizacoes)
+    elif acao == 'status':
+        db.executemany('UPDATE chamados SET status_id = ?, resolvido_em = ?, admin_responsavel_id = ? WHERE id = ?',
+                       atualizacoes)
+    else:
+        db.executemany('UPDATE chamados SET admin_responsavel_id = ? WHERE id = ?', atualizacoes)
+    db.executemany(EVENTO_INSERT, eventos)
+    return resultados
+
+
 # --- ROTAS DO PAINEL DE ADMINISTRAÇÃO ---
 @app.route('/dashboard')
 @login_required
@@ -576,11 +1163,12 @@ def dashboard():
     db = get_db()
     kpis = {}
 
+    # Contagens lidas de kpi_status/kpi_tipo_problema, mantidas por triggers em chamados (migração 005)
     all_status_counts = db.execute(
-        'SELECT s.nome, s.e_inicial, s.e_em_atendimento, s.e_final, COUNT(c.id) as count FROM status s LEFT JOIN chamados c ON s.id = c.status_id GROUP BY s.id'
+        'SELECT s.nome, s.e_inicial, s.e_em_atendimento, s.e_final, COALESCE(k.total, 0) as count FROM status s LEFT JOIN kpi_status k ON k.status_id = s.id'
     ).fetchall()
 
-    kpis['Total'] = db.execute('SELECT COUNT(id) FROM chamados').fetchone()[0]
+    kpis['Total'] = db.execute('SELECT COALESCE(SUM(total), 0) FROM kpi_status').fetchone()[0]
 
     kpis['Aberto'] = sum(r['count'] for r in all_status_counts if r['e_inicial'])
     kpis['Em Atendimento'] = sum(r['count'] for r in all_status_counts if r['e_em_atendimento'])
@@ -591,11 +1179,11 @@ def dashboard():
         SELECT
             CASE WHEN s.e_final = 1 THEN 'finalizados' ELSE s.id END as status_id_agrupado,
             CASE WHEN s.e_final = 1 THEN 'Finalizados' ELSE s.nome END as status_nome_agrupado,
-            COUNT(c.id) as total_count
+            SUM(k.total) as total_count
         FROM status s
-        LEFT JOIN chamados c ON s.id = c.status_id
+        JOIN kpi_status k ON k.status_id = s.id
         GROUP BY status_id_agrupado, status_nome_agrupado
-        HAVING COUNT(c.id) > 0
+        HAVING SUM(k.total) > 0
         ORDER BY status_nome_agrupado;
     """
     status_data = db.execute(status_data_query).fetchall()
@@ -605,7 +1193,7 @@ def dashboard():
     status_values = [row['total_count'] for row in status_data]
 
     tipo_data = db.execute(
-        'SELECT tp.id, tp.nome, COUNT(c.id) as count FROM chamados c JOIN tipos_problema tp ON c.tipo_problema_id = tp.id GROUP BY tp.id, tp.nome ORDER BY count DESC'
+        'SELECT tp.id, tp.nome, k.total as count FROM kpi_tipo_problema k JOIN tipos_problema tp ON k.tipo_problema_id = tp.id WHERE k.total > 0 ORDER BY count DESC'
     ).fetchall()
     tipo_ids = [row['id'] for row in tipo_data]
     tipo_labels = [row['nome'] for row in tipo_data]
@@ -626,8 +1214,6 @@ def dashboard():
         chamado_dict['timestamp'] = data_obj.strftime('%d/%m/%Y')
         ultimos_chamados_formatados.append(chamado_dict)
 
-    db.close()
-
     return render_template(
         'dashboard.html', kpis=kpis,
         status_ids=status_ids, status_labels=status_labels, status_values=status_values,
@@ -636,21 +1222,90 @@ def dashboard():
     )
 
 
+@app.route('/admin/exportar')
+@login_required
+@admin_required
+def exportar_chamados():
+    """Exporta os chamados (CSV ou XLSX) com os mesmos filtros de /meus_chamados, em streaming."""
+    formato = request.args.get('formato', 'csv')
+    if formato not in exportacao.FORMATOS:
+        flash('Formato de exportação inválido.', 'danger')
+        return redirect(url_for('meus_chamados'))
+
+    conditions, params = filtros_chamados(request.args.get('status', type=int), request.args.get('municipio'),
+                                          request.args.get('tipo_problema', type=int),
+                                          request.args.get('status_group'), request.args.get('q'))
+    maximo = app.config['EXPORTACAO_XLSX_MAXIMO']
+    if formato == 'xlsx' and maximo and exportacao.excede(get_db(), conditions, params, maximo):
+        flash(f'A exportação em XLSX é limitada a {maximo} chamados. Refine os filtros ou exporte em CSV.', 'warning')
+        filtros = {chave: valor for chave, valor in request.args.items() if chave != 'formato'}
+        return redirect(url_for('meus_chamados', **filtros))
+    mimetype, extensao = exportacao.FORMATOS[formato]
+    nome_arquivo = f"chamados_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.{extensao}"
+    # Sem Content-Length: o corpo vai em chunked transfer conforme os lotes são lidos
+    return Response(stream_with_context(exportacao.exportar(get_db(), formato, conditions, params)),
+                    mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'})
+
+
+@app.route('/metrics')
+def metricas_prometheus():
+    """Métricas de todos os workers no formato do Prometheus. Exige sessão de admin ou METRICAS_TOKEN."""
+    token = app.config['METRICAS_TOKEN']
+    autorizado = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not autorizado and not (g.user and g.user['is_admin']):
+        abort(403)
+    return Response(metricas.exportar(METRICAS_FOLDER), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/admin/')
 @login_required
 @admin_required
+@pagina_condicional(perfis.VERSAO_USUARIOS)
 def admin_index():
+    """Lista de usuários em ordem de nome, paginada por cursor em (responsavel, id).
+
+    A busca usa o índice users_fts (nome, e-mail, município e telefone, sem diferenciar acentos).
+    `?depois=<id>` traz a página seguinte ao usuário <id> e `?antes=<id>` a anterior.
+    """
     search_query = request.args.get('search', '')
     db = get_db()
-    if search_query:
-        search_term = f"%{search_query}%"
-        users = db.execute(
-            'SELECT * FROM users WHERE responsavel LIKE ? OR email LIKE ? OR municipio LIKE ? ORDER BY responsavel',
-            (search_term, search_term, search_term)).fetchall()
-    else:
-        users = db.execute('SELECT * FROM users ORDER BY responsavel').fetchall()
-    db.close()
-    return render_template('admin.html', users=users, search_query=search_query)
+    por_pagina = app.config['USUARIOS_POR_PAGINA']
+    antes = request.args.get('antes', type=int)
+    depois = request.args.get('depois', type=int)
+
+    conditions, params = " WHERE 1 = 1", []
+    expressao = expressao_fts(search_query)
+    if expressao:
+        conditions += " AND id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)"
+        params.append(expressao)
+    elif search_query.strip():
+        # Nada pesquisável (só pontuação): nenhum usuário corresponde
+        conditions += " AND 0"
+    total = db.execute('SELECT COUNT(*) FROM users' + conditions, params).fetchone()[0]
+
+    order = " ORDER BY responsavel, id"
+    if antes:
+        conditions += " AND (responsavel, id) < (SELECT responsavel, id FROM users WHERE id = ?)"
+        params.append(antes)
+        order = " ORDER BY responsavel DESC, id DESC"
+    elif depois:
+        conditions += " AND (responsavel, id) > (SELECT responsavel, id FROM users WHERE id = ?)"
+        params.append(depois)
+
+    users = db.execute('SELECT * FROM users' + conditions + order + ' LIMIT ?', [*params, por_pagina + 1]).fetchall()
+    tem_mais = len(users) > por_pagina
+    users = users[:por_pagina]
+    if antes:
+        users.reverse()
+
+    ha_anteriores = tem_mais if antes else bool(depois)
+    ha_proximos = True if antes else tem_mais
+    args = {'search': search_query} if search_query else {}
+    return render_template('admin.html', users=users, search_query=search_query, total_usuarios=total,
+                           url_anteriores=url_for('admin_index', antes=users[0]['id'], **args)
+                           if users and ha_anteriores else None,
+                           url_proximos=url_for('admin_index', depois=users[-1]['id'], **args)
+                           if users and ha_proximos else None)
 
 
 @app.route('/admin/add_user', methods=['POST'])
@@ -675,8 +1330,6 @@ def add_user():
             flash(f'Usuário {email} adicionado com sucesso!', 'success')
         except sqlite3.IntegrityError:
             flash(f'O e-mail {email} já está cadastrado.', 'danger')
-        finally:
-            db.close()
     return redirect(url_for('admin_index'))
 
 
@@ -687,7 +1340,7 @@ def delete_user(user_id):
     db = get_db()
     db.execute('DELETE FROM users WHERE id = ?', (user_id,))
     db.commit()
-    db.close()
+    perfil_alterado(db, user_id)
     flash('Usuário removido com sucesso!', 'success')
     return redirect(url_for('admin_index'))
 
@@ -699,7 +1352,7 @@ def reset_password(user_id):
     db = get_db()
     db.execute('UPDATE users SET password = ?, must_reset_password = 1 WHERE id = ?', (DEFAULT_PASSWORD, user_id))
     db.commit()
-    db.close()
+    perfil_alterado(db, user_id)
     flash('Senha do usuário redefinida para o padrão com sucesso!', 'success')
     return redirect(url_for('admin_index'))
 
@@ -721,12 +1374,12 @@ def edit_user(user_id):
                 'UPDATE users SET email = ?, municipio = ?, responsavel = ?, telefone = ?, is_admin = ?, must_reset_password = ? WHERE id = ?',
                 (email, municipio, responsavel, telefone, is_admin_val, must_reset_val, user_id))
             db.commit()
+            perfil_alterado(db, user_id)
             flash('Usuário atualizado com sucesso!', 'success')
             return redirect(url_for('admin_index'))
         except sqlite3.IntegrityError:
             flash(f'O e-mail {email} já está em uso por outro usuário.', 'danger')
     user_to_edit = db.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    db.close()
     if user_to_edit is None:
         flash('Usuário não encontrado.', 'danger')
         return redirect(url_for('admin_index'))
@@ -737,10 +1390,9 @@ def edit_user(user_id):
 @login_required
 @admin_required
 def gerenciar_cadastros():
-    db = get_db()
-    status_list = db.execute('SELECT * FROM status ORDER BY nome').fetchall()
-    tipos_problema_list = db.execute('SELECT * FROM tipos_problema ORDER BY nome').fetchall()
-    db.close()
+    cadastros = get_lookups()
+    status_list = cadastros.status
+    tipos_problema_list = cadastros.tipos_problema
     return render_template('gerenciar_cadastros.html', status_list=status_list, tipos_problema_list=tipos_problema_list)
 
 
@@ -774,18 +1426,13 @@ def gerenciar_configuracoes():
             db.commit()
             flash('Configurações salvas com sucesso!', 'success')
 
-        db.close()
         return redirect(url_for('gerenciar_configuracoes'))
 
-    config_rows = db.execute('SELECT chave, valor FROM configuracoes').fetchall()
-    configs = {row['chave']: row['valor'] for row in config_rows}
+    cadastros = get_lookups()
+    configs = cadastros.configs
 
-    status_atendimento_options = db.execute(
-        'SELECT id, nome FROM status WHERE e_em_atendimento = 1 ORDER BY nome').fetchall()
-    status_finais_options = db.execute(
-        'SELECT id, nome FROM status WHERE e_final = 1 AND permite_reabertura = 0 ORDER BY nome').fetchall()
-
-    db.close()
+    status_atendimento_options = [s for s in cadastros.status if s['e_em_atendimento']]
+    status_finais_options = [s for s in cadastros.status if s['e_final'] and not s['permite_reabertura']]
 
     return render_template('configuracoes.html', configs=configs,
                            status_atendimento_options=status_atendimento_options,
@@ -805,8 +1452,6 @@ def add_status():
             flash('Novo status adicionado! Configure seus comportamentos abaixo.', 'success')
         except sqlite3.IntegrityError:
             flash('Este status já existe.', 'danger')
-        finally:
-            db.close()
     else:
         flash('O nome do status não pode ser vazio.', 'danger')
     return redirect(url_for('gerenciar_cadastros'))
@@ -835,7 +1480,6 @@ def update_status():
         """, (novo_nome, e_inicial, e_em_atendimento, permite_reabertura, e_final, status_id))
 
     db.commit()
-    db.close()
     flash('Status atualizados com sucesso!', 'success')
     return redirect(url_for('gerenciar_cadastros'))
 
@@ -849,7 +1493,6 @@ def delete_status(status_id):
     chamado_usando = db.execute('SELECT id FROM chamados WHERE status_id = ?', (status_id,)).fetchone()
     if chamado_usando:
         flash('Não é possível remover este status, pois ele está em uso por um ou mais chamados.', 'danger')
-        db.close()
         return redirect(url_for('gerenciar_cadastros'))
 
     configs_usando = db.execute(
@@ -862,13 +1505,11 @@ def delete_status(status_id):
         flash(
             f'Não é possível remover. Este status está configurado como um status chave em: {", ".join(nomes_config)}.',
             'danger')
-        db.close()
         return redirect(url_for('gerenciar_cadastros'))
 
     db.execute('DELETE FROM status WHERE id = ?', (status_id,))
     db.commit()
     flash('Status removido com sucesso!', 'success')
-    db.close()
     return redirect(url_for('gerenciar_cadastros'))
 
 
@@ -885,8 +1526,6 @@ def add_tipo_problema():
             flash('Novo tipo de problema adicionado com sucesso!', 'success')
         except sqlite3.IntegrityError:
             flash('Este tipo de problema já existe.', 'danger')
-        finally:
-            db.close()
     else:
         flash('O nome do tipo de problema não pode ser vazio.', 'danger')
     return redirect(url_for('gerenciar_cadastros'))
@@ -904,7 +1543,6 @@ def delete_tipo_problema(tipo_id):
         db.execute('DELETE FROM tipos_problema WHERE id = ?', (tipo_id,))
         db.commit()
         flash('Tipo de problema removido com sucesso!', 'success')
-    db.close()
     return redirect(url_for('gerenciar_cadastros'))
 
 
@@ -922,11 +1560,9 @@ def update_tipos_problema():
                 db.execute("UPDATE tipos_problema SET nome = ? WHERE id = ?", (novo_nome, tipo_id))
             except sqlite3.IntegrityError:
                 flash(f'O nome "{novo_nome}" já existe. Os nomes dos tipos de problema devem ser únicos.', 'danger')
-                db.close()
                 return redirect(url_for('gerenciar_cadastros'))
 
     db.commit()
-    db.close()
     flash('Tipos de problema atualizados com sucesso!', 'success')
     return redirect(url_for('gerenciar_cadastros'))
 
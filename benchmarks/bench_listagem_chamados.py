@@ -0,0 +1,162 @@
+# bench_listagem_chamados.py - Compara o cálculo antigo (em Python) da listagem de /meus_chamados com o novo (em SQL)
+#
+# Uso:
+#     python benchmarks/bench_listagem_chamados.py [--linhas 10000 100000] [--repeticoes 5]
+#
+# O caminho antigo busca as colunas cruas e passa cada linha por `processar_chamados` (três strptime por linha);
+# o novo usa CHAMADOS_LISTA_QUERY, que já devolve data formatada, cor da borda e janela de reabertura.
+# Antes de medir, o script confere que os dois caminhos produzem os mesmos valores.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import lookups
+from app import CHAMADOS_LISTA_QUERY, parametros_lista_chamados
+
+QUERY_ANTIGA = """
+    SELECT c.id, c.timestamp, c.municipio, c.solicitante_email, c.smartphone_imei,
+           c.observacoes, c.foto, c.solucao, c.status_id, c.tipo_problema_id, c.admin_responsavel_id,
+           c.resolvido_em,
+           s.nome as status_nome,
+           s.e_inicial as status_e_inicial,
+           s.e_final as status_e_final,
+           s.permite_reabertura as status_permite_reabertura,
+           tp.nome as tipo_problema_nome,
+           u.responsavel as admin_responsavel_nome,
+           e.marca as equipamento_marca,
+           e.modelo as equipamento_modelo,
+           e.patrimonio as equipamento_patrimonio,
+           e.numeroDeSerie as equipamento_ns,
+           e.localdeUso as equipamento_local,
+           e.situacao as equipamento_situacao
+    FROM chamados c
+    JOIN status s ON c.status_id = s.id
+    JOIN tipos_problema tp ON c.tipo_problema_id = tp.id
+    LEFT JOIN users u ON c.admin_responsavel_id = u.id
+    LEFT JOIN equipamentos e ON c.smartphone_imei = e.imei1
+    ORDER BY c.timestamp DESC
+"""
+
+
+def processar_chamados_antigo(chamados_raw, prazo_vermelho, prazo_amarelo, prazo_reabrir):
+    """Cópia da implementação anterior de `processar_chamados` (app.py, antes do cálculo em SQL)."""
+    chamados_processados = []
+    for chamado in chamados_raw:
+        chamado_dict = dict(chamado)
+
+        try:
+            data_obj = datetime.strptime(chamado_dict['timestamp'].split('.')[0], '%Y-%m-%d %H:%M:%S')
+            chamado_dict['timestamp'] = data_obj.strftime('%d/%m/%Y')
+        except (ValueError, TypeError):
+            chamado_dict['timestamp'] = 'Data inválida'
+
+        chamado_dict['cor_borda'] = 'success'
+        if not chamado_dict['status_e_final']:
+            try:
+                data_abertura = datetime.strptime(chamado_dict['timestamp'], '%d/%m/%Y')
+                dias_aberto = (datetime.now() - data_abertura).days
+                if dias_aberto > prazo_vermelho:
+                    chamado_dict['cor_borda'] = 'danger'
+                elif dias_aberto > prazo_amarelo:
+                    chamado_dict['cor_borda'] = 'warning'
+            except (ValueError, TypeError):
+                chamado_dict['cor_borda'] = 'secondary'
+
+        chamado_dict['reabertura_disponivel'] = False
+        if chamado_dict['status_permite_reabertura'] and chamado_dict['resolvido_em']:
+            try:
+                data_resolvido = datetime.strptime(chamado_dict['resolvido_em'], '%Y-%m-%d %H:%M:%S.%f')
+                data_expiracao = data_resolvido + timedelta(days=prazo_reabrir)
+                if datetime.now() < data_expiracao:
+                    chamado_dict['reabertura_disponivel'] = True
+                    chamado_dict['expira_em'] = data_expiracao.strftime('%d/%m/%Y às %H:%M')
+            except (ValueError, TypeError):
+                pass
+
+        chamados_processados.append(chamado_dict)
+    return chamados_processados
+
+
+def criar_banco(caminho, linhas):
+    conn = database.connect(caminho)
+    database.migrate(conn)
+    database.populate_lookup_tables(conn)
+    status = [dict(r) for r in conn.execute('SELECT * FROM status')]
+    tipos = [r['id'] for r in conn.execute('SELECT id FROM tipos_problema')]
+
+    agora = datetime.now()
+    aleatorio = random.Random(42)
+    registros = []
+    for i in range(linhas):
+        s = aleatorio.choice(status)
+        aberto_em = agora - timedelta(days=aleatorio.uniform(0, 30))
+        resolvido_em = None
+        if s['permite_reabertura']:
+            resolvido_em = (agora - timedelta(days=aleatorio.uniform(0, 6), microseconds=1)).isoformat(' ')
+        registros.append((aberto_em.strftime('%Y-%m-%d %H:%M:%S'), f'usuario{i % 800}@exemplo', 'Curitiba',
+                          str(100000000000000 + i), aleatorio.choice(tipos), 'Observação de teste', s['id'],
+                          resolvido_em))
+    conn.executemany(
+        'INSERT INTO chamados (timestamp, solicitante_email, municipio, smartphone_imei, tipo_problema_id, '
+        'observacoes, status_id, resolvido_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', registros)
+    conn.commit()
+    return conn
+
+
+def caminho_antigo(conn, cadastros):
+    rows = conn.execute(QUERY_ANTIGA).fetchall()
+    return processar_chamados_antigo(rows, cadastros.prazo_vermelho, cadastros.prazo_amarelo,
+                                     cadastros.prazo_reabrir)
+
+
+def caminho_novo(conn, cadastros):
+    return conn.execute(CHAMADOS_LISTA_QUERY + ' ORDER BY c.timestamp DESC',
+                        parametros_lista_chamados(cadastros)).fetchall()
+
+
+def conferir(antigos, novos):
+    por_id = {r['id']: r for r in novos}
+    for antigo in antigos:
+        novo = por_id[antigo['id']]
+        assert antigo['timestamp'] == novo['data_abertura'], (antigo, dict(novo))
+        if not antigo['status_e_final']:
+            assert antigo['cor_borda'] == novo['cor_borda'], (antigo, dict(novo))
+        assert antigo['reabertura_disponivel'] == bool(novo['reabertura_disponivel']), (antigo, dict(novo))
+        if antigo['reabertura_disponivel']:
+            assert antigo['expira_em'] == novo['expira_em'], (antigo, dict(novo))
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark da listagem de chamados (Python x SQL).")
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        print(f"{'linhas':>8} | {'antigo (s)':>10} | {'novo (s)':>10} | {'ganho':>6}")
+        for linhas in args.linhas:
+            conn = criar_banco(os.path.join(pasta, f'bench_{linhas}.db'), linhas)
+            cadastros = lookups.obter(conn)
+            conferir(caminho_antigo(conn, cadastros), caminho_novo(conn, cadastros))
+
+            t_antigo = medir(lambda: caminho_antigo(conn, cadastros), args.repeticoes)
+            t_novo = medir(lambda: caminho_novo(conn, cadastros), args.repeticoes)
+            print(f"{linhas:>8} | {t_antigo:>10.3f} | {t_novo:>10.3f} | {t_antigo / t_novo:>5.1f}x")
+            conn.close()
@@ -0,0 +1,255 @@
+# bench_rotas.py - Latência (p50/p95/p99) e vazão das principais rotas da aplicação
+#
+# Uso:
+#     python benchmarks/gerar_dados.py --db /tmp/carga.db --chamados 1000000
+#     python benchmarks/bench_rotas.py --db /tmp/carga.db [--modo cliente|gunicorn] [--requisicoes 200]
+#                                      [--concorrencia 1] [--rotas dashboard,chamado] [--saida resultado.json]
+#                                      [--comparar anterior.json]
+#
+# `--modo cliente` chama a aplicação pelo test client do Flask, no próprio processo (mede só o código da
+# aplicação e o banco). `--modo gunicorn` sobe `gunicorn app:app` em 127.0.0.1 com o banco indicado (via
+# CHAMADOS_DB) e faz as requisições por HTTP; `--workers`/`--threads` são repassados ao gunicorn. Nos dois
+# modos cada thread faz login com o seu próprio cliente, e os redirecionamentos não são seguidos.
+#
+# A aplicação roda com CHAMADOS_INSTANCIA numa pasta temporária, apagada no final: uploads, retratos de
+# métricas e consultas lentas do benchmark não vão para o instance/ do repositório.
+#
+# O banco deve ter sido criado por gerar_dados.py (usuários com a senha conhecida). O cenário de abertura de
+# chamado grava no banco, por isso roda por último. Com `--saida`, os resultados vão para um JSON junto com o
+# commit, as versões e o tamanho do banco; `--comparar` mostra a variação em relação a um JSON anterior.
+
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('EXPIRACAO_INTERVALO', '0')
+os.environ.setdefault('NOTIFICACOES_INTERVALO', '0')
+
+from gerar_dados import SENHA_TESTE
+
+ADMIN = 'admin0@teste'
+USUARIO = 'usuario0@teste'
+
+
+def cenarios(conn, aleatorio):
+    """(nome, perfil, método, função que devolve (caminho, formulário)) de cada rota medida."""
+    ids = [r[0] for r in conn.execute('SELECT id FROM chamados ORDER BY random() LIMIT 1000')]
+    municipio, = conn.execute('SELECT municipio FROM users WHERE email = ?', (USUARIO,)).fetchone()
+    imeis = [r[0] for r in conn.execute('SELECT imei1 FROM equipamentos WHERE municipio = ? LIMIT 100', (municipio,))]
+    tipo, = conn.execute('SELECT id FROM tipos_problema ORDER BY id').fetchone()
+    termos = ['bateria', 'tela quebrada', 'wifi', 'senha', 'Octostudio']
+    return [
+        ('inicio', 'usuario', 'GET', lambda: ('/', None)),
+        ('meus_chamados', 'usuario', 'GET', lambda: ('/meus_chamados', None)),
+        ('meus_chamados_admin', 'admin', 'GET', lambda: ('/meus_chamados', None)),
+        ('meus_chamados_busca', 'admin', 'GET',
+         lambda: ('/meus_chamados?' + urllib.parse.urlencode({'q': aleatorio.choice(termos)}), None)),
+        ('dashboard', 'admin', 'GET', lambda: ('/dashboard', None)),
+        ('chamado', 'admin', 'GET', lambda: (f'/chamado/{aleatorio.choice(ids)}', None)),
+        ('equipamentos_busca', 'usuario', 'GET',
+         lambda: ('/equipamentos/busca?' + urllib.parse.urlencode({'q': aleatorio.choice(imeis)[-6:-2]}), None)),
+        ('admin_usuarios', 'admin', 'GET', lambda: ('/admin/', None)),
+        ('abrir_chamado', 'usuario', 'POST',
+         lambda: ('/submit_chamado', {'selectedDevice': aleatorio.choice(imeis), 'tipoProblema': tipo,
+                                      'observacoes': 'Chamado aberto pelo benchmark.'})),
+    ]
+
+
+class ClienteFlask:
+    def __init__(self, db):
+        import app
+        app.DATABASE = db
+        self.cliente = app.app.test_client()
+
+    def requisitar(self, metodo, caminho, formulario=None):
+        return self.cliente.open(caminho, method=metodo, data=formulario).status_code
+
+
+class _SemRedirecionar(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHttp:
+    def __init__(self, base):
+        self.base = base
+        self.abridor = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SemRedirecionar())
+
+    def requisitar(self, metodo, caminho, formulario=None):
+        dados = urllib.parse.urlencode(formulario).encode() if formulario is not None else None
+        try:
+            with self.abridor.open(urllib.request.Request(self.base + caminho, data=dados, method=metodo)) as resposta:
+                resposta.read()
+                return resposta.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def entrar(cliente, email):
+    status = cliente.requisitar('POST', '/login', {'email': email, 'password': SENHA_TESTE})
+    if status != 302:
+        raise SystemExit(f"ERRO: login de {email} falhou ({status}). O banco foi criado por gerar_dados.py?")
+    return cliente
+
+
+def percentil(ordenadas, p):
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))]
+
+
+def medir(clientes, metodo, montar, requisicoes, aquecimento):
+    """Divide `requisicoes` entre os clientes (um por thread). Devolve latências, erros e duração total."""
+    for _ in range(aquecimento):
+        clientes[0].requisitar(metodo, *montar())
+    latencias, erros = [], []
+
+    def trabalhar(cliente, quantidade):
+        for _ in range(quantidade):
+            caminho, formulario = montar()
+            inicio = time.perf_counter()
+            status = cliente.requisitar(metodo, caminho, formulario)
+            latencias.append(time.perf_counter() - inicio)
+            if status >= 400:
+                erros.append(status)
+
+    threads = [threading.Thread(target=trabalhar, args=(cliente, requisicoes // len(clientes)))
+               for cliente in clientes]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencias), erros, time.perf_counter() - inicio
+
+
+def subir_gunicorn(db, workers, threads):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        porta = s.getsockname()[1]
+    ambiente = dict(os.environ, CHAMADOS_DB=db)
+    processo = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+                                 '-b', f'127.0.0.1:{porta}', '--log-level', 'warning', 'app:app'],
+                                cwd=RAIZ, env=ambiente)
+    base = f'http://127.0.0.1:{porta}'
+    for _ in range(100):
+        if processo.poll() is not None:
+            raise SystemExit("ERRO: o gunicorn não subiu (está instalado? pip install gunicorn).")
+        try:
+            urllib.request.urlopen(base + '/login').read()
+            return processo, base
+        except OSError:
+            time.sleep(0.1)
+    processo.terminate()
+    raise SystemExit("ERRO: o gunicorn não respondeu em 10 s.")
+
+
+def metadados(db, args):
+    conn = sqlite3.connect(db)
+    tamanho = {tabela: conn.execute(f'SELECT COUNT(*) FROM {tabela}').fetchone()[0]
+               for tabela in ('chamados', 'users', 'equipamentos')}
+    conn.close()
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=RAIZ, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'data': datetime.now().isoformat(timespec='seconds'), 'modo': args.modo,
+            'concorrencia': args.concorrencia, 'requisicoes': args.requisicoes,
+            'workers': args.workers if args.modo == 'gunicorn' else None,
+            'threads': args.threads if args.modo == 'gunicorn' else None,
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'banco': tamanho}
+
+
+def imprimir(resultados, anteriores):
+    print(f"{'rota':<22} {'n':>6} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for nome, r in resultados.items():
+        linha = (f"{nome:<22} {r['n']:>6} {r['erros']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+                 f"{r['p99_ms']:>9.2f} {r['req_s']:>8.1f}")
+        if nome in anteriores:
+            a = anteriores[nome]
+            linha += (f"   p50 {(r['p50_ms'] / a['p50_ms'] - 1) * 100:+.0f}%  p95 {(r['p95_ms'] / a['p95_ms'] - 1) * 100:+.0f}%"
+                      f"  req/s {(r['req_s'] / a['req_s'] - 1) * 100:+.0f}%")
+        print(linha)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark das rotas da aplicação.")
+    parser.add_argument('--db', required=True, help='Banco criado por benchmarks/gerar_dados.py.')
+    parser.add_argument('--modo', choices=['cliente', 'gunicorn'], default='cliente')
+    parser.add_argument('--requisicoes', type=int, default=200, help='Requisições medidas por rota.')
+    parser.add_argument('--aquecimento', type=int, default=10, help='Requisições descartadas por rota.')
+    parser.add_argument('--concorrencia', type=int, default=1, help='Threads fazendo requisições ao mesmo tempo.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--rotas', help='Só estas rotas (nomes separados por vírgula).')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='Grava os resultados neste arquivo JSON.')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior, para comparar.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"ERRO: '{args.db}' não existe. Gere com benchmarks/gerar_dados.py.")
+    db = os.path.abspath(args.db)
+    aleatorio = random.Random(args.semente)
+    conn = sqlite3.connect(db)
+    selecionados = cenarios(conn, aleatorio)
+    conn.close()
+    if args.rotas:
+        nomes = args.rotas.split(',')
+        selecionados = [c for c in selecionados if c[0] in nomes]
+
+    # Definida antes do primeiro `import app` (em ClienteFlask) e herdada pelo gunicorn
+    instancia = os.environ['CHAMADOS_INSTANCIA'] = tempfile.mkdtemp(prefix='bench_rotas_')
+    servidor = None
+    if args.modo == 'gunicorn':
+        servidor, base = subir_gunicorn(db, args.workers, args.threads)
+        novo_cliente = lambda: ClienteHttp(base)
+    else:
+        novo_cliente = lambda: ClienteFlask(db)
+
+    try:
+        clientes = {perfil: [entrar(novo_cliente(), email) for _ in range(args.concorrencia)]
+                    for perfil, email in (('admin', ADMIN), ('usuario', USUARIO))}
+        resultados = {}
+        for nome, perfil, metodo, montar in selecionados:
+            latencias, erros, duracao = medir(clientes[perfil], metodo, montar, args.requisicoes, args.aquecimento)
+            resultados[nome] = {'n': len(latencias), 'erros': len(erros),
+                                'p50_ms': percentil(latencias, 0.50) * 1000, 'p95_ms': percentil(latencias, 0.95) * 1000,
+                                'p99_ms': percentil(latencias, 0.99) * 1000, 'req_s': len(latencias) / duracao}
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+        shutil.rmtree(instancia, ignore_errors=True)
+
+    info = metadados(db, args)
+    anteriores = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            anterior = json.load(arquivo)
+        anteriores = anterior['rotas']
+        print(f"comparando com {anterior['metadados']['commit']} ({anterior['metadados']['data']})")
+    print(f"{info['commit']} | modo {args.modo}, concorrência {args.concorrencia} | "
+          f"{info['banco']['chamados']} chamados | Python {info['python']}, SQLite {info['sqlite']}")
+    imprimir(resultados, anteriores)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({'metadados': info, 'rotas': resultados}, arquivo, indent=2, ensure_ascii=False)
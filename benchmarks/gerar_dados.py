@@ -0,0 +1,202 @@
+# gerar_dados.py - Gera um banco de teste com usuários, equipamentos e chamados sintéticos
+#
+# Uso:
+#     python benchmarks/gerar_dados.py --db /tmp/carga.db [--usuarios 5000] [--equipamentos 50000]
+#                                      [--chamados 1000000] [--admins 20] [--dias 730] [--semente 42]
+#
+# Os municípios vêm da tabela users de instance/chamados.db (ou de --municipios-de), com volume em
+# distribuição de Zipf: poucos municípios grandes concentram a maior parte dos usuários, equipamentos e
+# chamados, como na rede real. O status de cada chamado depende da idade: os antigos estão quase todos
+# encerrados, os recentes ainda estão na fila ou em atendimento. Cada chamado capturado ganha o evento de
+# captura e os finalizados, a nota de encerramento.
+#
+# Todos os usuários gerados usam a senha SENHA_TESTE (os admins são admin0@teste ... adminN@teste), para os
+# benchmarks poderem fazer login. O resultado é determinístico para a mesma semente.
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from werkzeug.security import generate_password_hash
+
+SENHA_TESTE = 'teste123'
+TAMANHO_LOTE = 10_000
+
+SINTOMAS = ['tela quebrada', 'bateria não carrega', 'sistema travando', 'wifi não conecta', 'aplicativo fecha sozinho',
+            'senha bloqueada', 'câmera não abre', 'sem som', 'microfone falhando', 'chip não reconhecido',
+            'Octostudio não sincroniza', 'atualização pendente', 'aparelho esquentando', 'tela não responde ao toque']
+DETALHES = ['desde ontem', 'depois da última atualização', 'em sala de aula', 'após queda', 'intermitente',
+            'com vários alunos', 'mesmo após reiniciar', 'só no período da tarde']
+SOLUCOES = ['Aparelho reiniciado e configurado.', 'Substituição de peça realizada.', 'Orientação passada por telefone.',
+            'Sistema reinstalado.', 'Encaminhado para garantia.', 'Senha redefinida.']
+MARCAS = [('Samsung', 'Galaxy A14'), ('Samsung', 'Galaxy A24'), ('Motorola', 'Moto G54'), ('Positivo', 'Twist 5'),
+          ('Multilaser', 'M10')]
+
+
+def pesos_zipf(total, expoente=1.0):
+    return [1 / (posicao ** expoente) for posicao in range(1, total + 1)]
+
+
+def listar_municipios(caminho, aleatorio):
+    municipios = []
+    if caminho and os.path.exists(caminho):
+        conn = sqlite3.connect(caminho)
+        try:
+            municipios = [r[0] for r in conn.execute('SELECT DISTINCT municipio FROM users ORDER BY municipio')]
+        except sqlite3.Error:
+            pass
+        conn.close()
+    if not municipios:
+        municipios = [f'Município {i}' for i in range(1, 400)]
+    aleatorio.shuffle(municipios)
+    # A capital na frente: é o maior município na distribuição de Zipf
+    if 'Curitiba' in municipios:
+        municipios.remove('Curitiba')
+        municipios.insert(0, 'Curitiba')
+    return municipios
+
+
+def em_lotes(linhas):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= TAMANHO_LOTE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def gerar_usuarios(conn, aleatorio, municipios, pesos, total, admins):
+    senha = generate_password_hash(SENHA_TESTE)
+    linhas = [(f'admin{i}@teste', senha, municipios[0], f'Admin Teste {i}', '(41) 3000-0000', 0, 1)
+              for i in range(admins)]
+    # Todo município tem pelo menos um usuário; o restante segue a distribuição
+    por_municipio = municipios + aleatorio.choices(municipios, pesos, k=max(0, total - len(municipios)))
+    for i, municipio in enumerate(por_municipio):
+        linhas.append((f'usuario{i}@teste', senha, municipio, f'Usuário Teste {i}', '(41) 99999-0000', 0, 0))
+    conn.executemany('INSERT INTO users (email, password, municipio, responsavel, telefone, must_reset_password, '
+                     'is_admin) VALUES (?, ?, ?, ?, ?, ?, ?)', linhas)
+
+
+def gerar_equipamentos(conn, aleatorio, municipios, pesos, total):
+    por_municipio = municipios + aleatorio.choices(municipios, pesos, k=max(0, total - len(municipios)))
+    linhas = []
+    for i, municipio in enumerate(por_municipio):
+        marca, modelo = aleatorio.choice(MARCAS)
+        linhas.append((municipio, str(350000000000000 + i), str(360000000000000 + i), marca, modelo, '128GB',
+                       f'SN{i:09d}', '2024-02-01', f'Escola {aleatorio.randint(1, 30)}', 'Em uso', f'PAT{i:07d}'))
+    for lote in em_lotes(linhas):
+        conn.executemany('INSERT INTO equipamentos (municipio, imei1, imei2, marca, modelo, capacidade, numeroDeSerie, '
+                         'dataEntrega, localdeUso, situacao, patrimonio) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', lote)
+
+
+def sortear_status(aleatorio, idade_dias, status):
+    """Status de um chamado aberto há `idade_dias` dias: quanto mais antigo, mais provável estar encerrado."""
+    if aleatorio.random() < min(0.97, 0.25 + idade_dias / 30 * 0.6):
+        if aleatorio.random() < 0.1:
+            return status['Cancelado']
+        # 'Resolvido' só dura o prazo de reabertura; depois disso o chamado é expirado para 'Encerrado'
+        return status['Resolvido'] if idade_dias <= 3 else status['Encerrado']
+    return aleatorio.choices([status['Aberto'], status['Em Andamento'], status['Aguardando Peça']], [40, 45, 15])[0]
+
+
+def gerar_chamados(conn, aleatorio, municipios, pesos, total, dias):
+    status = {r['nome']: r for r in conn.execute('SELECT * FROM status')}
+    tipos = [r[0] for r in conn.execute('SELECT id FROM tipos_problema ORDER BY id')]
+    admins = [(r['id'], r['responsavel']) for r in conn.execute('SELECT id, responsavel FROM users WHERE is_admin = 1')]
+    usuarios, equipamentos = {}, {}
+    for r in conn.execute('SELECT email, municipio FROM users WHERE is_admin = 0'):
+        usuarios.setdefault(r[1], []).append(r[0])
+    for r in conn.execute('SELECT imei1, municipio FROM equipamentos'):
+        equipamentos.setdefault(r[1], []).append(r[0])
+    primeiro_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chamados").fetchone()[0]
+    agora = datetime.now()
+
+    def linhas():
+        for i in range(total):
+            municipio = aleatorio.choices(municipios, pesos)[0]
+            aberto_em = agora - timedelta(seconds=aleatorio.uniform(0, dias * 86400))
+            idade = (agora - aberto_em).days
+            s = sortear_status(aleatorio, idade, status)
+            admin = aleatorio.choice(admins) if not s['e_inicial'] else (None, None)
+            resolvido_em = None
+            if s['e_final']:
+                resolvido_em = min(agora, aberto_em + timedelta(hours=aleatorio.uniform(1, 72)))
+            observacoes = f"{aleatorio.choice(SINTOMAS).capitalize()} {aleatorio.choice(DETALHES)}."
+            yield (primeiro_id + i, aberto_em, municipio, s, admin, resolvido_em, observacoes)
+
+    capturado_id = conn.execute("SELECT valor FROM configuracoes WHERE chave = 'status_capturado_id'").fetchone()[0]
+    for lote in em_lotes(linhas()):
+        chamados, eventos = [], []
+        for chamado_id, aberto_em, municipio, s, (admin_id, admin_nome), resolvido_em, observacoes in lote:
+            chamados.append((chamado_id, aberto_em.strftime('%Y-%m-%d %H:%M:%S'),
+                             aleatorio.choice(usuarios.get(municipio) or usuarios[municipios[0]]), municipio,
+                             aleatorio.choice(equipamentos.get(municipio) or equipamentos[municipios[0]]),
+                             aleatorio.choice(tipos), observacoes, s['id'], admin_id,
+                             resolvido_em.isoformat(' ', timespec='microseconds')
+                             if resolvido_em and s['permite_reabertura'] else None))
+            if admin_id:
+                capturado_em = aberto_em + timedelta(minutes=aleatorio.uniform(5, 600))
+                eventos.append((chamado_id, 'captura', capturado_em.strftime('%Y-%m-%d %H:%M:%S'), admin_id, admin_nome,
+                                None, capturado_id, None))
+            if resolvido_em:
+                eventos.append((chamado_id, 'status', resolvido_em.strftime('%Y-%m-%d %H:%M:%S'), admin_id, admin_nome,
+                                capturado_id, s['id'], aleatorio.choice(SOLUCOES)))
+        conn.executemany('INSERT INTO chamados (id, timestamp, solicitante_email, municipio, smartphone_imei, '
+                         'tipo_problema_id, observacoes, status_id, admin_responsavel_id, resolvido_em) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', chamados)
+        conn.executemany('INSERT INTO chamado_eventos (chamado_id, tipo, timestamp, autor_id, autor_nome, '
+                         'status_anterior_id, status_novo_id, texto) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', eventos)
+        conn.commit()
+        print(f"  {chamados[-1][0] - primeiro_id + 1} chamados...", end='\r', flush=True)
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gera um banco de teste com dados sintéticos.")
+    parser.add_argument('--db', required=True, help='Banco a criar (não pode existir).')
+    parser.add_argument('--usuarios', type=int, default=5000)
+    parser.add_argument('--admins', type=int, default=20)
+    parser.add_argument('--equipamentos', type=int, default=50_000)
+    parser.add_argument('--chamados', type=int, default=100_000)
+    parser.add_argument('--dias', type=int, default=730, help='Período em que os chamados foram abertos.')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--municipios-de', default=database.DATABASE,
+                        help='Banco de onde tirar a lista de municípios (padrão: instance/chamados.db).')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        raise SystemExit(f"ERRO: '{args.db}' já existe.")
+
+    inicio = time.perf_counter()
+    aleatorio = random.Random(args.semente)
+    conn = database.connect(args.db)
+    database.migrate(conn)
+    database.populate_lookup_tables(conn)
+    # Banco descartável: sem journal nem fsync durante a carga
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+
+    municipios = listar_municipios(args.municipios_de, aleatorio)
+    pesos = pesos_zipf(len(municipios))
+    gerar_usuarios(conn, aleatorio, municipios, pesos, args.usuarios, args.admins)
+    gerar_equipamentos(conn, aleatorio, municipios, pesos, args.equipamentos)
+    conn.commit()
+    print(f"{args.usuarios} usuários, {args.admins} admins e {args.equipamentos} equipamentos em {len(municipios)} municípios.")
+    gerar_chamados(conn, aleatorio, municipios, pesos, args.chamados, args.dias)
+    # Notificações dos chamados gerados não devem ser enviadas
+    conn.execute('DELETE FROM notificacoes')
+    conn.commit()
+
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('ANALYZE')
+    conn.close()
+    print(f"{args.chamados} chamados gerados em {time.perf_counter() - inicio:.0f} s.")
@@ -0,0 +1,145 @@
+# stress_captura.py - Vários admins capturando os mesmos chamados ao mesmo tempo
+#
+# Uso:
+#     python benchmarks/stress_captura.py [--processos 8] [--chamados 200] [--modo atual|antigo]
+#
+# Cria um banco temporário com `--chamados` chamados no status inicial e um admin por processo. Cada processo
+# (como um worker do gunicorn) tenta capturar todos os chamados, na mesma ordem, pela rota
+# /chamado/capturar/<id>. No final confere que cada chamado tem exatamente um vencedor: um único evento de
+# captura, do mesmo admin gravado em admin_responsavel_id. A pasta temporária também é o CHAMADOS_INSTANCIA
+# dos processos: métricas e consultas lentas não vão para o instance/ do repositório.
+#
+# `--modo antigo` troca a captura pela implementação anterior (SELECT do status e UPDATE separado), para
+# mostrar as capturas duplicadas que ela permitia.
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('EXPIRACAO_INTERVALO', '0')
+os.environ.setdefault('NOTIFICACOES_INTERVALO', '0')
+
+import database
+
+
+def capturar_antigo(db, chamado_id, cadastros, status_capturado_id):
+    """Cópia da implementação anterior de `capturar_chamado` (SELECT e depois UPDATE, sem condição)."""
+    from app import g, registrar_evento
+    chamado_atual = db.execute(
+        "SELECT c.id, c.status_id FROM chamados c JOIN status s ON c.status_id = s.id WHERE c.id = ? AND s.e_inicial = 1",
+        (chamado_id,)).fetchone()
+    if not chamado_atual:
+        return False
+    db.execute('UPDATE chamados SET admin_responsavel_id = ?, status_id = ? WHERE id = ?',
+               (g.user['id'], status_capturado_id, chamado_id))
+    registrar_evento(db, chamado_id, 'captura', status_anterior_id=chamado_atual['status_id'],
+                     status_novo_id=status_capturado_id)
+    return True
+
+
+def em_transacao_antiga(db, funcao, *args):
+    # Sem BEGIN IMMEDIATE: o SELECT e o UPDATE rodavam fora de uma transação de escrita
+    resultado = funcao(db, *args)
+    db.commit()
+    return resultado
+
+
+def criar_banco(caminho, processos, chamados):
+    conn = database.connect(caminho)
+    database.migrate(conn)
+    database.populate_lookup_tables(conn)
+    status_inicial = conn.execute('SELECT id FROM status WHERE e_inicial = 1 ORDER BY id').fetchone()[0]
+    tipo = conn.execute('SELECT id FROM tipos_problema ORDER BY id').fetchone()[0]
+    admins = []
+    for i in range(processos):
+        cursor = conn.execute(
+            'INSERT INTO users (email, password, municipio, responsavel, telefone, is_admin, must_reset_password) '
+            'VALUES (?, ?, ?, ?, ?, 1, 0)', (f'admin{i}@exemplo', 'x', 'Curitiba', f'Admin {i}', ''))
+        admins.append(cursor.lastrowid)
+    conn.executemany(
+        'INSERT INTO chamados (solicitante_email, municipio, smartphone_imei, tipo_problema_id, observacoes, status_id) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [('usuario@exemplo', 'Curitiba', str(100000000000000 + i), tipo, 'Teste', status_inicial)
+         for i in range(chamados)])
+    conn.commit()
+    ids = [r[0] for r in conn.execute('SELECT id FROM chamados ORDER BY id')]
+    conn.close()
+    return admins, ids
+
+
+def trabalhador(caminho, admin_id, ids, modo, barreira, fila):
+    import app
+    app.DATABASE = caminho
+    if modo == 'antigo':
+        app.capturar = capturar_antigo
+        app.em_transacao = em_transacao_antiga
+    cliente = app.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = admin_id
+    latencias = []
+    barreira.wait()
+    for chamado_id in ids:
+        inicio = time.perf_counter()
+        resposta = cliente.post(f'/chamado/capturar/{chamado_id}')
+        latencias.append(time.perf_counter() - inicio)
+        assert resposta.status_code == 302, resposta.status_code
+    fila.put(latencias)
+
+
+def conferir(caminho):
+    conn = database.connect(caminho)
+    capturas = conn.execute("""
+        SELECT c.id, c.admin_responsavel_id, COUNT(ev.id) as eventos,
+               SUM(ev.autor_id = c.admin_responsavel_id) as do_responsavel
+        FROM chamados c LEFT JOIN chamado_eventos ev ON ev.chamado_id = c.id AND ev.tipo = 'captura'
+        GROUP BY c.id
+    """).fetchall()
+    conn.close()
+    sem_vencedor = sum(1 for r in capturas if r['eventos'] == 0)
+    duplicadas = sum(1 for r in capturas if r['eventos'] > 1)
+    inconsistentes = sum(1 for r in capturas if r['eventos'] == 1 and r['do_responsavel'] != 1)
+    return len(capturas), sem_vencedor, duplicadas, inconsistentes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Teste de concorrência da captura de chamados.")
+    parser.add_argument('--processos', type=int, default=8)
+    parser.add_argument('--chamados', type=int, default=200)
+    parser.add_argument('--modo', choices=['atual', 'antigo'], default='atual')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'stress.db')
+        # Herdado pelos processos (spawn), que importam app depois
+        os.environ['CHAMADOS_INSTANCIA'] = pasta
+        admins, ids = criar_banco(caminho, args.processos, args.chamados)
+
+        contexto = multiprocessing.get_context('spawn')
+        barreira = contexto.Barrier(args.processos + 1)
+        fila = contexto.Queue()
+        processos = [contexto.Process(target=trabalhador, args=(caminho, admin_id, ids, args.modo, barreira, fila))
+                     for admin_id in admins]
+        for processo in processos:
+            processo.start()
+        barreira.wait()
+        inicio = time.perf_counter()
+        latencias = sorted(l for _ in processos for l in fila.get())
+        duracao = time.perf_counter() - inicio
+        for processo in processos:
+            processo.join()
+
+        total, sem_vencedor, duplicadas, inconsistentes = conferir(caminho)
+        tentativas = len(latencias)
+        print(f"modo {args.modo}: {args.processos} processos x {len(ids)} chamados = {tentativas} tentativas "
+              f"em {duracao:.2f} s ({tentativas / duracao:.0f} tentativas/s)")
+        print(f"latência p50 {latencias[tentativas // 2] * 1000:.1f} ms, "
+              f"p99 {latencias[int(tentativas * 0.99)] * 1000:.1f} ms")
+        print(f"{total} chamados: {total - sem_vencedor - duplicadas} com exatamente um vencedor, "
+              f"{sem_vencedor} sem vencedor, {duplicadas} capturados mais de uma vez, "
+              f"{inconsistentes} com responsável diferente do autor da captura")
+        if sem_vencedor or duplicadas or inconsistentes:
+            sys.exit(1)
@@ -4,10 +4,11 @@ set -o errexit
 pip install --upgrade pip
 pip install -r requirements.txt
 
-# Executa o script para criar o banco de dados se ele não existir
+# Cria o banco de dados se ele não existir; caso contrário, aplica as migrações pendentes
 if [ ! -f instance/chamados.db ]; then
   echo "Criando o banco de dados..."
-  python database.py
+  python database.py init
 else
-  echo "Banco de dados já existe."
+  echo "Banco de dados já existe. Aplicando migrações..."
+  python database.py migrate
 fi
@@ -0,0 +1,54 @@
+# compressao.py - Compressão das respostas (gzip e, se o pacote `brotli` estiver instalado, brotli)
+#
+# As páginas de /meus_chamados e /admin/ passam de 100 KB de HTML repetitivo e são abertas em celulares com
+# conexão fraca; comprimidas, ficam com uma fração disso. Só respostas de texto acima de um tamanho mínimo
+# são comprimidas: abaixo disso o ganho não paga o custo. Respostas em streaming (exportação), arquivos
+# servidos direto do disco (send_from_directory) e imagens ficam como estão.
+#
+# O brotli é opcional (pip install brotli); sem ele, só gzip é oferecido.
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TAMANHO_MINIMO = 1024
+NIVEL_GZIP = 6
+QUALIDADE_BROTLI = 5
+TIPOS_COMPRIMIVEIS = {'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'application/javascript',
+                      'application/json', 'image/svg+xml'}
+
+
+def escolher_codificacao(aceitas):
+    """'br', 'gzip' ou None, conforme o Accept-Encoding do cliente (`request.accept_encodings`)."""
+    if brotli is not None and aceitas['br']:
+        return 'br'
+    if aceitas['gzip']:
+        return 'gzip'
+    return None
+
+
+def comprimir(response, aceitas, minimo=TAMANHO_MINIMO):
+    """Comprime o corpo de `response` no lugar, se o tipo e o tamanho permitirem. Devolve a própria resposta."""
+    if (response.status_code < 200 or response.status_code in (204, 206, 304) or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIVEIS):
+        return response
+    response.vary.add('Accept-Encoding')
+    corpo = response.get_data()
+    codificacao = escolher_codificacao(aceitas)
+    if len(corpo) < minimo or codificacao is None:
+        return response
+
+    if codificacao == 'br':
+        response.set_data(brotli.compress(corpo, quality=QUALIDADE_BROTLI))
+    else:
+        response.set_data(gzip.compress(corpo, compresslevel=NIVEL_GZIP, mtime=0))
+    response.headers['Content-Encoding'] = codificacao
+    # Uma ETag forte identifica os bytes exatos; a versão comprimida precisa de outra
+    etag, fraca = response.get_etag()
+    if etag and not fraca:
+        response.set_etag(f'{etag}-{codificacao}')
+    return response
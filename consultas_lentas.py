@@ -0,0 +1,133 @@
+# consultas_lentas.py - Registro das consultas SQL lentas, com o plano de execução
+#
+# Toda consulta executada por uma ConexaoMedida (metricas.py) que passar de CONSULTA_LENTA_MS gera uma linha
+# JSON em instance/consultas_lentas.jsonl: texto normalizado, formato dos parâmetros (tipos, nunca os
+# valores), duração, rota e o resultado de EXPLAIN QUERY PLAN, com marcações para leitura da tabela inteira
+# (SCAN sem índice) e ordenação em B-tree temporária. O relatório agrupa o arquivo por consulta:
+#
+#     python database.py consultas [--desde 2025-01-01] [--top 20] [--por semana]
+#
+# Cada worker acrescenta linhas curtas ao mesmo arquivo (modo append); o arquivo não é rotacionado.
+
+import json
+import logging
+import re
+import sqlite3
+import statistics
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO = 'consultas_lentas.jsonl'
+# Comandos sem plano de execução (EXPLAIN QUERY PLAN não se aplica ou não diz nada)
+SEM_PLANO = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'CREATE', 'DROP', 'ALTER', 'ANALYZE',
+             'VACUUM', 'EXPLAIN')
+MARCACOES = {
+    # 'SCAN chamados' ou 'SCAN c': a tabela inteira, sem índice (SCAN ... USING INDEX percorre um índice)
+    'scan_completo': re.compile(r'^SCAN (?!.*\b(?:USING|VIRTUAL TABLE)\b)(?!CONSTANT ROW)'),
+    'btree_temporaria': re.compile(r'^USE TEMP B-TREE'),
+}
+
+
+def formato_parametros(parametros):
+    """Tipos dos parâmetros (ex.: ['int', 'str', 'None'] ou {'q': 'str'}), sem os valores."""
+    if parametros is None:
+        return None
+    if isinstance(parametros, dict):
+        return {nome: type(valor).__name__ for nome, valor in parametros.items()}
+    return [type(valor).__name__ for valor in parametros]
+
+
+def plano(conexao, sql, parametros):
+    """Linhas de EXPLAIN QUERY PLAN (indentadas conforme a árvore), ou None se o comando não tem plano.
+
+    `parametros` None (executemany) planeja com todos os parâmetros nulos.
+    """
+    if not sql.strip() or sql.split(None, 1)[0].upper() in SEM_PLANO:
+        return None
+    if parametros is None:
+        parametros = [None] * sql.count('?')
+    try:
+        # Direto em sqlite3.Connection: não passa pela medição nem gera outra entrada no registro
+        linhas = sqlite3.Connection.execute(conexao, 'EXPLAIN QUERY PLAN ' + sql, parametros).fetchall()
+    except sqlite3.Error as e:
+        return [f'(plano indisponível: {e})']
+    profundidade = {0: -1}
+    resultado = []
+    for id_no, pai, _, detalhe in linhas:
+        profundidade[id_no] = profundidade.get(pai, -1) + 1
+        resultado.append('  ' * profundidade[id_no] + detalhe)
+    return resultado
+
+
+def marcacoes(linhas_plano):
+    return sorted({nome for linha in linhas_plano or () for nome, padrao in MARCACOES.items()
+                   if padrao.match(linha.strip())})
+
+
+def registrar(caminho, conexao, sql, normalizado, parametros, duracao, origem=None):
+    """Acrescenta a consulta lenta ao arquivo `caminho`. Erros de gravação são só registrados no log.
+
+    `parametros` é None para executemany (as linhas já foram consumidas) e executescript.
+    """
+    linhas_plano = plano(conexao, sql, parametros)
+    entrada = {'timestamp': datetime.now().isoformat(' ', timespec='seconds'), 'query': normalizado,
+               'parametros': formato_parametros(parametros), 'duracao_ms': round(duracao * 1000, 2),
+               'origem': origem, 'plano': linhas_plano, 'marcacoes': marcacoes(linhas_plano)}
+    try:
+        with open(caminho, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(json.dumps(entrada, ensure_ascii=False) + '\n')
+    except OSError:
+        logger.exception('Falha ao gravar a consulta lenta em %s.', caminho)
+
+
+def ler(caminho, desde=None):
+    with open(caminho, encoding='utf-8') as arquivo:
+        for linha in arquivo:
+            try:
+                entrada = json.loads(linha)
+            except ValueError:
+                continue
+            if desde is None or entrada['timestamp'] >= desde:
+                yield entrada
+
+
+def _periodo(timestamp, por):
+    data = datetime.fromisoformat(timestamp)
+    if por == 'dia':
+        return data.strftime('%Y-%m-%d')
+    ano, semana, _ = data.isocalendar()
+    return f'{ano}-S{semana:02d}'
+
+
+def relatorio(caminho, desde=None, top=20, por=None):
+    """Texto do relatório: as `top` consultas com maior tempo total, com percentis, rotas, marcações e o
+    plano mais recente. Com `por` ('dia' ou 'semana'), mostra também a mediana de cada período."""
+    grupos = {}
+    for entrada in ler(caminho, desde):
+        grupos.setdefault(entrada['query'], []).append(entrada)
+    if not grupos:
+        return 'Nenhuma consulta lenta registrada.'
+
+    ordenados = sorted(grupos.items(), key=lambda item: -sum(e['duracao_ms'] for e in item[1]))
+    linhas = [f"{len(grupos)} consulta(s) distintas, {sum(len(g) for g in grupos.values())} registro(s).", '']
+    for posicao, (query, entradas) in enumerate(ordenados[:top], 1):
+        duracoes = sorted(e['duracao_ms'] for e in entradas)
+        p95 = duracoes[min(len(duracoes) - 1, int(len(duracoes) * 0.95))]
+        ultima = max(entradas, key=lambda e: e['timestamp'])
+        origens = sorted({e['origem'] or '-' for e in entradas})
+        linhas.append(f"#{posicao} {len(entradas)}x, total {sum(duracoes) / 1000:.1f} s, "
+                      f"p50 {statistics.median(duracoes):.0f} ms, p95 {p95:.0f} ms, máx {duracoes[-1]:.0f} ms")
+        linhas.append(f"   rotas: {', '.join(origens)} | última em {ultima['timestamp']}"
+                      + (f" | {', '.join(ultima['marcacoes']).upper()}" if ultima['marcacoes'] else ''))
+        linhas.append(f"   {query}")
+        if por:
+            periodos = {}
+            for e in entradas:
+                periodos.setdefault(_periodo(e['timestamp'], por), []).append(e['duracao_ms'])
+            linhas.append('   ' + '  '.join(f"{p}: {len(d)}x p50 {statistics.median(d):.0f} ms"
+                                             for p, d in sorted(periodos.items())))
+        for linha_plano in ultima['plano'] or ():
+            linhas.append(f"      {linha_plano}")
+        linhas.append('')
+    return '\n'.join(linhas)
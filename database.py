@@ -1,29 +1,47 @@
 # database.py
 
+import argparse
+import re
 import sqlite3
 import os
-import pandas as pd
-from werkzeug.security import generate_password_hash
+from datetime import datetime
+
+import openpyxl
+
+import consultas_lentas
+import exportacao
+import fotos
+import notificacoes
+from expiracao import expirar_chamados
+from filtros import filtros_chamados
 
 # --- Configurações ---
 INSTANCE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
 DATABASE = os.path.join(INSTANCE_FOLDER, 'chamados.db')
-EXCEL_FILE = 'suporte.xlsx'
+UPLOAD_FOLDER = os.path.join(INSTANCE_FOLDER, 'uploads')
+EXCEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Suporte.xlsx')
 DEFAULT_PASSWORD = '12345'
 
-os.makedirs(INSTANCE_FOLDER, exist_ok=True)
-conn = sqlite3.connect(DATABASE)
-cursor = conn.cursor()
-print("Conectado ao banco de dados.")
+
+def connect(caminho=DATABASE):
+    """Abre uma conexão para os scripts de manutenção (fora do Flask)."""
+    # Com um nome sem pasta (--db sync.db), dirname é '' e o banco fica no diretório atual
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    conn = sqlite3.connect(caminho, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
 
 
-# --- Funções para criar/atualizar as tabelas ---
-def setup_tables():
-    """Cria as tabelas com a nova estrutura."""
+# --- Migrações de esquema ---
+# Cada migração é aplicada uma única vez, em ordem. A versão do esquema fica em PRAGMA user_version,
+# então um banco existente é atualizado sem perder dados. Nunca altere uma migração já publicada:
+# adicione uma nova ao final da lista MIGRATIONS.
 
-    # MUDANÇA: Adicionadas colunas de comportamento na tabela STATUS
-    cursor.execute('DROP TABLE IF EXISTS status')
-    cursor.execute('''
+def _migracao_001_esquema_inicial(conn):
+    """Cria as tabelas base (não altera bancos já existentes)."""
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS status (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         nome TEXT UNIQUE NOT NULL,
@@ -33,45 +51,33 @@ def setup_tables():
         e_final BOOLEAN DEFAULT 0 NOT NULL
     );
     ''')
-    print("Tabela 'status' recriada com colunas de comportamento.")
-
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS tipos_problema (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         nome TEXT UNIQUE NOT NULL
     );
     ''')
-    print("Tabela 'tipos_problema' criada/verificada.")
-
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS configuracoes (
         chave TEXT PRIMARY KEY,
         valor TEXT NOT NULL
     );
     ''')
-    print("Tabela 'configuracoes' criada/verificada.")
-
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
         municipio TEXT NOT NULL, responsavel TEXT NOT NULL, telefone TEXT NOT NULL,
         must_reset_password BOOLEAN DEFAULT 1, is_admin BOOLEAN DEFAULT 0
     );
     ''')
-    print("Tabela 'users' criada/verificada.")
-
-    cursor.execute('DROP TABLE IF EXISTS equipamentos')
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS equipamentos (
         id INTEGER PRIMARY KEY AUTOINCREMENT, municipio TEXT NOT NULL, imei1 TEXT UNIQUE, imei2 TEXT,
         marca TEXT, modelo TEXT, capacidade TEXT, numeroDeSerie TEXT, dataEntrega TEXT,
         localdeUso TEXT, situacao TEXT, patrimonio TEXT
     );
     ''')
-    print("Tabela 'equipamentos' criada/verificada.")
-
-    cursor.execute('DROP TABLE IF EXISTS chamados')
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS chamados (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -90,14 +96,545 @@ def setup_tables():
         FOREIGN KEY (admin_responsavel_id) REFERENCES users (id)
     );
     ''')
-    print("Tabela 'chamados' atualizada/verificada.")
 
-    conn.commit()
 
+def _migracao_002_indices_consultas(conn):
+    """Índices para as consultas de meus_chamados, dashboard, abrir_chamado e index."""
+    # index (KPIs do usuário) e meus_chamados do usuário comum
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_solicitante '
+                 'ON chamados (solicitante_email, status_id, timestamp)')
+    # meus_chamados do admin: chamados atribuídos, ordenados por data
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_admin_responsavel '
+                 'ON chamados (admin_responsavel_id, timestamp)')
+    # meus_chamados do admin (demais chamados) e últimos chamados do dashboard
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_timestamp ON chamados (timestamp)')
+    # contagens por status/tipo do dashboard e filtros de status
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_status ON chamados (status_id, tipo_problema_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_tipo_problema ON chamados (tipo_problema_id)')
+    # filtro e lista de municípios de meus_chamados
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_municipio ON chamados (municipio)')
+    # abrir_chamado / abrir_chamado_admin
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_equipamentos_municipio ON equipamentos (municipio)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_municipio ON users (municipio, is_admin)')
+
+
+def _criar_triggers_versao(conn, nome_versao, tabelas):
+    """Cria triggers que incrementam `versoes.valor` a cada INSERT/UPDATE/DELETE nas tabelas dadas."""
+    conn.execute('INSERT OR IGNORE INTO versoes (nome, valor) VALUES (?, 0)', (nome_versao,))
+    for tabela in tabelas:
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_versao_{nome_versao}_{tabela}_{evento.lower()}
+            AFTER {evento} ON {tabela}
+            BEGIN
+                UPDATE versoes SET valor = valor + 1 WHERE nome = '{nome_versao}';
+            END;
+            ''')
+
+
+def _migracao_003_versoes_lookups(conn):
+    """Contador de versão para invalidar o cache de status, tipos_problema e configuracoes."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS versoes (
+        nome TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    _criar_triggers_versao(conn, 'lookups', ('status', 'tipos_problema', 'configuracoes'))
+
+
+def _migracao_004_indice_expiracao(conn):
+    """Índice usado pela expiração em lotes de chamados resolvidos."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_status_resolvido '
+                 'ON chamados (status_id, resolvido_em) WHERE resolvido_em IS NOT NULL')
+
+
+# Contadores de chamados mantidos por triggers, lidos pelo dashboard e pela página inicial do usuário.
+# Cada entrada: (tabela, colunas-chave). As triggers somam 1 no INSERT, subtraem 1 no DELETE e, no UPDATE,
+# movem a contagem quando alguma das colunas-chave muda.
+TABELAS_KPI = [
+    ('kpi_status', ('status_id',)),
+    ('kpi_tipo_problema', ('tipo_problema_id',)),
+    ('kpi_solicitante_status', ('solicitante_email', 'status_id')),
+]
+
+
+def _sql_incrementar_kpi(tabela, chaves, registro):
+    colunas = ', '.join(chaves)
+    valores = ', '.join(f'{registro}.{c}' for c in chaves)
+    return (f'INSERT INTO {tabela} ({colunas}, total) VALUES ({valores}, 1) '
+            f'ON CONFLICT ({colunas}) DO UPDATE SET total = total + 1;')
+
+
+def _sql_decrementar_kpi(tabela, chaves, registro):
+    filtro = ' AND '.join(f'{c} = {registro}.{c}' for c in chaves)
+    return (f'UPDATE {tabela} SET total = total - 1 WHERE {filtro}; '
+            f'DELETE FROM {tabela} WHERE {filtro} AND total <= 0;')
+
+
+def recalcular_kpis(conn):
+    """Reconstrói as tabelas de KPI a partir da tabela chamados (não faz commit)."""
+    for tabela, chaves in TABELAS_KPI:
+        colunas = ', '.join(chaves)
+        conn.execute(f'DELETE FROM {tabela}')
+        conn.execute(f'INSERT INTO {tabela} ({colunas}, total) '
+                     f'SELECT {colunas}, COUNT(*) FROM chamados GROUP BY {colunas}')
+
+
+def verificar_kpis(conn):
+    """Compara as tabelas de KPI com as agregações ao vivo. Retorna a lista de divergências."""
+    divergencias = []
+    for tabela, chaves in TABELAS_KPI:
+        colunas = ', '.join(chaves)
+        ao_vivo = {tuple(r[:-1]): r[-1] for r in conn.execute(
+            f'SELECT {colunas}, COUNT(*) FROM chamados GROUP BY {colunas}')}
+        contadores = {tuple(r[:-1]): r[-1] for r in conn.execute(
+            f'SELECT {colunas}, total FROM {tabela} WHERE total <> 0')}
+        for chave in sorted(set(ao_vivo) | set(contadores), key=repr):
+            if ao_vivo.get(chave, 0) != contadores.get(chave, 0):
+                divergencias.append((tabela, chave, contadores.get(chave, 0), ao_vivo.get(chave, 0)))
+    return divergencias
+
+
+def _migracao_005_kpis(conn):
+    """Tabelas de contadores (por status, tipo e solicitante) mantidas por triggers em chamados."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS kpi_status (
+        status_id INTEGER PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS kpi_tipo_problema (
+        tipo_problema_id INTEGER PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS kpi_solicitante_status (
+        solicitante_email TEXT NOT NULL,
+        status_id INTEGER NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (solicitante_email, status_id)
+    ) WITHOUT ROWID;
+    ''')
 
-def populate_lookup_tables():
+    for tabela, chaves in TABELAS_KPI:
+        mudou = ' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in chaves)
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_insert AFTER INSERT ON chamados
+        BEGIN
+            {_sql_incrementar_kpi(tabela, chaves, 'NEW')}
+        END;
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_delete AFTER DELETE ON chamados
+        BEGIN
+            {_sql_decrementar_kpi(tabela, chaves, 'OLD')}
+        END;
+        ''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_update AFTER UPDATE OF {', '.join(chaves)} ON chamados
+        WHEN {mudou}
+        BEGIN
+            {_sql_decrementar_kpi(tabela, chaves, 'OLD')}
+            {_sql_incrementar_kpi(tabela, chaves, 'NEW')}
+        END;
+        ''')
+
+    recalcular_kpis(conn)
+
+
+# Formato das entradas que update_chamado/reabrir_chamado acumulavam em chamados.solucao (mais recente primeiro):
+#     [01/09/2025 12:28 - Nome do Autor]:\n<texto>\n-------...-------\n
+SEPARADOR_SOLUCAO = "-" * 50 + "\n"
+_ENTRADA_SOLUCAO = re.compile(r'^\[(\d{2}/\d{2}/\d{4} \d{2}:\d{2}) - (.*?)\]:\n(.*)$', re.DOTALL)
+
+
+def _eventos_do_historico(solucao):
+    """Converte o texto acumulado em chamados.solucao em eventos (timestamp, autor, e_solicitante, texto).
+
+    Os eventos são devolvidos do mais antigo para o mais recente. Trechos fora do formato viram um evento
+    sem data nem autor, para que nenhum texto se perca.
+    """
+    eventos = []
+    for trecho in solucao.split(SEPARADOR_SOLUCAO):
+        trecho = trecho.strip('\n')
+        if not trecho.strip():
+            continue
+        encontrado = _ENTRADA_SOLUCAO.match(trecho)
+        if not encontrado:
+            eventos.append((None, None, False, trecho))
+            continue
+        data, autor, texto = encontrado.groups()
+        e_solicitante = autor.endswith(' (SOLICITANTE)')
+        if e_solicitante:
+            autor = autor[:-len(' (SOLICITANTE)')]
+        timestamp = datetime.strptime(data, '%d/%m/%Y %H:%M').strftime('%Y-%m-%d %H:%M:%S')
+        eventos.append((timestamp, autor, e_solicitante, texto.rstrip('\n')))
+    eventos.reverse()
+    return eventos
+
+
+def _migracao_006_chamado_eventos(conn):
+    """Histórico de chamados em chamado_eventos (uma linha por nota/transição), migrando chamados.solucao."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS chamado_eventos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chamado_id INTEGER NOT NULL,
+        tipo TEXT NOT NULL DEFAULT 'nota',
+        timestamp DATETIME NOT NULL,
+        autor_id INTEGER,
+        autor_nome TEXT,
+        e_solicitante BOOLEAN DEFAULT 0 NOT NULL,
+        status_anterior_id INTEGER,
+        status_novo_id INTEGER,
+        texto TEXT,
+        FOREIGN KEY (chamado_id) REFERENCES chamados (id),
+        FOREIGN KEY (autor_id) REFERENCES users (id)
+    );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamado_eventos_chamado ON chamado_eventos (chamado_id)')
+
+    # O texto antigo guarda só o nome do autor; o id é preenchido quando o nome identifica um único usuário
+    autores = {}
+    for row in conn.execute('SELECT responsavel, MIN(id), COUNT(*) FROM users GROUP BY responsavel'):
+        if row[2] == 1:
+            autores[row[0]] = row[1]
+
+    chamados = conn.execute("SELECT id, timestamp, solucao FROM chamados "
+                            "WHERE solucao IS NOT NULL AND solucao <> '' ORDER BY id").fetchall()
+    for chamado_id, aberto_em, solucao in chamados:
+        for timestamp, autor, e_solicitante, texto in _eventos_do_historico(solucao):
+            tipo = 'reabertura' if e_solicitante and texto.startswith('CHAMADO REABERTO') else 'nota'
+            conn.execute(
+                'INSERT INTO chamado_eventos (chamado_id, tipo, timestamp, autor_id, autor_nome, e_solicitante, texto) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (chamado_id, tipo, timestamp or aberto_em, autores.get(autor), autor, e_solicitante, texto))
+
+
+# Colunas de equipamentos pesquisáveis pela busca do formulário de abertura de chamado (/equipamentos/busca)
+COLUNAS_BUSCA_EQUIPAMENTOS = ('imei1', 'imei2', 'numeroDeSerie', 'patrimonio', 'marca', 'modelo')
+
+
+def _migracao_007_busca_equipamentos(conn):
+    """Índice FTS5 de equipamentos (IMEI, série, patrimônio, modelo) e tabela de municípios pré-calculada."""
+    colunas = ', '.join(COLUNAS_BUSCA_EQUIPAMENTOS)
+    novos = ', '.join(f'NEW.{c}' for c in COLUNAS_BUSCA_EQUIPAMENTOS)
+    antigos = ', '.join(f'OLD.{c}' for c in COLUNAS_BUSCA_EQUIPAMENTOS)
+    # Tabela de conteúdo externo: o índice aponta para equipamentos.id, sem duplicar o texto.
+    # prefix='2 3 4' acelera as buscas por prefixo curto, as mais comuns enquanto o usuário digita.
+    conn.execute(f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS equipamentos_fts USING fts5(
+        {colunas},
+        content='equipamentos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    );
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_equipamentos_fts_insert AFTER INSERT ON equipamentos
+    BEGIN
+        INSERT INTO equipamentos_fts (rowid, {colunas}) VALUES (NEW.id, {novos});
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_equipamentos_fts_delete AFTER DELETE ON equipamentos
+    BEGIN
+        INSERT INTO equipamentos_fts (equipamentos_fts, rowid, {colunas}) VALUES ('delete', OLD.id, {antigos});
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_equipamentos_fts_update AFTER UPDATE ON equipamentos
+    BEGIN
+        INSERT INTO equipamentos_fts (equipamentos_fts, rowid, {colunas}) VALUES ('delete', OLD.id, {antigos});
+        INSERT INTO equipamentos_fts (rowid, {colunas}) VALUES (NEW.id, {novos});
+    END;
+    ''')
+    conn.execute("INSERT INTO equipamentos_fts (equipamentos_fts) VALUES ('rebuild')")
+
+    # Lista de municípios do abrir_chamado_admin (antes um SELECT DISTINCT sobre todos os equipamentos),
+    # mantida pelas mesmas triggers de contagem usadas nos KPIs
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS municipios (
+        municipio TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    ''')
+    chaves = ('municipio',)
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_municipios_insert AFTER INSERT ON equipamentos
+    BEGIN
+        {_sql_incrementar_kpi('municipios', chaves, 'NEW')}
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_municipios_delete AFTER DELETE ON equipamentos
+    BEGIN
+        {_sql_decrementar_kpi('municipios', chaves, 'OLD')}
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_municipios_update AFTER UPDATE OF municipio ON equipamentos
+    WHEN OLD.municipio IS NOT NEW.municipio
+    BEGIN
+        {_sql_decrementar_kpi('municipios', chaves, 'OLD')}
+        {_sql_incrementar_kpi('municipios', chaves, 'NEW')}
+    END;
+    ''')
+    conn.execute('DELETE FROM municipios')
+    conn.execute('INSERT INTO municipios (municipio, total) SELECT municipio, COUNT(*) FROM equipamentos GROUP BY municipio')
+
+
+def _migracao_008_busca_chamados(conn):
+    """Índice FTS5 das observações e notas de cada chamado, usado pela busca (q=) de /meus_chamados."""
+    # Uma linha por chamado (rowid = chamados.id). O índice guarda o próprio texto para que snippet()
+    # possa destacar os trechos encontrados; como chamado_eventos só recebe INSERTs, cada nota nova é
+    # simplesmente concatenada à coluna `notas`.
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS chamados_fts USING fts5(
+        observacoes, notas,
+        tokenize='unicode61 remove_diacritics 2', prefix='3'
+    );
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_chamados_fts_insert AFTER INSERT ON chamados
+    BEGIN
+        INSERT INTO chamados_fts (rowid, observacoes, notas) VALUES (NEW.id, NEW.observacoes, '');
+    END;
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_chamados_fts_update AFTER UPDATE OF observacoes ON chamados
+    WHEN OLD.observacoes IS NOT NEW.observacoes
+    BEGIN
+        UPDATE chamados_fts SET observacoes = NEW.observacoes WHERE rowid = NEW.id;
+    END;
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_chamados_fts_delete AFTER DELETE ON chamados
+    BEGIN
+        DELETE FROM chamados_fts WHERE rowid = OLD.id;
+    END;
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_chamados_fts_evento AFTER INSERT ON chamado_eventos
+    WHEN NEW.texto IS NOT NULL AND NEW.texto <> ''
+    BEGIN
+        UPDATE chamados_fts SET notas = notas || char(10) || NEW.texto WHERE rowid = NEW.chamado_id;
+    END;
+    ''')
+
+    conn.execute('DELETE FROM chamados_fts')
+    conn.execute('''
+    INSERT INTO chamados_fts (rowid, observacoes, notas)
+    SELECT c.id, c.observacoes,
+           COALESCE((SELECT group_concat(texto, char(10)) FROM (
+                         SELECT texto FROM chamado_eventos
+                         WHERE chamado_id = c.id AND texto IS NOT NULL AND texto <> ''
+                         ORDER BY id)), '')
+    FROM chamados c
+    ''')
+
+
+# Colunas de users pesquisáveis pela busca de /admin/
+COLUNAS_BUSCA_USUARIOS = ('responsavel', 'email', 'municipio', 'telefone')
+
+
+def _migracao_009_busca_usuarios(conn):
+    """Índice FTS5 de usuários (nome, e-mail, município, telefone) e índice por nome para a paginação."""
+    colunas = ', '.join(COLUNAS_BUSCA_USUARIOS)
+    novos = ', '.join(f'NEW.{c}' for c in COLUNAS_BUSCA_USUARIOS)
+    antigos = ', '.join(f'OLD.{c}' for c in COLUNAS_BUSCA_USUARIOS)
+    # remove_diacritics: "joao" encontra "João". O tokenizador trigram só ignora acentos a partir do
+    # SQLite 3.45, então a busca é por prefixo de palavra (e-mail e telefone também são quebrados em palavras).
+    conn.execute(f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        {colunas},
+        content='users', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO users_fts (rowid, {colunas}) VALUES (NEW.id, {novos});
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, {colunas}) VALUES ('delete', OLD.id, {antigos});
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_update AFTER UPDATE OF {colunas} ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, {colunas}) VALUES ('delete', OLD.id, {antigos});
+        INSERT INTO users_fts (rowid, {colunas}) VALUES (NEW.id, {novos});
+    END;
+    ''')
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    # admin_index: lista ordenada por nome, paginada por cursor em (responsavel, id)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_responsavel ON users (responsavel)')
+
+
+def _migracao_010_referencias_fotos(conn):
+    """Contagem de referências a cada foto (chamados.foto), usada para apagar as fotos que nenhum chamado usa."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fotos (
+        foto TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    ''')
+    chaves = ('foto',)
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fotos_insert AFTER INSERT ON chamados
+    WHEN NEW.foto IS NOT NULL
+    BEGIN
+        {_sql_incrementar_kpi('fotos', chaves, 'NEW')}
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fotos_delete AFTER DELETE ON chamados
+    WHEN OLD.foto IS NOT NULL
+    BEGIN
+        {_sql_decrementar_kpi('fotos', chaves, 'OLD')}
+    END;
+    ''')
+    # Duas triggers de UPDATE porque a foto antiga ou a nova podem ser NULL
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fotos_update_antiga AFTER UPDATE OF foto ON chamados
+    WHEN OLD.foto IS NOT NEW.foto AND OLD.foto IS NOT NULL
+    BEGIN
+        {_sql_decrementar_kpi('fotos', chaves, 'OLD')}
+    END;
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_fotos_update_nova AFTER UPDATE OF foto ON chamados
+    WHEN OLD.foto IS NOT NEW.foto AND NEW.foto IS NOT NULL
+    BEGIN
+        {_sql_incrementar_kpi('fotos', chaves, 'NEW')}
+    END;
+    ''')
+    conn.execute('DELETE FROM fotos')
+    conn.execute('INSERT INTO fotos (foto, total) SELECT foto, COUNT(*) FROM chamados WHERE foto IS NOT NULL GROUP BY foto')
+
+
+def _migracao_011_versao_usuarios(conn):
+    """Contador de versão para invalidar o cache de perfis de usuário (perfis.py)."""
+    _criar_triggers_versao(conn, 'usuarios', ('users',))
+
+
+def _migracao_012_notificacoes(conn):
+    """Caixa de saída de notificações (notificacoes.py), preenchida por triggers na abertura e em cada evento."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS notificacoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chamado_id INTEGER NOT NULL,
+        evento_id INTEGER,
+        tipo TEXT NOT NULL,
+        criado_em DATETIME NOT NULL,
+        proxima_tentativa_em DATETIME NOT NULL,
+        reservado_ate DATETIME,
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        email_enviado_em DATETIME,
+        webhook_enviado_em DATETIME,
+        enviado_em DATETIME,
+        falhou_em DATETIME,
+        ultimo_erro TEXT,
+        FOREIGN KEY (chamado_id) REFERENCES chamados (id),
+        FOREIGN KEY (evento_id) REFERENCES chamado_eventos (id)
+    );
+    ''')
+    # Só as pendentes ficam no índice, então a busca do worker não cresce com o histórico de enviadas
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notificacoes_pendentes ON notificacoes (proxima_tentativa_em) '
+                 'WHERE enviado_em IS NULL AND falhou_em IS NULL')
+    # Mesmo formato (hora local) que datetime.now() grava no restante do sistema
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_notificacoes_abertura AFTER INSERT ON chamados
+    BEGIN
+        INSERT INTO notificacoes (chamado_id, tipo, criado_em, proxima_tentativa_em)
+        VALUES (NEW.id, 'abertura', datetime('now', 'localtime'), datetime('now', 'localtime'));
+    END;
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_notificacoes_evento AFTER INSERT ON chamado_eventos
+    BEGIN
+        INSERT INTO notificacoes (chamado_id, evento_id, tipo, criado_em, proxima_tentativa_em)
+        VALUES (NEW.chamado_id, NEW.id, NEW.tipo, datetime('now', 'localtime'), datetime('now', 'localtime'));
+    END;
+    ''')
+
+
+def _migracao_013_versao_chamados(conn):
+    """Contador de versão dos chamados e do histórico, usado nas ETags de /meus_chamados (GET condicional)."""
+    _criar_triggers_versao(conn, 'chamados', ('chamados', 'chamado_eventos'))
+
+
+def _migracao_014_origem_usuarios(conn):
+    """Coluna users.origem: a sincronização com a planilha só remove as contas que vieram dela."""
+    conn.execute('ALTER TABLE users ADD COLUMN origem TEXT')
+
+
+def _migracao_015_indice_municipio_data(conn):
+    """Índice (municipio, timestamp, id) no lugar de idx_chamados_municipio, para a lista filtrada por município."""
+    # A lista ordena por (timestamp, id): com o índice só em municipio, o SQLite ordenava numa B-tree temporária
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_municipio_timestamp ON chamados (municipio, timestamp, id)')
+    conn.execute('DROP INDEX IF EXISTS idx_chamados_municipio')
+
+
+def _migracao_016_indice_solicitante_data(conn):
+    """Índice (solicitante_email, timestamp, id) no lugar de idx_chamados_solicitante, para "meus chamados"."""
+    # A lista do usuário ordena por (timestamp, id); com status_id no meio do índice antigo, o SQLite ordenava
+    # todos os chamados do solicitante. Os KPIs por status vêm de kpi_solicitante_status (migração 005).
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chamados_solicitante_timestamp '
+                 'ON chamados (solicitante_email, timestamp, id)')
+    conn.execute('DROP INDEX IF EXISTS idx_chamados_solicitante')
+
+
+MIGRATIONS = [
+    _migracao_001_esquema_inicial,
+    _migracao_002_indices_consultas,
+    _migracao_003_versoes_lookups,
+    _migracao_004_indice_expiracao,
+    _migracao_005_kpis,
+    _migracao_006_chamado_eventos,
+    _migracao_007_busca_equipamentos,
+    _migracao_008_busca_chamados,
+    _migracao_009_busca_usuarios,
+    _migracao_010_referencias_fotos,
+    _migracao_011_versao_usuarios,
+    _migracao_012_notificacoes,
+    _migracao_013_versao_chamados,
+    _migracao_014_origem_usuarios,
+    _migracao_015_indice_municipio_data,
+    _migracao_016_indice_solicitante_data,
+]
+
+
+def migrate(conn):
+    """Aplica as migrações pendentes, cada uma em sua própria transação. Retorna a versão final."""
+    versao_atual = conn.execute('PRAGMA user_version').fetchone()[0]
+    for versao, migracao in enumerate(MIGRATIONS, start=1):
+        if versao <= versao_atual:
+            continue
+        conn.execute('BEGIN')
+        try:
+            migracao(conn)
+            conn.execute(f'PRAGMA user_version = {versao}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migração {versao:03d} aplicada: {migracao.__doc__}")
+        versao_atual = versao
+
+    conn.execute('PRAGMA optimize')
+    return versao_atual
+
+
+# --- Funções para popular as tabelas ---
+def populate_lookup_tables(conn):
     """Popula as novas tabelas com valores e comportamentos padrão."""
-    # MUDANÇA: Inserção dos comportamentos padrão para cada status
     default_status = [
         # nome, e_inicial, e_em_atendimento, permite_reabertura, e_final
         ('Aberto', 1, 0, 0, 0),
@@ -109,7 +646,6 @@ def populate_lookup_tables():
     ]
     default_problemas = ['Octostudio', 'Sistema Operacional', 'Hardware/Dispositivo', 'Dúvidas/Outros']
 
-    # MUDANÇA: Adicionadas configurações de fluxo de trabalho
     default_config = [
         ('prazo_vermelho', '10'),
         ('prazo_amarelo', '5'),
@@ -119,83 +655,348 @@ def populate_lookup_tables():
     ]
 
     try:
-        cursor.executemany(
+        conn.executemany(
             "INSERT OR IGNORE INTO status (nome, e_inicial, e_em_atendimento, permite_reabertura, e_final) VALUES (?, ?, ?, ?, ?)",
             default_status)
-        cursor.executemany("INSERT OR IGNORE INTO tipos_problema (nome) VALUES (?)", [(p,) for p in default_problemas])
-        cursor.executemany("INSERT OR IGNORE INTO configuracoes (chave, valor) VALUES (?, ?)", default_config)
+        conn.executemany("INSERT OR IGNORE INTO tipos_problema (nome) VALUES (?)", [(p,) for p in default_problemas])
+        conn.executemany("INSERT OR IGNORE INTO configuracoes (chave, valor) VALUES (?, ?)", default_config)
         conn.commit()
         print("Tabelas 'status', 'tipos_problema' e 'configuracoes' populadas com valores e comportamentos padrão.")
     except Exception as e:
         print(f"Erro ao popular tabelas de lookup: {e}")
 
 
-# ... O resto do arquivo (populate_users, populate_equipamentos, etc.) permanece o mesmo ...
+# --- Sincronização com a planilha ---
+# As abas são lidas linha a linha (openpyxl em modo read-only) e comparadas com o banco pela chave natural:
+# e-mail (sem diferenciar maiúsculas) para usuários e IMEI 1 para equipamentos. Só as diferenças são gravadas,
+# em lote e numa única transação; chamados nunca são alterados.
+
+MAPA_COLUNAS_USUARIOS = {
+    'email': 'email', 'e-mail': 'email',
+    'município': 'municipio', 'municipio': 'municipio',
+    'responsável': 'responsavel', 'responsavel': 'responsavel',
+    'telefone': 'telefone',
+    'is_admin': 'is_admin', 'admin': 'is_admin',
+}
+MAPA_COLUNAS_EQUIPAMENTOS = {
+    'município': 'municipio', 'municipio': 'municipio',
+    'imei1': 'imei1', 'imei 1': 'imei1', 'imei2': 'imei2', 'imei 2': 'imei2',
+    'marca': 'marca', 'modelo': 'modelo', 'capacidade': 'capacidade',
+    'numero de serie': 'numeroDeSerie', 'numerodeserie': 'numeroDeSerie',
+    'data da entrega': 'dataEntrega', 'dataentrega': 'dataEntrega',
+    'local de uso': 'localdeUso', 'localdeuso': 'localdeUso',
+    'situação': 'situacao', 'situacao': 'situacao', 'patrimonio': 'patrimonio', 'patrimônio': 'patrimonio',
+}
+# Colunas gravadas a partir da planilha (e-mail/IMEI são as chaves; senha e flags de usuário existentes
+# não são tocadas)
+CAMPOS_USUARIOS = ('municipio', 'responsavel', 'telefone')
+# users.origem das contas criadas ou confirmadas pela sincronização (as demais ficam NULL)
+ORIGEM_PLANILHA = 'planilha'
+CAMPOS_EQUIPAMENTOS = ('municipio', 'imei2', 'marca', 'modelo', 'capacidade', 'numeroDeSerie', 'dataEntrega',
+                       'localdeUso', 'situacao', 'patrimonio')
+
+
+def _valor_planilha(valor):
+    """Converte uma célula para o texto gravado no banco (o mesmo formato que a importação via pandas gerava)."""
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    valor = str(valor)
+    return valor if valor.strip() else None
+
+
+def ler_aba(workbook, aba, mapa_colunas):
+    """Gera um dict por linha da aba, com as colunas renomeadas por `mapa_colunas` (as demais são ignoradas)."""
+    linhas = workbook[aba].iter_rows(values_only=True)
+    cabecalho = next(linhas, ())
+    colunas = [(i, mapa_colunas[str(nome).lower().strip()]) for i, nome in enumerate(cabecalho)
+               if nome is not None and str(nome).lower().strip() in mapa_colunas]
+    for linha in linhas:
+        registro = {campo: _valor_planilha(linha[i]) if i < len(linha) else None for i, campo in colunas}
+        if any(v is not None for v in registro.values()):
+            yield registro
+
+
+def _novo_resumo():
+    return {'inseridos': 0, 'atualizados': 0, 'removidos': 0, 'inalterados': 0, 'ignorados': 0, 'mantidos': 0}
+
+
+def sincronizar_usuarios(conn, registros):
+    """Aplica a aba 'Cadastro' à tabela users (não faz commit). Retorna o resumo das mudanças.
+
+    Os usuários são casados pelo e-mail exato: users.email diferencia maiúsculas, e a base tem contas
+    distintas que só mudam na caixa (ex.: mail@Adrianópolis e mail@adrianópolis). Um e-mail da planilha sem
+    correspondente exato, mas igual a um e-mail existente ignorando maiúsculas, não é inserido nem aplicado a
+    nenhuma conta: vai para `conflitos` (pares planilha/banco), para ser corrigido à mão.
+
+    Só são removidos os usuários que vieram da planilha (users.origem = 'planilha') e saíram dela; contas
+    criadas em /admin/add_user, administradores e quem tem chamados (como solicitante ou responsável) ficam,
+    contados em `mantidos`. O e-mail de um usuário existente nunca é reescrito, pois os chamados o referenciam.
+    """
+    resumo = dict(_novo_resumo(), conflitos=[])
+    existentes = {row['email']: row for row in conn.execute(f'''
+        SELECT u.id, u.email, u.is_admin, u.origem, {', '.join(f'u.{c}' for c in CAMPOS_USUARIOS)},
+               EXISTS (SELECT 1 FROM chamados c WHERE c.solicitante_email = u.email) OR
+               EXISTS (SELECT 1 FROM chamados c WHERE c.admin_responsavel_id = u.id) AS tem_chamados
+        FROM users u
+    ''')}
+    por_email_minusculo = {}
+    for email in existentes:
+        por_email_minusculo.setdefault(email.strip().lower(), []).append(email)
+
+    planilha = {}
+    for registro in registros:
+        email = (registro.get('email') or '').strip()
+        if not email or not registro.get('municipio') or not registro.get('responsavel'):
+            resumo['ignorados'] += 1
+            continue
+        planilha[email] = dict(registro, email=email)
+
+    inserir, atualizar, marcar = [], [], []
+    for email, registro in planilha.items():
+        valores = tuple(registro.get(c) or '' for c in CAMPOS_USUARIOS)
+        atual = existentes.get(email)
+        if atual is None:
+            parecidos = [e for e in por_email_minusculo.get(email.lower(), ()) if e not in planilha]
+            if parecidos:
+                resumo['conflitos'].extend((email, parecido) for parecido in parecidos)
+                continue
+            admin = 1 if str(registro.get('is_admin') or '').strip().lower() in ('1', 'sim', 'true') else 0
+            inserir.append((registro['email'], DEFAULT_PASSWORD, *valores, 1, admin))
+        elif valores != tuple(atual[c] for c in CAMPOS_USUARIOS):
+            atualizar.append((*valores, atual['id']))
+        else:
+            resumo['inalterados'] += 1
+            if atual['origem'] != ORIGEM_PLANILHA:
+                marcar.append((atual['id'],))
+
+    # A conta do banco num conflito não é removida: a planilha provavelmente só grafou o e-mail diferente
+    em_conflito = {existente for _, existente in resumo['conflitos']}
+    remover = []
+    for email, atual in existentes.items():
+        if email not in planilha:
+            if (atual['is_admin'] or atual['tem_chamados'] or atual['origem'] != ORIGEM_PLANILHA
+                    or email in em_conflito):
+                resumo['mantidos'] += 1
+            else:
+                remover.append((atual['id'],))
+
+    conn.executemany(
+        f"INSERT INTO users (email, password, {', '.join(CAMPOS_USUARIOS)}, must_reset_password, is_admin, origem) "
+        f"VALUES (?, ?, {', '.join('?' for _ in CAMPOS_USUARIOS)}, ?, ?, '{ORIGEM_PLANILHA}')", inserir)
+    conn.executemany(f"UPDATE users SET {', '.join(f'{c} = ?' for c in CAMPOS_USUARIOS)}, "
+                     f"origem = '{ORIGEM_PLANILHA}' WHERE id = ?", atualizar)
+    # Contas que já estavam iguais à planilha passam a ser reconhecidas como vindas dela
+    conn.executemany(f"UPDATE users SET origem = '{ORIGEM_PLANILHA}' WHERE id = ?", marcar)
+    conn.executemany("DELETE FROM users WHERE id = ?", remover)
+    resumo.update(inseridos=len(inserir), atualizados=len(atualizar), removidos=len(remover))
+    return resumo
+
+
+def sincronizar_equipamentos(conn, registros):
+    """Aplica a aba 'equipamentos' à tabela equipamentos, pelo IMEI 1 (não faz commit). Retorna o resumo.
+
+    Equipamentos que não estão na planilha são removidos; os chamados que os citam continuam intactos.
+    """
+    resumo = _novo_resumo()
+    existentes = {row['imei1']: row for row in
+                  conn.execute(f"SELECT id, imei1, {', '.join(CAMPOS_EQUIPAMENTOS)} FROM equipamentos")}
+
+    planilha = {}
+    for registro in registros:
+        imei = (registro.get('imei1') or '').strip()
+        if not imei or not registro.get('municipio'):
+            resumo['ignorados'] += 1
+            continue
+        planilha[imei] = registro
+
+    inserir, atualizar = [], []
+    for imei, registro in planilha.items():
+        valores = tuple(registro.get(c) for c in CAMPOS_EQUIPAMENTOS)
+        atual = existentes.get(imei)
+        if atual is None:
+            inserir.append((imei, *valores))
+        elif valores != tuple(atual[c] for c in CAMPOS_EQUIPAMENTOS):
+            atualizar.append((*valores, atual['id']))
+        else:
+            resumo['inalterados'] += 1
+    remover = [(atual['id'],) for imei, atual in existentes.items() if imei not in planilha]
+
+    conn.executemany(
+        f"INSERT INTO equipamentos (imei1, {', '.join(CAMPOS_EQUIPAMENTOS)}) "
+        f"VALUES (?, {', '.join('?' for _ in CAMPOS_EQUIPAMENTOS)})", inserir)
+    conn.executemany(f"UPDATE equipamentos SET {', '.join(f'{c} = ?' for c in CAMPOS_EQUIPAMENTOS)} WHERE id = ?",
+                     atualizar)
+    conn.executemany("DELETE FROM equipamentos WHERE id = ?", remover)
+    resumo.update(inseridos=len(inserir), atualizados=len(atualizar), removidos=len(remover))
+    return resumo
+
+
+def sincronizar_planilha(conn, caminho, simular=False):
+    """Sincroniza usuários e equipamentos com a planilha numa única transação. Retorna {aba: resumo}.
+
+    Com `simular`, as mudanças são calculadas e desfeitas no final.
+    """
+    workbook = openpyxl.load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        # IMMEDIATE: reserva a escrita já no início; leitores (a aplicação, em WAL) seguem funcionando
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            resumos = {
+                'Cadastro': sincronizar_usuarios(conn, ler_aba(workbook, 'Cadastro', MAPA_COLUNAS_USUARIOS)),
+                'equipamentos': sincronizar_equipamentos(
+                    conn, ler_aba(workbook, 'equipamentos', MAPA_COLUNAS_EQUIPAMENTOS)),
+            }
+            if simular:
+                conn.rollback()
+            else:
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        workbook.close()
+    return resumos
+
+
+# --- Comandos ---
+def cmd_init(conn, args):
+    """Cria um banco novo: aplica as migrações e popula com os valores padrão e a planilha."""
+    migrate(conn)
+    populate_lookup_tables(conn)
+
+    if os.path.exists(args.planilha):
+        cmd_sync(conn, args)
+    else:
+        print(
+            f"\nAVISO: '{args.planilha}' não encontrado. As tabelas foram criadas, mas não populadas com dados da planilha.")
+
+
+def cmd_migrate(conn, args):
+    """Atualiza o esquema de um banco existente sem apagar dados."""
+    versao = migrate(conn)
+    print(f"Esquema na versão {versao}.")
 
 
-def populate_users():
-    """Lê a aba 'Cadastro' e insere/atualiza usuários."""
+def cmd_sync(conn, args):
+    """Sincroniza usuários e equipamentos com a planilha (só grava as diferenças)."""
+    resumos = sincronizar_planilha(conn, args.planilha, simular=args.simular)
+    for aba, resumo in resumos.items():
+        conflitos = resumo.pop('conflitos', [])
+        print(f"{aba}: " + ', '.join(f"{total} {acao}" for acao, total in resumo.items())
+              + (f", {len(conflitos)} conflitos" if conflitos else ''))
+        for email, existente in conflitos:
+            print(f"  Conflito: '{email}' (planilha) difere só nas maiúsculas de '{existente}' (banco); não aplicado.")
+    if args.simular:
+        print("Simulação: nenhuma alteração foi gravada.")
+
+
+def cmd_exportar(conn, args):
+    """Exporta os chamados (CSV ou XLSX) com os filtros de /meus_chamados (--status, --municipio, ...)."""
+    conditions, params = filtros_chamados(args.status, args.municipio, args.tipo_problema,
+                                          'finalizados' if args.finalizados else None, args.busca)
+    saida = args.saida or f"chamados.{args.formato}"
+    with open(saida, 'wb') as arquivo:
+        for bloco in exportacao.exportar(conn, args.formato, conditions, params):
+            arquivo.write(bloco)
+    print(f"Chamados exportados para '{saida}'.")
+
+
+def cmd_fotos(conn, args):
+    """Processa as fotos pendentes, gera as miniaturas que faltam e apaga as fotos sem chamado."""
+    resumo = fotos.processar_pendentes(UPLOAD_FOLDER)
+    referenciadas = [r['foto'] for r in conn.execute('SELECT foto FROM fotos WHERE total > 0')]
+    resumo['arquivos removidos'] = fotos.remover_orfas(UPLOAD_FOLDER, referenciadas)
+    print(', '.join(f"{total} {acao}" for acao, total in resumo.items()))
+
+
+def cmd_notificar(conn, args):
+    """Entrega as notificações pendentes (e-mail/webhook configurados pelas variáveis SMTP_* e NOTIFICACOES_*)."""
+    enviadas, falhas = notificacoes.processar_fila(conn, notificacoes.Configuracao.do_ambiente())
+    print(f"{enviadas} notificação(ões) enviada(s), {falhas} com falha.")
+
+
+def cmd_expirar(conn, args):
+    """Encerra os chamados resolvidos cujo prazo de reabertura já expirou."""
+    total = expirar_chamados(conn)
+    print(f"{total} chamado(s) movido(s) para o status de expirado.")
+
+
+def cmd_kpis(conn, args):
+    """Confere os contadores do dashboard com as agregações ao vivo e os reconstrói do zero."""
+    divergencias = verificar_kpis(conn)
+    for tabela, chave, contador, ao_vivo in divergencias:
+        print(f"Divergência em {tabela} {chave}: contador={contador}, ao vivo={ao_vivo}")
+    print(f"{len(divergencias)} divergência(s) encontrada(s). Reconstruindo contadores...")
+
+    conn.execute('BEGIN IMMEDIATE')
     try:
-        df = pd.read_excel(EXCEL_FILE, sheet_name='Cadastro')
-        df.columns = [str(col).lower().strip() for col in df.columns]
-
-        for index, row in df.iterrows():
-            cursor.execute("SELECT id FROM users WHERE email = ?", (row['email'],))
-            if cursor.fetchone() is None:
-                is_admin_flag = 1 if 'admin' in df.columns and str(row.get('admin', '')).lower() == 'sim' else 0
-                cursor.execute(
-                    "INSERT INTO users (email, password, municipio, responsavel, telefone, must_reset_password, is_admin) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (row['email'], DEFAULT_PASSWORD, row['município'], row['responsável'], str(row['telefone']), 1,
-                     is_admin_flag)
-                )
+        recalcular_kpis(conn)
         conn.commit()
-        print("Usuários populados com sucesso.")
-    except Exception as e:
-        print(f"\nAVISO: Não foi possível popular usuários. Aba 'Cadastro' não encontrada ou erro: {e}")
+    except Exception:
+        conn.rollback()
+        raise
 
+    restantes = verificar_kpis(conn)
+    if restantes:
+        raise SystemExit(f"ERRO: {len(restantes)} divergência(s) após a reconstrução.")
+    print("Contadores reconstruídos e conferidos.")
 
-def populate_equipamentos():
-    """Lê a aba de equipamentos da planilha e insere os dados na nova tabela."""
-    try:
-        df = pd.read_excel(EXCEL_FILE, sheet_name='equipamentos')
-
-        df.columns = [str(col).lower().strip() for col in df.columns]
-
-        column_map = {
-            'município': 'municipio', 'imei 1': 'imei1', 'imei 2': 'imei2',
-            'marca': 'marca', 'modelo': 'modelo', 'capacidade': 'capacidade',
-            'numero de serie': 'numeroDeSerie', 'numerodeserie': 'numeroDeSerie',
-            'data da entrega': 'dataEntrega', 'dataentrega': 'dataEntrega',
-            'local de uso': 'localdeUso', 'localdeuso': 'localdeUso',
-            'situação': 'situacao', 'patrimonio': 'patrimonio'
-        }
-        df.rename(columns=column_map, inplace=True)
-
-        expected_cols = [
-            'municipio', 'imei1', 'imei2', 'marca', 'modelo', 'capacidade',
-            'numeroDeSerie', 'dataEntrega', 'localdeUso', 'situacao', 'patrimonio'
-        ]
-
-        df_cols_to_insert = {col: df[col] for col in expected_cols if col in df.columns}
-        df_to_insert = pd.DataFrame(df_cols_to_insert)
-
-        df_to_insert.to_sql('equipamentos', conn, if_exists='append', index=False)
-        print("Equipamentos populados com sucesso.")
-    except Exception as e:
-        print(f"\nAVISO: Não foi possível popular equipamentos. Aba 'equipamentos' não encontrada ou erro: {e}")
 
+def cmd_consultas(conn, args):
+    """Relatório das consultas lentas registradas (instance/consultas_lentas.jsonl), agrupadas por consulta."""
+    caminho = args.log or os.path.join(INSTANCE_FOLDER, consultas_lentas.ARQUIVO)
+    if not os.path.exists(caminho):
+        raise SystemExit(f"ERRO: '{caminho}' não existe (nenhuma consulta passou de CONSULTA_LENTA_MS).")
+    print(consultas_lentas.relatorio(caminho, args.desde, args.top, args.por))
 
-# --- Execução Principal ---
-if __name__ == '__main__':
-    setup_tables()
-    populate_lookup_tables()
 
-    if os.path.exists(EXCEL_FILE):
-        populate_users()
-        populate_equipamentos()
-    else:
-        print(
-            f"\nAVISO: '{EXCEL_FILE}' não encontrado. As tabelas foram criadas, mas não populadas com dados da planilha.")
+COMMANDS = {
+    'init': cmd_init,
+    'migrate': cmd_migrate,
+    'sync': cmd_sync,
+    'exportar': cmd_exportar,
+    'fotos': cmd_fotos,
+    'notificar': cmd_notificar,
+    'expirar': cmd_expirar,
+    'kpis': cmd_kpis,
+    'consultas': cmd_consultas,
+}
+
 
-    conn.close()
-    print("\nProcesso de inicialização do banco de dados concluído.")
\ No newline at end of file
+# --- Execução Principal ---
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Manutenção do banco de dados de chamados.',
+        epilog='comandos:\n' + '\n'.join(f'  {nome:<10} {cmd.__doc__}' for nome, cmd in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('comando', nargs='?', default='init', choices=list(COMMANDS),
+                        help='Comando a executar (padrão: init).')
+    parser.add_argument('--db', default=DATABASE, help='Caminho do arquivo SQLite (padrão: instance/chamados.db).')
+    parser.add_argument('--planilha', default=EXCEL_FILE, help='Planilha de usuários e equipamentos (padrão: Suporte.xlsx).')
+    parser.add_argument('--simular', action='store_true', help='sync: mostra o resumo sem gravar as mudanças.')
+    exportar = parser.add_argument_group('exportar')
+    exportar.add_argument('--formato', choices=list(exportacao.FORMATOS), default='csv')
+    exportar.add_argument('--saida', help='Arquivo de saída (padrão: chamados.<formato>).')
+    exportar.add_argument('--status', type=int, help='Id do status.')
+    exportar.add_argument('--municipio')
+    exportar.add_argument('--tipo-problema', type=int, help='Id do tipo de problema.')
+    exportar.add_argument('--finalizados', action='store_true', help='Só chamados em status final.')
+    exportar.add_argument('--busca', help='Texto buscado nas observações e notas.')
+    consultas = parser.add_argument_group('consultas')
+    consultas.add_argument('--log', help='Registro de consultas lentas (padrão: instance/consultas_lentas.jsonl).')
+    consultas.add_argument('--desde', help='Só registros a partir desta data (AAAA-MM-DD).')
+    consultas.add_argument('--top', type=int, default=20, help='Quantidade de consultas mostradas.')
+    consultas.add_argument('--por', choices=['dia', 'semana'], help='Mediana de cada período, para ver regressões.')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    print("Conectado ao banco de dados.")
+    try:
+        COMMANDS[args.comando](conn, args)
+    finally:
+        conn.close()
+    print("\nProcesso concluído.")
@@ -0,0 +1,97 @@
+# expiracao.py - Encerramento automático de chamados resolvidos cujo prazo de reabertura já passou
+#
+# Antes isso era um UPDATE na tabela inteira executado a cada visita a /meus_chamados. Agora roda em
+# lotes, em uma thread de fundo de cada worker (ver `iniciar`) ou pela linha de comando:
+#
+#     python database.py expirar
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import lookups
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 500
+
+
+def expirar_chamados(db, lote=TAMANHO_LOTE, agora=None):
+    """Move para `status_expirado_id` os chamados resolvidos há mais de `prazo_reabrir` dias.
+
+    Cada lote é confirmado separadamente, para não segurar o lock de escrita do banco por muito tempo.
+    Retorna o total de chamados alterados.
+    """
+    cadastros = lookups.obter(db)
+    status_expirado_id = cadastros.status_expirado_id
+    if not status_expirado_id:
+        return 0
+
+    # Se o status de expiração também permitisse reabertura, os chamados movidos continuariam selecionados e o
+    # laço abaixo não terminaria
+    status_reabriveis = [s['id'] for s in cadastros.status
+                         if s['permite_reabertura'] and s['id'] != status_expirado_id]
+    if not status_reabriveis:
+        return 0
+
+    # resolvido_em é gravado com datetime.now(), no mesmo formato de isoformat(' ')
+    limite = ((agora or datetime.now()) - timedelta(days=cadastros.prazo_reabrir)).isoformat(' ')
+    marcadores = ', '.join('?' for _ in status_reabriveis)
+    # Usa idx_chamados_status_resolvido: uma busca por faixa de resolvido_em para cada status reabrível
+    query = f"""
+        UPDATE chamados SET status_id = ?
+        WHERE id IN (
+            SELECT id FROM chamados
+            WHERE status_id IN ({marcadores}) AND resolvido_em IS NOT NULL AND resolvido_em <= ?
+            LIMIT ?
+        )
+    """
+
+    total = 0
+    while True:
+        cursor = db.execute(query, (status_expirado_id, *status_reabriveis, limite, lote))
+        db.commit()
+        total += cursor.rowcount
+        if cursor.rowcount < lote:
+            break
+    return total
+
+
+_thread = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _executar_periodicamente(conectar, intervalo):
+    while True:
+        try:
+            db = conectar()
+            try:
+                total = expirar_chamados(db)
+            finally:
+                db.close()
+            if total:
+                logger.info('%d chamado(s) expirado(s).', total)
+        except Exception:
+            logger.exception('Falha ao expirar chamados.')
+        time.sleep(intervalo)
+
+
+def iniciar(conectar, intervalo):
+    """Inicia (uma vez por processo) a thread que expira chamados a cada `intervalo` segundos.
+
+    `conectar` é uma função que abre uma nova conexão. Com `intervalo` <= 0 nada é iniciado, e a
+    expiração fica a cargo do comando `python database.py expirar` (por exemplo, via cron).
+    """
+    global _thread, _pid
+    if intervalo <= 0 or (_thread is not None and _pid == os.getpid()):
+        return
+    with _lock:
+        if _thread is not None and _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        _thread = threading.Thread(target=_executar_periodicamente, args=(conectar, intervalo),
+                                   name='expiracao-chamados', daemon=True)
+        _thread.start()
@@ -0,0 +1,127 @@
+# exportacao.py - Exportação de chamados em CSV ou XLSX, com os mesmos filtros de /meus_chamados
+#
+# Usada pela rota /admin/exportar (resposta em streaming) e pela linha de comando:
+#
+#     python database.py exportar --formato xlsx --saida chamados.xlsx --municipio Curitiba
+#
+# As linhas são lidas do cursor em lotes de TAMANHO_LOTE, então a memória usada não cresce com o número
+# de chamados exportados. O CSV sai em streaming desde o primeiro lote; o XLSX só fica pronto no fim, por isso
+# a rota limita o XLSX a EXPORTACAO_XLSX_MAXIMO chamados (acima disso, CSV ou a linha de comando).
+
+import csv
+import io
+import os
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+TAMANHO_LOTE = 1000
+TAMANHO_BLOCO_ARQUIVO = 64 * 1024
+# Textos que o Excel/LibreOffice interpretam como fórmula ao abrir um CSV
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+EXPORTACAO_QUERY = """
+    SELECT c.id, c.timestamp, c.municipio, c.solicitante_email, s.nome as status_nome,
+           tp.nome as tipo_problema_nome, u.responsavel as admin_responsavel_nome, c.resolvido_em,
+           c.smartphone_imei, e.marca, e.modelo, e.patrimonio, e.numeroDeSerie, c.observacoes
+    FROM chamados c
+    JOIN status s ON c.status_id = s.id
+    JOIN tipos_problema tp ON c.tipo_problema_id = tp.id
+    LEFT JOIN users u ON c.admin_responsavel_id = u.id
+    LEFT JOIN equipamentos e ON c.smartphone_imei = e.imei1
+    WHERE 1 = 1
+"""
+CABECALHO = ['Chamado', 'Data de abertura', 'Município', 'Solicitante', 'Status', 'Tipo de problema',
+             'Responsável', 'Resolvido em', 'IMEI', 'Marca', 'Modelo', 'Patrimônio', 'Nº de série', 'Observações']
+
+CONTAGEM_QUERY = """
+    SELECT COUNT(*) FROM (
+        SELECT 1 FROM chamados c JOIN status s ON c.status_id = s.id WHERE 1 = 1 {conditions} LIMIT ?
+    )
+"""
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+def _lotes(db, conditions, params):
+    cursor = db.execute(EXPORTACAO_QUERY + conditions + " ORDER BY c.timestamp, c.id", params)
+    while True:
+        lote = cursor.fetchmany(TAMANHO_LOTE)
+        if not lote:
+            break
+        yield lote
+
+
+def excede(db, conditions, params, maximo):
+    """True se os filtros selecionam mais de `maximo` chamados (conta só até maximo + 1)."""
+    total, = db.execute(CONTAGEM_QUERY.format(conditions=conditions), list(params) + [maximo + 1]).fetchone()
+    return total > maximo
+
+
+def _texto_csv(valor):
+    """Prefixa com `'` os textos que seriam lidos como fórmula (observações, nomes, etc. vêm dos usuários)."""
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def exportar_csv(db, conditions, params):
+    """Gera o CSV em blocos de bytes, um por lote de chamados.
+
+    Usa `;` como separador e BOM UTF-8, que é o que o Excel em português espera para abrir o arquivo direto.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow(CABECALHO)
+    for lote in _lotes(db, conditions, params):
+        escritor.writerows([_texto_csv(valor) for valor in linha] for linha in lote)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _celula_xlsx(planilha, valor):
+    if not (isinstance(valor, str) and valor.startswith('=')):
+        return valor
+    celula = WriteOnlyCell(planilha, valor)
+    celula.data_type = 's'
+    return celula
+
+
+def exportar_xlsx(db, conditions, params):
+    """Gera o XLSX em blocos de bytes.
+
+    No modo write-only o openpyxl grava as linhas num arquivo temporário em vez de mantê-las em memória,
+    mas o .xlsx (um zip) só fica pronto no save(): os bytes começam a sair depois que todas as linhas
+    foram escritas. Textos começados por `=` vão como célula de texto (o openpyxl os gravaria como fórmula).
+    """
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet('Chamados')
+    planilha.append(CABECALHO)
+    for lote in _lotes(db, conditions, params):
+        for linha in lote:
+            planilha.append([_celula_xlsx(planilha, valor) for valor in linha])
+
+    descritor, caminho = tempfile.mkstemp(suffix='.xlsx')
+    os.close(descritor)
+    try:
+        workbook.save(caminho)
+        with open(caminho, 'rb') as arquivo:
+            while bloco := arquivo.read(TAMANHO_BLOCO_ARQUIVO):
+                yield bloco
+    finally:
+        os.remove(caminho)
+
+
+def exportar(db, formato, conditions, params):
+    """Gerador de bytes do arquivo no `formato` dado ('csv' ou 'xlsx')."""
+    if formato == 'xlsx':
+        return exportar_xlsx(db, conditions, params)
+    return exportar_csv(db, conditions, params)
@@ -0,0 +1,40 @@
+# filtros.py - Filtros da lista de chamados, compartilhados por /meus_chamados, pela exportação e pela CLI
+#
+# As condições são escritas sobre `chamados c JOIN status s` e devolvidas como um trecho " AND ..." para
+# ser acrescentado depois do WHERE de cada consulta.
+
+import re
+
+
+def expressao_fts(termo):
+    """Converte o texto digitado em uma consulta FTS5 em que cada palavra é buscada por prefixo.
+
+    As aspas impedem que o texto seja interpretado como sintaxe FTS5. Retorna None se não houver palavras.
+    """
+    palavras = re.findall(r'\w+', termo or '')
+    return ' '.join(f'"{p}"*' for p in palavras) or None
+
+
+def filtros_chamados(status_id=None, municipio=None, tipo_problema_id=None, status_group=None, busca=None):
+    """Condições e parâmetros dos filtros de /meus_chamados.
+
+    `busca` (texto digitado) só filtra, pelo índice chamados_fts; a ordenação por relevância fica com quem
+    chama. Retorna (condições, parâmetros).
+    """
+    conditions, params = "", []
+    if status_id:
+        conditions += " AND c.status_id = ?"
+        params.append(status_id)
+    if municipio:
+        conditions += " AND c.municipio = ?"
+        params.append(municipio)
+    if tipo_problema_id:
+        conditions += " AND c.tipo_problema_id = ?"
+        params.append(tipo_problema_id)
+    if status_group == 'finalizados':
+        conditions += " AND s.e_final = 1"
+    expressao = expressao_fts(busca)
+    if expressao:
+        conditions += " AND c.id IN (SELECT rowid FROM chamados_fts WHERE chamados_fts MATCH ?)"
+        params.append(expressao)
+    return conditions, params
@@ -0,0 +1,274 @@
+# fotos.py - Tratamento das fotos anexadas aos chamados
+#
+# A foto recebida em /submit_chamado é validada na própria requisição (formato e dimensões, lendo só o
+# cabeçalho) e gravada em `uploads/pendentes`. O trabalho pesado roda num pool de processos, fora da
+# requisição: corrige a orientação, descarta os metadados EXIF (inclusive GPS), reduz para no máximo
+# LADO_MAXIMO pixels, regrava como JPEG e gera a miniatura usada na listagem.
+#
+# O nome do arquivo é o SHA-256 do conteúdo enviado: a mesma foto enviada duas vezes é gravada e processada
+# uma vez só, e um arquivo nunca muda depois de gravado (pode ficar em cache para sempre). As referências
+# em chamados.foto são contadas na tabela `fotos`, e as fotos sem referência são apagadas pela linha de
+# comando, junto com o processamento de fotos pendentes que sobraram (por exemplo, se o servidor caiu) e
+# a geração das miniaturas de fotos antigas:
+#
+#     python database.py fotos
+#
+# As pendentes que sobraram também são reenviadas ao pool na primeira requisição de cada worker (ver
+# `retomar_pendentes`), e enquanto não ficam prontas /uploads/<foto> serve o arquivo original.
+
+import contextlib
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+FORMATOS_ACEITOS = {'JPEG': '.jpg', 'PNG': '.png'}
+LADO_MAXIMO = 1600
+LADO_MINIATURA = 320
+QUALIDADE_JPEG = 82
+QUALIDADE_MINIATURA = 70
+# Recusa imagens gigantes (descompressão de um PNG pequeno pode ocupar gigabytes de memória)
+MAXIMO_PIXELS = 50_000_000
+PASTA_PENDENTES = 'pendentes'
+SUFIXO_MINIATURA = '_mini.jpg'
+TAMANHO_BLOCO = 64 * 1024
+# Fotos sem referência só são apagadas depois desse tempo: o arquivo é gravado antes do INSERT do chamado
+IDADE_MINIMA_ORFA = 3600
+
+Image.MAX_IMAGE_PIXELS = MAXIMO_PIXELS
+
+
+class FotoInvalida(ValueError):
+    pass
+
+
+def nome_miniatura(foto):
+    return os.path.splitext(foto)[0] + SUFIXO_MINIATURA
+
+
+def validar(arquivo):
+    """Confere se o arquivo enviado é um JPEG ou PNG de tamanho aceitável e devolve a extensão a usar.
+
+    Só o cabeçalho é lido; o arquivo volta para o início no final.
+    """
+    try:
+        with Image.open(arquivo) as imagem:
+            formato, (largura, altura) = imagem.format, imagem.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise FotoInvalida('O arquivo enviado não é uma imagem válida.')
+    finally:
+        arquivo.seek(0)
+    if formato not in FORMATOS_ACEITOS:
+        raise FotoInvalida('Formato de imagem não suportado. Envie uma foto JPG ou PNG.')
+    if largura * altura > MAXIMO_PIXELS:
+        raise FotoInvalida('A imagem enviada tem dimensões grandes demais.')
+    return FORMATOS_ACEITOS[formato]
+
+
+def _salvar_jpeg(imagem, caminho, qualidade):
+    # Grava num arquivo temporário e renomeia, para nunca servir um JPEG pela metade. O pid no nome evita
+    # que dois processos tratando a mesma foto (ver `retomar_pendentes`) gravem no mesmo temporário.
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    imagem.save(temporario, 'JPEG', quality=qualidade, optimize=True, progressive=True)
+    os.replace(temporario, caminho)
+
+
+def _abrir_rgb(caminho, lado):
+    """Abre a imagem já na orientação correta, em RGB (transparência vira fundo branco), com no máximo `lado`
+    pixels."""
+    with Image.open(caminho) as imagem:
+        # Para JPEG, decodifica direto numa resolução reduzida (bem mais rápido em fotos de celular)
+        imagem.draft('RGB', (lado, lado))
+        imagem = ImageOps.exif_transpose(imagem)
+        if imagem.mode != 'RGB':
+            imagem = imagem.convert('RGBA')
+            fundo = Image.new('RGB', imagem.size, 'white')
+            fundo.paste(imagem, mask=imagem.getchannel('A'))
+            imagem = fundo
+        imagem.thumbnail((lado, lado), Image.LANCZOS)
+        # Imagem nova (sem `info`), então nenhum metadado da original é gravado
+        limpa = Image.new('RGB', imagem.size)
+        limpa.paste(imagem)
+        return limpa
+
+
+def processar(origem, pasta, foto):
+    """Gera `pasta/foto` (JPEG reduzido, sem EXIF) e a miniatura a partir de `origem`.
+
+    Roda nos processos do pool. Se `origem` for um arquivo diferente do destino, ele é apagado no final.
+    """
+    try:
+        imagem = _abrir_rgb(origem, LADO_MAXIMO)
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(pasta, foto)):
+            # Já processada por outro processo, que apagou a pendente
+            return
+        raise
+    _salvar_jpeg(imagem, os.path.join(pasta, foto), QUALIDADE_JPEG)
+    imagem.thumbnail((LADO_MINIATURA, LADO_MINIATURA), Image.LANCZOS)
+    _salvar_jpeg(imagem, os.path.join(pasta, nome_miniatura(foto)), QUALIDADE_MINIATURA)
+
+    if os.path.abspath(origem) != os.path.abspath(os.path.join(pasta, foto)):
+        # Duas cópias da mesma foto enviadas ao mesmo tempo podem ser processadas em paralelo
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(origem)
+
+
+_pool = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _obter_pool(processos):
+    global _pool, _pid
+    with _lock:
+        if _pool is None or _pid != os.getpid():
+            # spawn: o worker do gunicorn tem threads (ex.: expiração), e fork com threads ativas é arriscado
+            _pool = ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn'))
+            _pid = os.getpid()
+        return _pool
+
+
+def _registrar_falha(foto):
+    def callback(futuro):
+        erro = futuro.exception()
+        if erro is not None:
+            logger.error('Falha ao processar a foto %s.', foto, exc_info=erro)
+    return callback
+
+
+def receber(arquivo, pasta, processos=2):
+    """Valida a foto enviada (FileStorage), grava em `pasta/pendentes` e agenda o processamento.
+
+    O hash é calculado enquanto o arquivo é copiado para o disco. Se a mesma foto já foi recebida, nada é
+    gravado. Devolve o nome final da foto (`<sha256>.jpg`), a ser gravado em chamados.foto. Levanta
+    `FotoInvalida`.
+    """
+    extensao = validar(arquivo.stream)
+    pendentes = os.path.join(pasta, PASTA_PENDENTES)
+    os.makedirs(pendentes, exist_ok=True)
+
+    resumo = hashlib.sha256()
+    descritor, temporario = tempfile.mkstemp(dir=pendentes, suffix='.tmp')
+    with os.fdopen(descritor, 'wb') as destino:
+        while bloco := arquivo.stream.read(TAMANHO_BLOCO):
+            resumo.update(bloco)
+            destino.write(bloco)
+
+    nome = resumo.hexdigest()
+    foto = nome + '.jpg'
+    origem = os.path.join(pendentes, nome + extensao)
+    # Nessa ordem: o processamento grava a foto final antes de apagar a pendente
+    if os.path.exists(origem) or os.path.exists(os.path.join(pasta, foto)):
+        os.remove(temporario)
+        return foto
+    os.replace(temporario, origem)
+    _obter_pool(processos).submit(processar, origem, pasta, foto).add_done_callback(_registrar_falha(foto))
+    return foto
+
+
+def caminho_pendente(pasta, foto):
+    """Arquivo original da `foto` (`<sha256>.jpg`) ainda em `pasta/pendentes`, ou None."""
+    nome = os.path.splitext(os.path.basename(foto))[0]
+    for extensao in set(FORMATOS_ACEITOS.values()):
+        caminho = os.path.join(pasta, PASTA_PENDENTES, nome + extensao)
+        if os.path.isfile(caminho):
+            return caminho
+    return None
+
+
+_retomado_pid = None
+
+
+def retomar_pendentes(pasta, processos=2):
+    """Reenvia ao pool (uma vez por processo) as fotos que estão em `pasta/pendentes`.
+
+    Elas ficaram para trás quando o servidor parou ou o worker caiu antes de processá-las. Uma foto que outro
+    worker ainda está processando pode ser processada duas vezes, sem problema: o resultado é o mesmo e a
+    segunda cópia só encontra a pendente já apagada. Devolve quantas foram reenviadas.
+    """
+    global _retomado_pid
+    with _lock:
+        if _retomado_pid == os.getpid():
+            return 0
+        _retomado_pid = os.getpid()
+    pendentes = os.path.join(pasta, PASTA_PENDENTES)
+    if not os.path.isdir(pendentes):
+        return 0
+    antigas = [nome for nome in sorted(os.listdir(pendentes)) if not nome.endswith('.tmp')]
+    if antigas:
+        logger.warning('%d foto(s) pendente(s) em %s; reenviadas para processamento.', len(antigas), pendentes)
+        pool = _obter_pool(processos)
+        for nome in antigas:
+            foto = os.path.splitext(nome)[0] + '.jpg'
+            pool.submit(processar, os.path.join(pendentes, nome), pasta, foto).add_done_callback(
+                _registrar_falha(foto))
+    return len(antigas)
+
+
+def processar_pendentes(pasta):
+    """Processa, no processo atual, as fotos pendentes e gera as miniaturas que faltam. Devolve um resumo."""
+    resumo = {'processadas': 0, 'miniaturas': 0, 'falhas': 0}
+    pendentes = os.path.join(pasta, PASTA_PENDENTES)
+    if os.path.isdir(pendentes):
+        for nome in sorted(os.listdir(pendentes)):
+            if nome.endswith('.tmp'):
+                continue
+            try:
+                processar(os.path.join(pendentes, nome), pasta, os.path.splitext(nome)[0] + '.jpg')
+                resumo['processadas'] += 1
+            except Exception:
+                logger.exception('Falha ao processar a foto pendente %s.', nome)
+                resumo['falhas'] += 1
+
+    for nome in sorted(os.listdir(pasta)):
+        caminho = os.path.join(pasta, nome)
+        if (not os.path.isfile(caminho) or nome.endswith(SUFIXO_MINIATURA) or nome.endswith('.tmp')
+                or os.path.exists(os.path.join(pasta, nome_miniatura(nome)))):
+            continue
+        try:
+            # Fotos antigas mantêm o arquivo original (o nome está gravado nos chamados); só ganham a miniatura
+            _salvar_jpeg(_abrir_rgb(caminho, LADO_MINIATURA), os.path.join(pasta, nome_miniatura(nome)),
+                         QUALIDADE_MINIATURA)
+            resumo['miniaturas'] += 1
+        except Exception:
+            logger.exception('Falha ao gerar a miniatura de %s.', nome)
+            resumo['falhas'] += 1
+    return resumo
+
+
+def _principal(nome):
+    # Nome sem extensão da foto a que o arquivo pertence (a própria foto ou a sua miniatura)
+    if nome.endswith(SUFIXO_MINIATURA):
+        return nome[:-len(SUFIXO_MINIATURA)]
+    return os.path.splitext(nome)[0]
+
+
+def remover_orfas(pasta, referenciadas, idade_minima=IDADE_MINIMA_ORFA):
+    """Apaga as fotos (e miniaturas) que nenhum chamado referencia. Devolve a quantidade de arquivos apagados.
+
+    `referenciadas` são os nomes gravados em chamados.foto (tabela `fotos`). Arquivos modificados há menos
+    de `idade_minima` segundos são mantidos, para não apagar a foto de um chamado que ainda está sendo aberto.
+    """
+    principais = {os.path.splitext(foto)[0] for foto in referenciadas}
+    limite = time.time() - idade_minima
+    removidos = 0
+    for pasta_atual in (pasta, os.path.join(pasta, PASTA_PENDENTES)):
+        if not os.path.isdir(pasta_atual):
+            continue
+        for nome in os.listdir(pasta_atual):
+            caminho = os.path.join(pasta_atual, nome)
+            if (not os.path.isfile(caminho) or _principal(nome) in principais
+                    or os.path.getmtime(caminho) > limite):
+                continue
+            os.remove(caminho)
+            removidos += 1
+    return removidos
@@ -0,0 +1,37 @@
+# fragmentos.py - Cache em memória do HTML das linhas da listagem de chamados
+#
+# Cada linha de /meus_chamados é gerada por uma macro de templates/linhas_chamados.html a partir de uma
+# única linha de CHAMADOS_LISTA_QUERY, que já traz tudo o que aparece na tela (status, responsável, cor da
+# borda pela idade, janela de reabertura). A chave do cache é a própria linha da consulta (id e todos os
+# valores, que fazem o papel de versão) mais a variante da tabela e o trecho da busca: qualquer mudança no
+# chamado, no cadastro de status ou no nome do responsável gera uma chave nova, sem precisar de invalidação.
+# As entradas antigas saem pelo LRU, limitado a `capacidade` linhas por worker.
+
+import threading
+from collections import OrderedDict
+
+import metricas
+
+CAPACIDADE = 5000
+
+_fragmentos = OrderedDict()
+_lock = threading.Lock()
+
+
+def obter(chave, renderizar, capacidade=CAPACIDADE):
+    """HTML em cache para `chave`; se não houver, chama `renderizar()` e guarda o resultado."""
+    with _lock:
+        html = _fragmentos.get(chave)
+        if html is not None:
+            _fragmentos.move_to_end(chave)
+    if html is not None:
+        metricas.incrementar('chamados_fragmentos_total', ('acerto',))
+        return html
+
+    metricas.incrementar('chamados_fragmentos_total', ('falta',))
+    html = renderizar()
+    with _lock:
+        _fragmentos[chave] = html
+        while len(_fragmentos) > capacidade:
+            _fragmentos.popitem(last=False)
+    return html
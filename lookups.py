@@ -0,0 +1,95 @@
+# lookups.py - Cache em memória das tabelas pequenas (status, tipos_problema e configuracoes)
+#
+# Essas tabelas quase nunca mudam, mas eram lidas em praticamente toda requisição. O cache guarda um
+# instantâneo imutável por processo (worker do gunicorn). Triggers criadas na migração 003 incrementam a
+# linha 'lookups' da tabela `versoes` a cada escrita nessas tabelas, então cada worker só precisa comparar
+# esse número (uma busca por chave primária) para saber se o seu instantâneo ainda é válido.
+
+from dataclasses import dataclass, field
+
+VERSAO_LOOKUPS = 'lookups'
+
+
+@dataclass(frozen=True)
+class Lookups:
+    versao: int
+    status: list = field(default_factory=list)
+    tipos_problema: list = field(default_factory=list)
+    configs: dict = field(default_factory=dict)
+    status_por_id: dict = field(default_factory=dict)
+
+    def _config_int(self, chave, padrao=None):
+        try:
+            return int(self.configs[chave])
+        except (KeyError, TypeError, ValueError):
+            return padrao
+
+    @property
+    def status_inicial(self):
+        """Primeiro status marcado como inicial, ou None se nenhum estiver configurado."""
+        return next((s for s in self.status_por_id.values() if s['e_inicial']), None)
+
+    @property
+    def status_inicial_id(self):
+        status = self.status_inicial
+        return status['id'] if status else None
+
+    def status_info(self, status_id):
+        """Linha do status (com as flags de comportamento) pelo id; aceita id em texto vindo de formulários."""
+        try:
+            return self.status_por_id.get(int(status_id))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def prazo_reabrir(self):
+        return self._config_int('prazo_reabrir', 3)
+
+    @property
+    def prazo_vermelho(self):
+        return self._config_int('prazo_vermelho', 10)
+
+    @property
+    def prazo_amarelo(self):
+        return self._config_int('prazo_amarelo', 5)
+
+    @property
+    def status_capturado_id(self):
+        return self._config_int('status_capturado_id')
+
+    @property
+    def status_expirado_id(self):
+        return self._config_int('status_expirado_id')
+
+
+_cache = None
+
+
+def versao_atual(db, nome):
+    row = db.execute('SELECT valor FROM versoes WHERE nome = ?', (nome,)).fetchone()
+    return row[0] if row else 0
+
+
+def _carregar(db, versao):
+    status = [dict(row) for row in db.execute('SELECT * FROM status ORDER BY nome').fetchall()]
+    tipos_problema = [dict(row) for row in db.execute('SELECT * FROM tipos_problema ORDER BY nome').fetchall()]
+    configs = {row['chave']: row['valor'] for row in db.execute('SELECT chave, valor FROM configuracoes').fetchall()}
+    return Lookups(versao=versao, status=status, tipos_problema=tipos_problema, configs=configs,
+                   status_por_id={s['id']: s for s in sorted(status, key=lambda s: s['id'])})
+
+
+def obter(db):
+    """Retorna o instantâneo atual, recarregando-o se outro worker (ou este) alterou as tabelas."""
+    global _cache
+    versao = versao_atual(db, VERSAO_LOOKUPS)
+    atual = _cache
+    if atual is None or atual.versao != versao:
+        atual = _carregar(db, versao)
+        _cache = atual
+    return atual
+
+
+def invalidar():
+    """Descarta o instantâneo deste processo (as triggers já cuidam dos demais workers)."""
+    global _cache
+    _cache = None
@@ -0,0 +1,277 @@
+# metricas.py - Tempo das rotas e das consultas SQL, exportado no formato de texto do Prometheus
+#
+# app.py mede cada requisição (before_request/after_request) e abre as conexões com ConexaoMedida, que
+# cronometra cada execute/executemany/executescript. Os tempos vão para histogramas por rota e por consulta
+# (o texto do SQL normalizado: espaços colapsados, literais e listas de `?` trocados por marcadores). Só o
+# execute é cronometrado: no SQLite ele já calcula ordenações e agregações e devolve a primeira linha, mas as
+# demais linhas lidas depois (fetchall, iteração do cursor, como na exportação) ficam de fora.
+#
+# Cada worker do gunicorn tem os próprios histogramas; a cada INTERVALO_GRAVACAO segundos (e a cada leitura
+# de /metrics) o worker grava um retrato em `<pasta>/<pid>-<marca>.json`, e /metrics soma os retratos dos
+# workers vivos. A marca (boot do sistema + instante em que o processo começou, lidos de /proc) distingue um
+# worker novo que recebeu o pid de um que já terminou. Arquivos de workers que já terminaram são apagados: o
+# Prometheus trata a queda dos contadores como reinício. Sem /proc (fora do Linux) o arquivo é `<pid>.json` e
+# só se verifica se o pid existe.
+
+import contextlib
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import consultas_lentas
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+INTERVALO_GRAVACAO = 5
+TAMANHO_MAXIMO_CONSULTA = 300
+
+# nome: (tipo, descrição, rótulos, buckets)
+DEFINICOES = {
+    'chamados_http_requests_total': (
+        'counter', 'Requisições atendidas.', ('endpoint', 'method', 'status'), None),
+    'chamados_http_request_duration_seconds': (
+        'histogram', 'Duração das requisições (até a resposta ser devolvida ao servidor).', ('endpoint', 'method'),
+        BUCKETS_SEGUNDOS),
+    'chamados_http_db_duration_seconds': (
+        'histogram', 'Tempo gasto em consultas SQL por requisição.', ('endpoint',), BUCKETS_SEGUNDOS),
+    'chamados_http_render_duration_seconds': (
+        'histogram', 'Tempo gasto renderizando templates por requisição.', ('endpoint',), BUCKETS_SEGUNDOS),
+    'chamados_http_db_queries': (
+        'histogram', 'Consultas SQL executadas por requisição.', ('endpoint',), BUCKETS_CONSULTAS),
+    'chamados_fragmentos_total': (
+        'counter', 'Linhas da listagem de chamados servidas do cache (acerto) ou renderizadas (falta).',
+        ('resultado',), None),
+    'chamados_db_query_duration_seconds': (
+        'histogram', 'Duração de cada consulta SQL (execute), por texto normalizado.', ('query',), BUCKETS_SEGUNDOS),
+}
+
+# (nome, rótulos) -> [contagem de cada bucket..., contagem total, soma]; contadores usam só [valor]
+_series = {}
+_lock = threading.Lock()
+_gravado_em = 0.0
+
+
+@functools.lru_cache(maxsize=2048)
+def normalizar(sql):
+    """Texto da consulta usado como rótulo: uma linha, sem literais, com `IN (?, ?, ...)` de qualquer tamanho
+    agrupados."""
+    sql = ' '.join(sql.split())
+    sql = re.sub(r"'(?:[^']|'')*'", "'?'", sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', sql)
+    return sql[:TAMANHO_MAXIMO_CONSULTA]
+
+
+def observar(nome, rotulos, valor):
+    buckets = DEFINICOES[nome][3]
+    with _lock:
+        serie = _series.get((nome, rotulos))
+        if serie is None:
+            serie = _series[(nome, rotulos)] = [0] * (len(buckets) + 2)
+        for i, limite in enumerate(buckets):
+            if valor <= limite:
+                serie[i] += 1
+                break
+        serie[-2] += 1
+        serie[-1] += valor
+
+
+def incrementar(nome, rotulos, valor=1):
+    with _lock:
+        serie = _series.setdefault((nome, rotulos), [0])
+        serie[0] += valor
+
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão (usar como `factory` de sqlite3.connect) que cronometra cada comando.
+
+    `consultas` e `tempo_consultas` acumulam até `zerar_medicao()`, chamada no início de cada requisição com
+    a rota atual (`origem`). Comandos que levam `limite_lenta` segundos ou mais (0 desativa) são gravados em
+    `arquivo_lentas` (ver consultas_lentas.py).
+    """
+    limite_lenta = 0
+    arquivo_lentas = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.zerar_medicao()
+
+    def zerar_medicao(self, origem=None):
+        self.consultas = 0
+        self.tempo_consultas = 0.0
+        self.origem = origem
+
+    def _registrar(self, sql, parametros, inicio):
+        duracao = time.perf_counter() - inicio
+        self.consultas += 1
+        self.tempo_consultas += duracao
+        normalizado = normalizar(sql)
+        observar('chamados_db_query_duration_seconds', (normalizado,), duracao)
+        if self.limite_lenta and duracao >= self.limite_lenta and self.arquivo_lentas:
+            consultas_lentas.registrar(self.arquivo_lentas, self, sql, normalizado, parametros, duracao, self.origem)
+
+    def execute(self, sql, parametros=(), /):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            self._registrar(sql, parametros, inicio)
+
+    def executemany(self, sql, parametros, /):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            self._registrar(sql, None, inicio)
+
+    def executescript(self, script, /):
+        inicio = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            self._registrar(script, None, inicio)
+
+
+def registrar_requisicao(endpoint, metodo, status, duracao, conexao, tempo_render):
+    """Registra uma requisição atendida. `conexao` é a ConexaoMedida usada (ou None, se não houve banco)."""
+    incrementar('chamados_http_requests_total', (endpoint, metodo, str(status)))
+    observar('chamados_http_request_duration_seconds', (endpoint, metodo), duracao)
+    observar('chamados_http_render_duration_seconds', (endpoint,), tempo_render)
+    observar('chamados_http_db_duration_seconds', (endpoint,), conexao.tempo_consultas if conexao else 0.0)
+    observar('chamados_http_db_queries', (endpoint,), conexao.consultas if conexao else 0)
+
+
+def server_timing(duracao, conexao, tempo_render):
+    """Valor do cabeçalho Server-Timing: banco, renderização e total, em milissegundos."""
+    consultas, tempo_db = (conexao.consultas, conexao.tempo_consultas) if conexao else (0, 0.0)
+    return (f'db;dur={tempo_db * 1000:.1f};desc="{consultas} consultas", '
+            f'render;dur={tempo_render * 1000:.1f}, total;dur={duracao * 1000:.1f}')
+
+
+def _retrato():
+    with _lock:
+        return [[nome, list(rotulos), list(valores)] for (nome, rotulos), valores in _series.items()]
+
+
+def gravar(pasta, forcar=False):
+    """Grava o retrato deste worker em `pasta/<pid>-<marca>.json`, no máximo a cada INTERVALO_GRAVACAO
+    segundos."""
+    global _gravado_em
+    agora = time.monotonic()
+    if not forcar and agora - _gravado_em < INTERVALO_GRAVACAO:
+        return
+    _gravado_em = agora
+    os.makedirs(pasta, exist_ok=True)
+    pid = os.getpid()
+    caminho = os.path.join(pasta, _nome_retrato(pid, _marca_processo(pid)))
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(_retrato(), arquivo)
+    os.replace(caminho + '.tmp', caminho)
+
+
+@functools.lru_cache(maxsize=1)
+def _boot():
+    try:
+        with open('/proc/sys/kernel/random/boot_id', encoding='ascii') as arquivo:
+            return arquivo.read().strip()[:8]
+    except OSError:
+        return None
+
+
+def _marca_processo(pid):
+    """Identifica esta execução do processo `pid`: boot + início do processo (em ticks desde o boot), ou ''
+    sem /proc. None se o processo não existe."""
+    try:
+        with open(f'/proc/{pid}/stat', encoding='ascii', errors='replace') as arquivo:
+            campos = arquivo.read()
+    except FileNotFoundError:
+        if os.path.isdir('/proc/self'):
+            return None
+        return '' if _processo_vivo(pid) else None
+    except OSError:
+        return None
+    # O nome do comando (2º campo, entre parênteses) pode ter espaços; o início é o 22º campo
+    inicio = campos[campos.rindex(')') + 2:].split()[19]
+    return f'{_boot()}.{inicio}'
+
+
+def _nome_retrato(pid, marca):
+    return f'{pid}-{marca}.json' if marca else f'{pid}.json'
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _somar_retratos(pasta):
+    total = {}
+    for nome_arquivo in os.listdir(pasta):
+        pid, _, marca = nome_arquivo[:-len('.json')].partition('-')
+        if not nome_arquivo.endswith('.json') or not pid.isdigit():
+            continue
+        caminho = os.path.join(pasta, nome_arquivo)
+        # Pid reaproveitado por outro processo: a marca não confere e o retrato antigo é descartado
+        if _marca_processo(int(pid)) != marca:
+            # Outro worker atendendo /metrics ao mesmo tempo pode ter apagado o arquivo primeiro
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(caminho)
+            continue
+        try:
+            with open(caminho, encoding='utf-8') as arquivo:
+                retrato = json.load(arquivo)
+        except (OSError, ValueError):
+            continue
+        for nome, rotulos, valores in retrato:
+            if nome not in DEFINICOES:
+                continue
+            serie = total.setdefault((nome, tuple(rotulos)), [0] * len(valores))
+            for i, valor in enumerate(valores):
+                serie[i] += valor
+    return total
+
+
+def _rotulos(nomes, valores, extra=''):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def exportar(pasta):
+    """Métricas de todos os workers no formato de texto do Prometheus (versão 0.0.4)."""
+    gravar(pasta, forcar=True)
+    series = _somar_retratos(pasta)
+    linhas = []
+    for nome, (tipo, descricao, nomes_rotulos, buckets) in DEFINICOES.items():
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for (nome_serie, rotulos), valores in sorted(series.items()):
+            if nome_serie != nome:
+                continue
+            if tipo == 'counter':
+                linhas.append(f'{nome}{_rotulos(nomes_rotulos, rotulos)} {valores[0]}')
+                continue
+            acumulado = 0
+            for limite, contagem in zip(buckets, valores):
+                acumulado += contagem
+                le = f'le="{limite}"'
+                linhas.append(f'{nome}_bucket{_rotulos(nomes_rotulos, rotulos, le)} {acumulado}')
+            le = 'le="+Inf"'
+            linhas.append(f'{nome}_bucket{_rotulos(nomes_rotulos, rotulos, le)} {valores[-2]}')
+            linhas.append(f'{nome}_count{_rotulos(nomes_rotulos, rotulos)} {valores[-2]}')
+            linhas.append(f'{nome}_sum{_rotulos(nomes_rotulos, rotulos)} {valores[-1]}')
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,284 @@
+# notificacoes.py - Envio assíncrono de notificações (e-mail e webhook) sobre os chamados
+#
+# As notificações não são enviadas durante a requisição. Triggers criadas na migração 012 gravam uma linha
+# na tabela `notificacoes` (a "caixa de saída") na mesma transação em que o chamado é aberto ou recebe um
+# evento (captura, mudança de status, nota, reatribuição, reabertura). Uma thread de fundo de cada worker
+# (ver `iniciar`) reserva lotes de notificações pendentes e as entrega num pool de threads; as que falham são
+# repetidas com espera exponencial, até MAXIMO_TENTATIVAS.
+#
+# Configuração (variáveis de ambiente): SMTP_HOST, SMTP_PORT, SMTP_USUARIO, SMTP_SENHA, SMTP_TLS=1,
+# NOTIFICACOES_REMETENTE, NOTIFICACOES_WEBHOOK_URL e NOTIFICACOES_URL_BASE (endereço do sistema, usado no
+# link do e-mail). Sem SMTP_HOST nem webhook, nada é enviado e a fila só é marcada como entregue.
+#
+# Para testar localmente com um servidor SMTP de depuração (imprime as mensagens no terminal):
+#
+#     python -m aiosmtpd -n -l localhost:1025   (até o Python 3.11: python -m smtpd -n -c DebuggingServer localhost:1025)
+#     SMTP_HOST=localhost SMTP_PORT=1025 python database.py notificar
+
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 50
+MAXIMO_TENTATIVAS = 8
+ESPERA_INICIAL_S = 30
+ESPERA_MAXIMA_S = 3600
+# Tempo pelo qual um lote fica reservado para um worker; se ele cair no meio do envio, outro assume depois
+RESERVA_S = 300
+TIMEOUT_S = 10
+
+ASSUNTOS = {
+    'abertura': 'Chamado #{id} registrado',
+    'captura': 'Chamado #{id} em atendimento',
+    'status': 'Chamado #{id} atualizado: {status}',
+    'nota': 'Nova atualização no chamado #{id}',
+    'atribuicao': 'Chamado #{id} com novo responsável',
+    'reabertura': 'Chamado #{id} reaberto',
+}
+
+PENDENTES_QUERY = """
+    SELECT n.id, n.tipo, n.tentativas, n.email_enviado_em, n.webhook_enviado_em,
+           c.id as chamado_id, c.solicitante_email, c.municipio, s.nome as status_nome,
+           tp.nome as tipo_problema_nome, u.responsavel as admin_responsavel_nome,
+           COALESCE(ev.timestamp, n.criado_em) as evento_timestamp, ev.autor_nome, ev.texto,
+           COALESCE(sn.nome, s.nome) as status_evento_nome
+    FROM notificacoes n
+    JOIN chamados c ON n.chamado_id = c.id
+    JOIN status s ON c.status_id = s.id
+    JOIN tipos_problema tp ON c.tipo_problema_id = tp.id
+    LEFT JOIN users u ON c.admin_responsavel_id = u.id
+    LEFT JOIN chamado_eventos ev ON n.evento_id = ev.id
+    LEFT JOIN status sn ON ev.status_novo_id = sn.id
+    WHERE n.id IN ({marcadores})
+    ORDER BY n.id
+"""
+
+
+@dataclass(frozen=True)
+class Configuracao:
+    smtp_host: str = ''
+    smtp_port: int = 25
+    smtp_usuario: str = ''
+    smtp_senha: str = ''
+    smtp_tls: bool = False
+    remetente: str = 'chamados@localhost'
+    webhook_url: str = ''
+    url_base: str = ''
+    threads: int = 4
+
+    @classmethod
+    def do_ambiente(cls):
+        return cls(smtp_host=os.environ.get('SMTP_HOST', ''),
+                   smtp_port=int(os.environ.get('SMTP_PORT', 25)),
+                   smtp_usuario=os.environ.get('SMTP_USUARIO', ''),
+                   smtp_senha=os.environ.get('SMTP_SENHA', ''),
+                   smtp_tls=os.environ.get('SMTP_TLS') == '1',
+                   remetente=os.environ.get('NOTIFICACOES_REMETENTE', 'chamados@localhost'),
+                   webhook_url=os.environ.get('NOTIFICACOES_WEBHOOK_URL', ''),
+                   url_base=os.environ.get('NOTIFICACOES_URL_BASE', ''),
+                   threads=int(os.environ.get('NOTIFICACOES_THREADS', 4)))
+
+    @property
+    def canais(self):
+        """Canais configurados (os demais são ignorados)."""
+        return [canal for canal, ativo in (('email', self.smtp_host), ('webhook', self.webhook_url)) if ativo]
+
+
+def _agora():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _reservar(db, lote):
+    """Reserva até `lote` notificações vencidas para este processo. Devolve os ids."""
+    agora = datetime.now()
+    reservado_ate = (agora + timedelta(seconds=RESERVA_S)).strftime('%Y-%m-%d %H:%M:%S')
+    agora = agora.strftime('%Y-%m-%d %H:%M:%S')
+    # SELECT e UPDATE na mesma transação de escrita (BEGIN IMMEDIATE): dois workers nunca reservam a mesma
+    # notificação. UPDATE ... RETURNING faria isso num comando só, mas exige SQLite 3.35.
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        ids = [r[0] for r in db.execute("""
+            SELECT id FROM notificacoes
+            WHERE enviado_em IS NULL AND falhou_em IS NULL AND proxima_tentativa_em <= ?
+              AND (reservado_ate IS NULL OR reservado_ate <= ?)
+            ORDER BY proxima_tentativa_em
+            LIMIT ?
+        """, (agora, agora, lote))]
+        if ids:
+            db.execute(f"UPDATE notificacoes SET reservado_ate = ? WHERE id IN ({', '.join('?' for _ in ids)})",
+                       (reservado_ate, *ids))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return ids
+
+
+def _montar_email(notificacao, config):
+    mensagem = EmailMessage()
+    mensagem['From'] = config.remetente
+    mensagem['To'] = notificacao['solicitante_email']
+    mensagem['Subject'] = ASSUNTOS.get(notificacao['tipo'], 'Chamado #{id}').format(
+        id=notificacao['chamado_id'], status=notificacao['status_evento_nome'])
+    linhas = [f"Chamado #{notificacao['chamado_id']} ({notificacao['tipo_problema_nome']}, {notificacao['municipio']})",
+              f"Status atual: {notificacao['status_nome']}"]
+    if notificacao['admin_responsavel_nome']:
+        linhas.append(f"Responsável: {notificacao['admin_responsavel_nome']}")
+    if notificacao['texto']:
+        linhas += ['', f"{notificacao['autor_nome'] or 'Sistema'} escreveu:", notificacao['texto']]
+    if config.url_base:
+        linhas += ['', f"Acompanhe em {config.url_base.rstrip('/')}/meus_chamados"]
+    mensagem.set_content('\n'.join(linhas))
+    return mensagem
+
+
+def _payload_webhook(notificacao):
+    return {
+        'evento': notificacao['tipo'],
+        'chamado_id': notificacao['chamado_id'],
+        'status': notificacao['status_nome'],
+        'tipo_problema': notificacao['tipo_problema_nome'],
+        'municipio': notificacao['municipio'],
+        'solicitante': notificacao['solicitante_email'],
+        'responsavel': notificacao['admin_responsavel_nome'],
+        'autor': notificacao['autor_nome'],
+        'texto': notificacao['texto'],
+        'timestamp': notificacao['evento_timestamp'],
+    }
+
+
+def _enviar_emails(notificacoes, config):
+    """Envia os e-mails de uma parte do lote por uma única conexão SMTP. Devolve {id: erro ou None}."""
+    resultados = {}
+    try:
+        with smtplib.SMTP(config.smtp_host, config.smtp_port, timeout=TIMEOUT_S) as smtp:
+            if config.smtp_tls:
+                smtp.starttls()
+            if config.smtp_usuario:
+                smtp.login(config.smtp_usuario, config.smtp_senha)
+            for notificacao in notificacoes:
+                try:
+                    smtp.send_message(_montar_email(notificacao, config))
+                    resultados[notificacao['id']] = None
+                except smtplib.SMTPRecipientsRefused as e:
+                    resultados[notificacao['id']] = f'e-mail: {e}'
+    except (OSError, smtplib.SMTPException) as e:
+        for notificacao in notificacoes:
+            resultados.setdefault(notificacao['id'], f'e-mail: {e}')
+    return resultados
+
+
+def _enviar_webhook(notificacao, config):
+    requisicao = urllib.request.Request(
+        config.webhook_url, data=json.dumps(_payload_webhook(notificacao)).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(requisicao, timeout=TIMEOUT_S):
+            return None
+    except OSError as e:
+        return f'webhook: {e}'
+
+
+def _entregar(notificacoes, config, executor):
+    """Entrega as notificações pelos canais que ainda faltam. Devolve {id: {canal: erro ou None}}."""
+    resultados = {n['id']: {} for n in notificacoes}
+    futuros = []
+    if 'email' in config.canais:
+        faltando = [n for n in notificacoes if not n['email_enviado_em']]
+        # Divide o lote entre as threads; cada parte usa uma conexão SMTP
+        partes = [faltando[i::config.threads] for i in range(config.threads)]
+        futuros += [('email', executor.submit(_enviar_emails, parte, config)) for parte in partes if parte]
+    if 'webhook' in config.canais:
+        futuros += [('webhook', executor.submit(lambda n=n: {n['id']: _enviar_webhook(n, config)}))
+                    for n in notificacoes if not n['webhook_enviado_em']]
+    for canal, futuro in futuros:
+        for notificacao_id, erro in futuro.result().items():
+            resultados[notificacao_id][canal] = erro
+    return resultados
+
+
+def _registrar_resultados(db, notificacoes, resultados):
+    agora = _agora()
+    for notificacao in notificacoes:
+        por_canal = resultados[notificacao['id']]
+        enviados = {canal: agora for canal, erro in por_canal.items() if erro is None}
+        erros = [erro for erro in por_canal.values() if erro]
+        email_em = notificacao['email_enviado_em'] or enviados.get('email')
+        webhook_em = notificacao['webhook_enviado_em'] or enviados.get('webhook')
+        if not erros:
+            db.execute('UPDATE notificacoes SET email_enviado_em = ?, webhook_enviado_em = ?, enviado_em = ?, '
+                       'reservado_ate = NULL, ultimo_erro = NULL WHERE id = ?',
+                       (email_em, webhook_em, agora, notificacao['id']))
+            continue
+        tentativas = notificacao['tentativas'] + 1
+        espera = min(ESPERA_INICIAL_S * 2 ** (tentativas - 1), ESPERA_MAXIMA_S)
+        proxima = (datetime.now() + timedelta(seconds=espera)).strftime('%Y-%m-%d %H:%M:%S')
+        db.execute('UPDATE notificacoes SET email_enviado_em = ?, webhook_enviado_em = ?, tentativas = ?, '
+                   'proxima_tentativa_em = ?, reservado_ate = NULL, ultimo_erro = ?, falhou_em = ? WHERE id = ?',
+                   (email_em, webhook_em, tentativas, proxima, '; '.join(erros),
+                    agora if tentativas >= MAXIMO_TENTATIVAS else None, notificacao['id']))
+    db.commit()
+
+
+def processar_fila(db, config, lote=TAMANHO_LOTE):
+    """Entrega as notificações pendentes, em lotes, até a fila de vencidas esvaziar. Devolve (enviadas, falhas)."""
+    enviadas = falhas = 0
+    with ThreadPoolExecutor(max_workers=max(1, config.threads), thread_name_prefix='notificacoes') as executor:
+        while True:
+            ids = _reservar(db, lote)
+            if not ids:
+                break
+            notificacoes = db.execute(PENDENTES_QUERY.format(marcadores=', '.join('?' for _ in ids)), ids).fetchall()
+            resultados = _entregar(notificacoes, config, executor)
+            _registrar_resultados(db, notificacoes, resultados)
+            com_erro = sum(1 for r in resultados.values() if any(r.values()))
+            enviadas += len(notificacoes) - com_erro
+            falhas += com_erro
+    return enviadas, falhas
+
+
+_thread = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _executar_periodicamente(conectar, intervalo, config):
+    while True:
+        try:
+            db = conectar()
+            try:
+                enviadas, falhas = processar_fila(db, config)
+            finally:
+                db.close()
+            if enviadas or falhas:
+                logger.info('%d notificação(ões) enviada(s), %d com falha.', enviadas, falhas)
+        except Exception:
+            logger.exception('Falha ao processar a fila de notificações.')
+        time.sleep(intervalo)
+
+
+def iniciar(conectar, intervalo, config):
+    """Inicia (uma vez por processo) a thread que entrega as notificações a cada `intervalo` segundos.
+
+    Com `intervalo` <= 0 nada é iniciado, e a entrega fica a cargo do comando `python database.py notificar`.
+    """
+    global _thread, _pid
+    if intervalo <= 0 or (_thread is not None and _pid == os.getpid()):
+        return
+    with _lock:
+        if _thread is not None and _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        _thread = threading.Thread(target=_executar_periodicamente, args=(conectar, intervalo, config),
+                                   name='notificacoes-chamados', daemon=True)
+        _thread.start()
@@ -0,0 +1,67 @@
+# perfis.py - Cache em memória do perfil do usuário logado
+#
+# load_logged_in_user lia a linha do usuário em toda requisição (inclusive /static e /uploads). Agora cada
+# worker guarda os perfis usados mais recentemente num LRU limitado a CAPACIDADE entradas, cada uma válida
+# por `ttl` segundos. Triggers criadas na migração 011 incrementam a linha 'usuarios' da tabela `versoes` a
+# cada escrita em users; cada worker confere esse número no máximo a cada INTERVALO_VERIFICACAO segundos e,
+# se ele mudou, descarta o cache inteiro.
+#
+# A sessão guarda a versão mínima que o próprio usuário precisa enxergar (ver `versao_minima` em `obter`):
+# depois de redefinir a senha, a próxima requisição não pode cair num worker com o perfil antigo.
+
+import threading
+import time
+from collections import OrderedDict
+
+from lookups import versao_atual
+
+VERSAO_USUARIOS = 'usuarios'
+CAPACIDADE = 1000
+INTERVALO_VERIFICACAO = 2
+PERFIL_QUERY = 'SELECT id, email, municipio, responsavel, is_admin, must_reset_password FROM users WHERE id = ?'
+
+_perfis = OrderedDict()
+_versao = None
+_verificado_em = 0.0
+_lock = threading.Lock()
+
+
+def _conferir_versao(conectar, agora, versao_minima):
+    global _versao, _verificado_em
+    if agora - _verificado_em < INTERVALO_VERIFICACAO and (_versao or 0) >= versao_minima:
+        return
+    versao = versao_atual(conectar(), VERSAO_USUARIOS)
+    with _lock:
+        if versao != _versao:
+            _perfis.clear()
+            _versao = versao
+        _verificado_em = agora
+
+
+def obter(conectar, user_id, ttl, versao_minima=0):
+    """Perfil (dict) do usuário `user_id`, ou None se ele não existe mais.
+
+    `conectar` devolve a conexão da requisição e só é chamada quando o banco precisa ser consultado.
+    """
+    agora = time.monotonic()
+    _conferir_versao(conectar, agora, versao_minima)
+    with _lock:
+        entrada = _perfis.get(user_id)
+        if entrada is not None and entrada[1] > agora:
+            _perfis.move_to_end(user_id)
+            return entrada[0]
+
+    row = conectar().execute(PERFIL_QUERY, (user_id,)).fetchone()
+    perfil = dict(row) if row else None
+    with _lock:
+        _perfis[user_id] = (perfil, agora + ttl)
+        _perfis.move_to_end(user_id)
+        while len(_perfis) > CAPACIDADE:
+            _perfis.popitem(last=False)
+    return perfil
+
+
+def invalidar(user_id):
+    """Descarta o perfil deste processo (as triggers já cuidam dos demais workers)."""
+    with _lock:
+        _perfis.pop(user_id, None)
@@ -0,0 +1,41 @@
+# Testes da linha de comando de database.py (executada como script, num diretório temporário)
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+DATABASE_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database.py')
+
+
+class LinhaDeComandoTest(unittest.TestCase):
+    def executar(self, pasta, *argumentos):
+        return subprocess.run([sys.executable, DATABASE_PY, *argumentos], cwd=pasta, capture_output=True,
+                              text=True, timeout=60)
+
+    def test_db_relativo_sem_pasta(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            resultado = self.executar(pasta, '--db', 'teste.db', '--planilha', 'nao_existe.xlsx', 'init')
+            self.assertEqual(resultado.returncode, 0, resultado.stderr)
+            caminho = os.path.join(pasta, 'teste.db')
+            self.assertTrue(os.path.exists(caminho))
+
+            resultado = self.executar(pasta, '--db', 'teste.db', 'migrate')
+            self.assertEqual(resultado.returncode, 0, resultado.stderr)
+            conn = sqlite3.connect(caminho)
+            try:
+                self.assertGreater(conn.execute('SELECT COUNT(*) FROM status').fetchone()[0], 0)
+            finally:
+                conn.close()
+
+    def test_db_relativo_em_subpasta_nova(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            resultado = self.executar(pasta, '--db', os.path.join('dados', 'teste.db'), 'migrate')
+            self.assertEqual(resultado.returncode, 0, resultado.stderr)
+            self.assertTrue(os.path.exists(os.path.join(pasta, 'dados', 'teste.db')))
+
+
+if __name__ == '__main__':
+    unittest.main()